@@ -5,12 +5,12 @@ from core_data_modules.cleaners.cleaning_utils import CleaningUtils
 from core_data_modules.data_models.code_scheme import CodeTypes
 from core_data_modules.traced_data.util.fold_traced_data import FoldStrategies
 from core_data_modules.util import SHAUtils, TimeUtils
-from dateutil.parser import isoparse
 from social_media_tools.facebook import facebook_utils
 
 from configuration import code_imputation_functions
 from configuration.code_schemes import CodeSchemes
 from src.lib.configuration_objects import CodingConfiguration, CodingModes, CodingPlan
+from src.lib.timestamp_cache import timestamps
 
 
 def clean_age_with_range_filter(text):
@@ -73,7 +73,7 @@ def clean_engagement_type(sent_on, episode):
     ]
 
     for time_range in time_ranges:
-        if episode == time_range[0] and isoparse(time_range[2]) <= sent_on < isoparse(time_range[3]):
+        if episode == time_range[0] and timestamps.parse(time_range[2]) <= sent_on < timestamps.parse(time_range[3]):
             return time_range[1]
 
     return Codes.TRUE_MISSING
@@ -400,7 +400,7 @@ def get_engagement_coding_plans(pipeline_name):
                            CodingConfiguration(
                                coding_mode=CodingModes.SINGLE,
                                code_scheme=CodeSchemes.ENGAGEMENT_TYPE,
-                               cleaner=lambda sent_on: clean_engagement_type(isoparse(sent_on), "rqa_s08e01"),
+                               cleaner=lambda sent_on: clean_engagement_type(timestamps.parse(sent_on), "rqa_s08e01"),
                                coded_field="rqa_s08e01_engagement_type_coded",
                                analysis_file_key="rqa_s08e01_engagement_type",
                                fold_strategy=partial(fold_engagement_type, CodeSchemes.ENGAGEMENT_TYPE),
@@ -415,7 +415,7 @@ def get_engagement_coding_plans(pipeline_name):
                            CodingConfiguration(
                                coding_mode=CodingModes.SINGLE,
                                code_scheme=CodeSchemes.ENGAGEMENT_TYPE,
-                               cleaner=lambda sent_on: clean_engagement_type(isoparse(sent_on), "rqa_s08e02"),
+                               cleaner=lambda sent_on: clean_engagement_type(timestamps.parse(sent_on), "rqa_s08e02"),
                                coded_field="rqa_s08e02_engagement_type_coded",
                                analysis_file_key="rqa_s08e02_engagement_type",
                                fold_strategy=partial(fold_engagement_type, CodeSchemes.ENGAGEMENT_TYPE),
@@ -430,7 +430,7 @@ def get_engagement_coding_plans(pipeline_name):
                            CodingConfiguration(
                                coding_mode=CodingModes.SINGLE,
                                code_scheme=CodeSchemes.ENGAGEMENT_TYPE,
-                               cleaner=lambda sent_on: clean_engagement_type(isoparse(sent_on), "rqa_s08e03"),
+                               cleaner=lambda sent_on: clean_engagement_type(timestamps.parse(sent_on), "rqa_s08e03"),
                                coded_field="rqa_s08e03_engagement_type_coded",
                                analysis_file_key="rqa_s08e03_engagement_type",
                                fold_strategy=partial(fold_engagement_type, CodeSchemes.ENGAGEMENT_TYPE),
@@ -445,7 +445,8 @@ def get_engagement_coding_plans(pipeline_name):
                            CodingConfiguration(
                                coding_mode=CodingModes.SINGLE,
                                code_scheme=CodeSchemes.ENGAGEMENT_TYPE,
-                               cleaner=lambda sent_on: clean_engagement_type(isoparse(sent_on), "rqa_s08e03_break"),
+                               cleaner=lambda sent_on: clean_engagement_type(timestamps.parse(sent_on),
+                                                                             "rqa_s08e03_break"),
                                coded_field="rqa_s08e03_break_engagement_type_coded",
                                analysis_file_key="rqa_s08e03_break_engagement_type",
                                fold_strategy=partial(fold_engagement_type, CodeSchemes.ENGAGEMENT_TYPE),
@@ -460,7 +461,7 @@ def get_engagement_coding_plans(pipeline_name):
                            CodingConfiguration(
                                coding_mode=CodingModes.SINGLE,
                                code_scheme=CodeSchemes.ENGAGEMENT_TYPE,
-                               cleaner=lambda sent_on: clean_engagement_type(isoparse(sent_on), "rqa_s08e04"),
+                               cleaner=lambda sent_on: clean_engagement_type(timestamps.parse(sent_on), "rqa_s08e04"),
                                coded_field="rqa_s08e04_engagement_type_coded",
                                analysis_file_key="rqa_s08e04_engagement_type",
                                fold_strategy=partial(fold_engagement_type, CodeSchemes.ENGAGEMENT_TYPE),
@@ -475,7 +476,7 @@ def get_engagement_coding_plans(pipeline_name):
                            CodingConfiguration(
                                coding_mode=CodingModes.SINGLE,
                                code_scheme=CodeSchemes.ENGAGEMENT_TYPE,
-                               cleaner=lambda sent_on: clean_engagement_type(isoparse(sent_on), "rqa_s08e05"),
+                               cleaner=lambda sent_on: clean_engagement_type(timestamps.parse(sent_on), "rqa_s08e05"),
                                coded_field="rqa_s08e05_engagement_type_coded",
                                analysis_file_key="rqa_s08e05_engagement_type",
                                fold_strategy=partial(fold_engagement_type, CodeSchemes.ENGAGEMENT_TYPE),
@@ -490,7 +491,7 @@ def get_engagement_coding_plans(pipeline_name):
                            CodingConfiguration(
                                coding_mode=CodingModes.SINGLE,
                                code_scheme=CodeSchemes.ENGAGEMENT_TYPE,
-                               cleaner=lambda sent_on: clean_engagement_type(isoparse(sent_on), "rqa_s08e06"),
+                               cleaner=lambda sent_on: clean_engagement_type(timestamps.parse(sent_on), "rqa_s08e06"),
                                coded_field="rqa_s08e06_engagement_type_coded",
                                analysis_file_key="rqa_s08e06_engagement_type",
                                fold_strategy=partial(fold_engagement_type, CodeSchemes.ENGAGEMENT_TYPE),
@@ -11,6 +11,9 @@ while [[ $# -gt 0 ]]; do
             PROFILE_CPU=true
             CPU_PROFILE_OUTPUT_PATH="$2"
             shift 2;;
+        --uuid-table-cache-path)
+            UUID_TABLE_CACHE_PATH="$2"
+            shift 2;;
         --)
             shift
             break;;
@@ -22,7 +25,7 @@ done
 # Check that the correct number of arguments were provided.
 if [[ $# -ne 5 ]]; then
     echo "Usage: ./docker-run-fetch-raw-data.sh
-    [--profile-cpu <profile-output-path>]
+    [--profile-cpu <profile-output-path>] [--uuid-table-cache-path <uuid-table-cache-path>]
     <user> <google-cloud-credentials-file-path> <pipeline-configuration-file-path>
     <raw-data-dir> <metrics-dir>"
     exit
@@ -43,7 +46,11 @@ if [[ "$PROFILE_CPU" = true ]]; then
     PROFILE_CPU_CMD="-m pyinstrument -o /data/cpu.prof --renderer html --"
     SYS_PTRACE_CAPABILITY="--cap-add SYS_PTRACE"
 fi
-CMD="pipenv run python -u $PROFILE_CPU_CMD fetch_raw_data.py \
+if [[ "$UUID_TABLE_CACHE_PATH" != "" ]]; then
+    # Keep the cache outside of /data, because it contains the identifiable data the uuid table de-identifies.
+    UUID_TABLE_CACHE_ARG="--uuid-table-cache-path /cache/uuid-table-cache.sqlite"
+fi
+CMD="pipenv run python -u $PROFILE_CPU_CMD fetch_raw_data.py $UUID_TABLE_CACHE_ARG \
     \"$USER\" /credentials/google-cloud-credentials.json \
     /data/pipeline-configuration.json /data/Raw\ Data /data/Metrics
 "
@@ -62,10 +69,21 @@ mkdir -p "$OUTPUT_RAW_DATA_DIR"
 echo "Copying $OUTPUT_RAW_DATA_DIR/. -> $container_short_id:/data/Raw Data/"
 docker cp "$OUTPUT_RAW_DATA_DIR/." "$container:/data/Raw Data/"
 
+if [[ -f "$UUID_TABLE_CACHE_PATH" ]]; then
+    echo "Copying $UUID_TABLE_CACHE_PATH -> $container_short_id:/cache/uuid-table-cache.sqlite"
+    docker cp "$UUID_TABLE_CACHE_PATH" "$container:/cache/uuid-table-cache.sqlite"
+fi
+
 # Run the container
 echo "Starting container $container_short_id"
 docker start -a -i "$container"
 
+if [[ "$UUID_TABLE_CACHE_PATH" != "" ]]; then
+    echo "Copying $container_short_id:/cache/uuid-table-cache.sqlite -> $UUID_TABLE_CACHE_PATH"
+    mkdir -p "$(dirname "$UUID_TABLE_CACHE_PATH")"
+    docker cp "$container:/cache/uuid-table-cache.sqlite" "$UUID_TABLE_CACHE_PATH"
+fi
+
 # Copy the output data back out of the container
 echo "Copying $container_short_id:/data/Raw Data/. -> $OUTPUT_RAW_DATA_DIR"
 docker cp "$container:/data/Raw Data/." "$OUTPUT_RAW_DATA_DIR"
@@ -15,6 +15,9 @@ while [[ $# -gt 0 ]]; do
             PROFILE_MEMORY=true
             MEMORY_PROFILE_OUTPUT_PATH="$2"
             shift 2;;
+        --loaded-raw-data-cache-dir)
+            LOADED_RAW_DATA_CACHE_DIR="$2"
+            shift 2;;
         --)
             shift
             break;;
@@ -28,6 +31,7 @@ done
 if [[ $# -ne 13 ]]; then
     echo "Usage: ./docker-run-generate-outputs.sh
     [--profile-cpu <profile-output-path>] [--profile-memory <profile-output-path>]
+    [--loaded-raw-data-cache-dir <loaded-raw-data-cache-dir>]
     <user> <pipeline-run-mode> <pipeline-configuration-file-path>
     <raw-data-dir> <prev-coded-dir> <messages-json-output-path> <individuals-json-output-path>
     <icr-output-dir> <coded-output-dir> <messages-output-csv> <individuals-output-csv> <production-output-csv>"
@@ -60,7 +64,10 @@ fi
 if [[ "$PROFILE_MEMORY" = true ]]; then
     PROFILE_MEMORY_CMD="mprof run -o /data/memory.prof"
 fi
-CMD="pipenv run $PROFILE_MEMORY_CMD python -u $PROFILE_CPU_CMD generate_outputs.py \
+if [[ "$LOADED_RAW_DATA_CACHE_DIR" != "" ]]; then
+    LOADED_RAW_DATA_CACHE_ARG="--loaded-raw-data-cache-dir /data/loaded-raw-data-cache"
+fi
+CMD="pipenv run $PROFILE_MEMORY_CMD python -u $PROFILE_CPU_CMD generate_outputs.py $LOADED_RAW_DATA_CACHE_ARG \
     \"$USER\" \"$PIPELINE_RUN_MODE\" /data/pipeline_configuration.json /data/raw-data /data/prev-coded \
      /data/auto-coding-traced-data.jsonl /data/output-messages.jsonl /data/output-individuals.jsonl /data/output-icr /data/coded \
     /data/output-messages.csv /data/output-individuals.csv /data/output-production.csv \
@@ -83,11 +90,24 @@ else
     echo "WARNING: prev-coded-dir $PREV_CODED_DIR not found, ignoring"  # TODO: Stop allowing this to be optional.
 fi
 
+if [[ -d "$LOADED_RAW_DATA_CACHE_DIR" ]]; then
+    echo "Copying $LOADED_RAW_DATA_CACHE_DIR -> $container_short_id:/data/loaded-raw-data-cache"
+    docker cp "$LOADED_RAW_DATA_CACHE_DIR" "$container:/data/loaded-raw-data-cache"
+fi
+
 # Run the container
 echo "Starting container $container_short_id"
 docker start -a -i "$container"
 
 # Copy the output data back out of the container
+if [[ "$LOADED_RAW_DATA_CACHE_DIR" != "" ]]; then
+    echo "Copying $container_short_id:/data/loaded-raw-data-cache/. -> $LOADED_RAW_DATA_CACHE_DIR"
+    mkdir -p "$LOADED_RAW_DATA_CACHE_DIR"
+    # Replace the previous snapshot rather than accumulating snapshots for out of date raw data.
+    rm -f "$LOADED_RAW_DATA_CACHE_DIR"/*.pickle
+    docker cp "$container:/data/loaded-raw-data-cache/." "$LOADED_RAW_DATA_CACHE_DIR"
+fi
+
 echo "Copying $container_short_id:/data/output-icr/. -> $OUTPUT_ICR_DIR"
 mkdir -p "$OUTPUT_ICR_DIR"
 docker cp "$container:/data/output-icr/." "$OUTPUT_ICR_DIR"
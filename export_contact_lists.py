@@ -11,6 +11,7 @@ from storage.google_cloud import google_cloud_utils
 
 from configuration.code_schemes import CodeSchemes
 from src.lib import PipelineConfiguration
+from src.lib.cached_uuid_table import CachedUuidTable
 
 log = Logger(__name__)
 
@@ -20,6 +21,11 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generates lists of phone numbers of previous CSAP respondents who  "
                                                  "were labelled as living in one of the target locations")
 
+    parser.add_argument("--uuid-table-cache-path", metavar="uuid-table-cache-path",
+                        help="Path to a local SQLite database to cache the uuid table's mappings in, so that ids "
+                             "which have been re-identified before aren't requested again. The cache contains the "
+                             "identifiable data (e.g. phone numbers) in plain text, so it must be kept outside of the "
+                             "data root and protected like the uuid table itself")
     parser.add_argument("google_cloud_credentials_file_path", metavar="google-cloud-credentials-file-path",
                         help="Path to a Google Cloud service account credentials file to use to access the "
                              "credentials bucket")
@@ -34,6 +40,7 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
+    uuid_table_cache_path = args.uuid_table_cache_path
     google_cloud_credentials_file_path = args.google_cloud_credentials_file_path
     pipeline_configuration_file_path = args.pipeline_configuration_file_path
     traced_data_paths = args.traced_data_paths
@@ -58,6 +65,10 @@ if __name__ == "__main__":
     )
     log.info("Initialised the Firestore UUID table")
 
+    if uuid_table_cache_path is not None:
+        phone_number_uuid_table = CachedUuidTable(
+            phone_number_uuid_table, pipeline_configuration.phone_number_uuid_table.table_name, uuid_table_cache_path)
+
     uuids = set()
     location_counts = {location: 0 for location in TARGET_LOCATIONS}
     for path in traced_data_paths:
@@ -90,6 +101,8 @@ if __name__ == "__main__":
     # Convert the uuids to phone numbers
     log.info(f"Converting {len(uuids)} uuids to phone numbers...")
     uuid_phone_number_lut = phone_number_uuid_table.uuid_to_data_batch(uuids)
+    if uuid_table_cache_path is not None:
+        phone_number_uuid_table.log_stats()
     phone_numbers = set()
     skipped_uuids = set()
     for uuid in uuids:
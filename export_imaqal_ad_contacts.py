@@ -9,6 +9,8 @@ from core_data_modules.logging import Logger
 from id_infrastructure.firestore_uuid_table import FirestoreUuidTable
 from storage.google_cloud import google_cloud_utils
 
+from src.lib.cached_uuid_table import CachedUuidTable
+
 log = Logger(__name__)
 
 if __name__ == "__main__":
@@ -17,6 +19,11 @@ if __name__ == "__main__":
 
     parser.add_argument("--exclusion-list-file-path", nargs="?",
                         help="List of phone numbers to exclude from the ad group")
+    parser.add_argument("--uuid-table-cache-path", metavar="uuid-table-cache-path",
+                        help="Path to a local SQLite database to cache the uuid table's mappings in, so that ids "
+                             "which have been re-identified before aren't requested again. The cache contains the "
+                             "identifiable data (e.g. phone numbers) in plain text, so it must be kept outside of the "
+                             "data root and protected like the uuid table itself")
     parser.add_argument("google_cloud_credentials_file_path", metavar="google-cloud-credentials-file-path",
                         help="Path to a Google Cloud service account credentials file to use to access the "
                              "credentials bucket")
@@ -33,6 +40,7 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
+    uuid_table_cache_path = args.uuid_table_cache_path
     exclusion_list_file_path = args.exclusion_list_file_path
     google_cloud_credentials_file_path = args.google_cloud_credentials_file_path
     firebase_credentials_file_url = args.firebase_credentials_file_url
@@ -53,6 +61,9 @@ if __name__ == "__main__":
     )
     log.info("Initialised the Firestore UUID table")
 
+    if uuid_table_cache_path is not None:
+        phone_number_uuid_table = CachedUuidTable(phone_number_uuid_table, uuid_table_name, uuid_table_cache_path)
+
     all_uuids = set()
     banadir_uuids = set()
     sws_uuids = set()
@@ -111,6 +122,8 @@ if __name__ == "__main__":
     # Convert the uuids to phone numbers
     log.info(f"Converting {len(uuids)} uuids to phone numbers...")
     uuid_phone_number_lut = phone_number_uuid_table.uuid_to_data_batch(uuids)
+    if uuid_table_cache_path is not None:
+        phone_number_uuid_table.log_stats()
     phone_numbers = set()
     for uuid in uuids:
         phone_numbers.add(f"+{uuid_phone_number_lut[uuid]}")
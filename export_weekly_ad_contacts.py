@@ -10,6 +10,7 @@ from id_infrastructure.firestore_uuid_table import FirestoreUuidTable
 from storage.google_cloud import google_cloud_utils
 
 from src.lib import PipelineConfiguration
+from src.lib.cached_uuid_table import CachedUuidTable
 
 log = Logger(__name__)
 
@@ -19,6 +20,11 @@ if __name__ == "__main__":
 
     parser.add_argument("--exclusion-list-file-path", nargs="?",
                         help="List of phone numbers to exclude from the ad group")
+    parser.add_argument("--uuid-table-cache-path", metavar="uuid-table-cache-path",
+                        help="Path to a local SQLite database to cache the uuid table's mappings in, so that ids "
+                             "which have been re-identified before aren't requested again. The cache contains the "
+                             "identifiable data (e.g. phone numbers) in plain text, so it must be kept outside of the "
+                             "data root and protected like the uuid table itself")
     parser.add_argument("google_cloud_credentials_file_path", metavar="google-cloud-credentials-file-path",
                         help="Path to a Google Cloud service account credentials file to use to access the "
                              "credentials bucket")
@@ -33,6 +39,7 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
+    uuid_table_cache_path = args.uuid_table_cache_path
     exclusion_list_file_path = args.exclusion_list_file_path
     google_cloud_credentials_file_path = args.google_cloud_credentials_file_path
     pipeline_configuration_file_path = args.pipeline_configuration_file_path
@@ -60,6 +67,10 @@ if __name__ == "__main__":
     )
     log.info("Initialised the Firestore UUID table")
 
+    if uuid_table_cache_path is not None:
+        phone_number_uuid_table = CachedUuidTable(
+            phone_number_uuid_table, pipeline_configuration.uuid_table.table_name, uuid_table_cache_path)
+
     uuids = set()
     for path in traced_data_paths:
         # Load the traced data
@@ -95,6 +106,8 @@ if __name__ == "__main__":
     # Convert the uuids to phone numbers
     log.info(f"Converting {len(uuids)} uuids to phone numbers...")
     uuid_phone_number_lut = phone_number_uuid_table.uuid_to_data_batch(uuids)
+    if uuid_table_cache_path is not None:
+        phone_number_uuid_table.log_stats()
     phone_numbers = set()
     skipped_uuids = set()
     for uuid in uuids:
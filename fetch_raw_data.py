@@ -1,9 +1,12 @@
 import argparse
 import csv
 import json
-import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from io import StringIO
+from functools import partial
+from io import StringIO, TextIOWrapper
+from itertools import islice
 
 import pytz
 from core_data_modules.cleaners import Codes, PhoneCleaner
@@ -16,14 +19,34 @@ from id_infrastructure.firestore_uuid_table import FirestoreUuidTable
 from rapid_pro_tools.rapid_pro_client import RapidProClient
 from social_media_tools.facebook import FacebookClient, facebook_utils
 from storage.google_cloud import google_cloud_utils
-from temba_client.v2 import Contact, Run
 
 from src.lib import PipelineConfiguration
+from src.lib.bucket_downloads import BlobDownloadManager, GoogleCloudBucket
+from src.lib.cached_facebook_client import CachedFacebookClient
+from src.lib.cached_uuid_table import CachedUuidTable
+from src.lib.compressed_files import atomic_write, find_file, open_file, with_compression
+from src.lib.facebook_comments_sync import FacebookCommentsSync
 from src.lib.pipeline_configuration import RapidProSource, GCloudBucketSource, RecoveryCSVSource, FacebookSource
+from src.lib.rapid_pro_contacts import RapidProContactsSync
+from src.lib.rate_limiter import TokenBucketRateLimiter
+from src.lib.raw_runs_store import RawRunsStore
+from src.lib.source_scheduler import SourceScheduler
+from src.lib.throttled_facebook_client import ThrottledFacebookClient
+from src.lib.traced_data_conversion_cache import TracedDataConversionCache
 from configuration.code_imputation_functions import CodeSchemes
 
 log = Logger(__name__)
 
+MOGADISHU_TIMEZONE = pytz.timezone("Africa/Mogadishu")
+
+# Number of recovery CSV rows to convert and export at a time.
+RECOVERY_CSV_CHUNK_SIZE = 10000
+
+FACEBOOK_METRICS_HEADERS = [
+    "Page ID", "Dataset", "Post URL", "Post Created Time", "Post Text", "Post Type", "Post Impressions",
+    "Unique Post Impressions", "Post Engaged Users", "Total Comments", "Visible (analysed) Comments", "Reactions"
+]
+
 
 def label_somalia_operator(user, traced_runs, phone_number_uuid_table):
     # Set the operator codes for each message.
@@ -55,8 +78,174 @@ def label_somalia_operator(user, traced_runs, phone_number_uuid_table):
         }, Metadata(user, Metadata.get_call_location(), TimeUtils.utc_now_as_iso_string()))
 
 
+def run_conversion_key(run, contacts):
+    """
+    :param run: Run to get the TracedDataConversionCache key of.
+    :type run: temba_client.v2.Run
+    :param contacts: Contacts snapshot to look up the run's contact in.
+    :type contacts: src.lib.rapid_pro_contacts.ContactsSnapshot
+    :return: Cache key for this run, which changes whenever the run or its contact changes.
+    :rtype: tuple of (int, str, str | None)
+    """
+    return run.id, run.modified_on.isoformat(), contacts.modified_on(run.contact.uuid)
+
+
+def fetch_rapid_pro_flow(user, rapid_pro, raw_data_dir, phone_number_uuid_table, rapid_pro_source, flow,
+                         raw_contacts, compression=None):
+    """
+    Downloads the latest runs for a Rapid Pro flow, converts them to TracedData, and saves both the raw runs and the
+    traced runs to `raw_data_dir`. Raw runs are saved to a RawRunsStore, and traced runs are converted via a
+    TracedDataConversionCache, so only new or changed runs are written or converted.
+
+    Only the conversion to TracedData scales with the number of new or changed runs. Every stored run is still
+    deserialized, and every run's contact looked up, on each fetch, in order to find which runs changed.
+
+    This only writes to files which are specific to the given flow, so can be safely run in parallel with other flows
+    from the same workspace.
+
+    :param user: Identifier of the user running this program, for TracedData Metadata.
+    :type user: str
+    :param rapid_pro: Rapid Pro client to use to download the runs.
+    :type rapid_pro: rapid_pro_tools.rapid_pro_client.RapidProClient
+    :param raw_data_dir: Directory to read previous exports from and write the new exports to.
+    :type raw_data_dir: str
+    :param phone_number_uuid_table: Phone number <-> UUID table.
+    :type phone_number_uuid_table: id_infrastructure.firestore_uuid_table.FirestoreUuidTable
+    :param rapid_pro_source: Configuration for the Rapid Pro source this flow belongs to.
+    :type rapid_pro_source: src.lib.pipeline_configuration.RapidProSource
+    :param flow: Name of the flow to fetch.
+    :type flow: str
+    :param raw_contacts: Snapshot of the contacts in this workspace, to use when converting the runs to TracedData.
+    :type raw_contacts: src.lib.rapid_pro_contacts.ContactsSnapshot
+    :param compression: Compression format to write the raw data files in, or None to write them uncompressed.
+    :type compression: str | None
+    """
+    runs_log_path = with_compression(f"{raw_data_dir}/{flow}_log.jsonl", compression)
+    traced_runs_output_path = with_compression(f"{raw_data_dir}/{flow}.jsonl", compression)
+    log.info(f"Exporting flow '{flow}' to '{traced_runs_output_path}'...")
+
+    flow_id = rapid_pro.get_flow_id(flow)
+
+    raw_runs_store = RawRunsStore(raw_data_dir, flow, compression)
+    raw_runs_store.migrate_legacy_raw_runs_file()
+
+    # Load the previous export of runs for this flow, and update it with the runs modified since the previous export.
+    # If there is no previous export for this flow, fetch all the runs from Rapid Pro.
+    with open_file(runs_log_path, "a") as raw_runs_log_file:
+        if raw_runs_store.exists():
+            log.info(f"Loading raw runs from '{raw_runs_store.store_dir}'...")
+            raw_runs = raw_runs_store.load_runs()
+            log.info(f"Loaded {len(raw_runs)} runs")
+
+            latest_modified_on = raw_runs_store.latest_modified_on()
+            if latest_modified_on is None:
+                new_runs = rapid_pro.get_raw_runs_for_flow_id(
+                    flow_id, raw_export_log_file=raw_runs_log_file, ignore_archives=True)
+            else:
+                new_runs = rapid_pro.get_raw_runs_for_flow_id(
+                    flow_id, range_start_inclusive=latest_modified_on, raw_export_log_file=raw_runs_log_file,
+                    ignore_archives=True)
+
+            # The range start is inclusive, so the runs modified at exactly `latest_modified_on` are downloaded again.
+            # Drop any downloaded runs which are identical to the version already in the store.
+            stored_modified_ons = {run.id: run.modified_on for run in raw_runs}
+            new_runs = [run for run in new_runs if stored_modified_ons.get(run.id) != run.modified_on]
+        else:
+            log.info(f"No raw runs found in '{raw_runs_store.store_dir}', will fetch all runs from the Rapid Pro "
+                     f"server for flow '{flow}'")
+            raw_runs = []
+            new_runs = rapid_pro.get_raw_runs_for_flow_id(flow_id, raw_export_log_file=raw_runs_log_file)
+
+    # Persist only the new or changed runs.
+    log.info(f"Saving {len(new_runs)} new or updated raw runs to '{raw_runs_store.store_dir}'...")
+    raw_runs_store.append(new_runs)
+    raw_runs = RawRunsStore.merge_runs(raw_runs, new_runs)
+    log.info(f"Flow '{flow}' has {len(raw_runs)} raw runs")
+
+    # Convert the runs to TracedData. Runs which, along with their contact, are unchanged since the previous export
+    # re-use the TracedData exported then, so only new or changed runs need to be converted.
+    is_activation_flow = flow in rapid_pro_source.activation_flow_names
+    traced_runs_cache = TracedDataConversionCache(raw_data_dir, flow, {
+        "TestContactUUIDs": rapid_pro_source.test_contact_uuids,
+        "LabelSomaliaOperator": is_activation_flow
+    }, compression)
+    cached_lines = traced_runs_cache.load()
+    raw_contacts.preload(run.contact.uuid for run in raw_runs)
+    run_keys = [run_conversion_key(run, raw_contacts) for run in raw_runs]
+    runs_to_convert = [run for run, key in zip(raw_runs, run_keys) if key not in cached_lines]
+    log.info(f"Re-using the previous conversions of {len(raw_runs) - len(runs_to_convert)} runs; "
+             f"converting {len(runs_to_convert)} new or changed runs...")
+
+    converted_runs = convert_runs_to_traced_data_by_run_id(
+        user, rapid_pro, runs_to_convert, raw_contacts, phone_number_uuid_table, rapid_pro_source.test_contact_uuids)
+    if is_activation_flow:
+        label_somalia_operator(user, [td for td in converted_runs.values() if td is not None], phone_number_uuid_table)
+
+    for run in runs_to_convert:
+        traced_run = converted_runs[run.id]
+        cached_lines[run_conversion_key(run, raw_contacts)] = \
+            None if traced_run is None else TracedDataConversionCache.serialize_traced_data(traced_run)
+    lines = [cached_lines[key] for key in run_keys]
+
+    traced_runs_count = len([line for line in lines if line is not None])
+    log.info(f"Saving {traced_runs_count} traced runs to {traced_runs_output_path}...")
+    traced_runs_cache.save(run_keys, lines)
+    log.info(f"Saved {traced_runs_count} traced runs")
+
+
+def convert_runs_to_traced_data_by_run_id(user, rapid_pro, raw_runs, raw_contacts, phone_number_uuid_table,
+                                          test_contact_uuids):
+    """
+    Converts runs to TracedData, returning the TracedData for each run separately.
+
+    :param user: Identifier of the user running this program, for TracedData Metadata.
+    :type user: str
+    :param rapid_pro: Rapid Pro client to use to convert the runs.
+    :type rapid_pro: rapid_pro_tools.rapid_pro_client.RapidProClient
+    :param raw_runs: Runs to convert.
+    :type raw_runs: list of temba_client.v2.Run
+    :param raw_contacts: Snapshot of the contacts in this workspace.
+    :type raw_contacts: src.lib.rapid_pro_contacts.ContactsSnapshot
+    :param phone_number_uuid_table: Phone number <-> UUID table.
+    :type phone_number_uuid_table: id_infrastructure.firestore_uuid_table.FirestoreUuidTable
+    :param test_contact_uuids: Rapid Pro contact UUIDs of test contacts.
+    :type test_contact_uuids: list of str
+    :return: Dictionary of run id -> TracedData for that run, or None if the run was not converted to TracedData.
+    :rtype: dict of int -> (core_data_modules.traced_data.TracedData | None)
+    """
+    # The conversion skips runs by test contacts and runs whose contact isn't in the snapshot (e.g. because the contact
+    # was deleted), so record those runs as having no TracedData up-front. The conversion emits TracedData for every
+    # other run, in the same order as the runs it was given, so those runs can be converted in a single batch then
+    # matched up with their TracedData by position.
+    test_contact_uuids_set = set(test_contact_uuids)
+    raw_contacts.preload(run.contact.uuid for run in raw_runs)
+    converted_runs = dict()
+    runs_to_convert = []
+    for run in raw_runs:
+        if run.contact.uuid in test_contact_uuids_set or run.contact.uuid not in raw_contacts:
+            converted_runs[run.id] = None
+        else:
+            runs_to_convert.append(run)
+
+    if len(runs_to_convert) == 0:
+        return converted_runs
+
+    # Look up only the contacts these runs refer to, rather than having the conversion index every contact in the
+    # workspace.
+    traced_runs = rapid_pro.convert_runs_to_traced_data(
+        user, runs_to_convert, raw_contacts.contacts_for_runs(runs_to_convert), phone_number_uuid_table,
+        test_contact_uuids)
+    assert len(traced_runs) == len(runs_to_convert), \
+        f"Converted {len(traced_runs)} TracedData from {len(runs_to_convert)} runs, so the TracedData can't be " \
+        f"matched up with their runs"
+
+    for run, traced_run in zip(runs_to_convert, traced_runs):
+        converted_runs[run.id] = traced_run
+    return converted_runs
+
+
 def fetch_from_rapid_pro(user, google_cloud_credentials_file_path, raw_data_dir, phone_number_uuid_table,
-                         rapid_pro_source):
+                         rapid_pro_source, compression=None):
     log.info("Fetching data from Rapid Pro...")
     log.info("Downloading Rapid Pro access token...")
     rapid_pro_token = google_cloud_utils.download_blob_to_string(
@@ -65,187 +254,222 @@ def fetch_from_rapid_pro(user, google_cloud_credentials_file_path, raw_data_dir,
     rapid_pro = RapidProClient(rapid_pro_source.domain, rapid_pro_token)
     workspace_name = rapid_pro.get_workspace_name()
 
-    # Load the previous export of contacts if it exists, otherwise fetch all contacts from Rapid Pro.
-    raw_contacts_path = f"{raw_data_dir}/{workspace_name}_contacts_raw.json"
-    contacts_log_path = f"{raw_data_dir}/{workspace_name}_contacts_log.jsonl"
-    try:
-        log.info(f"Loading raw contacts from file '{raw_contacts_path}'...")
-        with open(raw_contacts_path) as raw_contacts_file:
-            raw_contacts = [Contact.deserialize(contact_json) for contact_json in json.load(raw_contacts_file)]
-        log.info(f"Loaded {len(raw_contacts)} contacts")
-    except FileNotFoundError:
-        log.info(f"File '{raw_contacts_path}' not found, will fetch all contacts from the Rapid Pro server")
-        with open(contacts_log_path, "a") as contacts_log_file:
-            raw_contacts = rapid_pro.get_raw_contacts(raw_export_log_file=contacts_log_file)
-
-    # Download all the runs for each of the radio shows
-    for flow in rapid_pro_source.activation_flow_names + rapid_pro_source.survey_flow_names:
-        runs_log_path = f"{raw_data_dir}/{flow}_log.jsonl"
-        raw_runs_path = f"{raw_data_dir}/{flow}_raw.json"
-        traced_runs_output_path = f"{raw_data_dir}/{flow}.jsonl"
-        log.info(f"Exporting flow '{flow}' to '{traced_runs_output_path}'...")
-
-        flow_id = rapid_pro.get_flow_id(flow)
-
-        # Load the previous export of runs for this flow, and update them with the newest runs.
-        # If there is no previous export for this flow, fetch all the runs from Rapid Pro.
-        with open(runs_log_path, "a") as raw_runs_log_file:
-            try:
-                log.info(f"Loading raw runs from file '{raw_runs_path}'...")
-                with open(raw_runs_path) as raw_runs_file:
-                    raw_runs = [Run.deserialize(run_json) for run_json in json.load(raw_runs_file)]
-                log.info(f"Loaded {len(raw_runs)} runs")
-                raw_runs = rapid_pro.update_raw_runs_with_latest_modified(
-                    flow_id, raw_runs, raw_export_log_file=raw_runs_log_file, ignore_archives=True)
-            except FileNotFoundError:
-                log.info(f"File '{raw_runs_path}' not found, will fetch all runs from the Rapid Pro server for flow '{flow}'")
-                raw_runs = rapid_pro.get_raw_runs_for_flow_id(flow_id, raw_export_log_file=raw_runs_log_file)
-
-        # Fetch the latest contacts from Rapid Pro.
-        with open(contacts_log_path, "a") as raw_contacts_log_file:
-            raw_contacts = rapid_pro.update_raw_contacts_with_latest_modified(raw_contacts,
-                                                                              raw_export_log_file=raw_contacts_log_file)
-
-        # Convert the runs to TracedData.
-        traced_runs = rapid_pro.convert_runs_to_traced_data(
-            user, raw_runs, raw_contacts, phone_number_uuid_table, rapid_pro_source.test_contact_uuids)
-
-        if flow in rapid_pro_source.activation_flow_names:
-            label_somalia_operator(user, traced_runs, phone_number_uuid_table)
-
-        log.info(f"Saving {len(raw_runs)} raw runs to {raw_runs_path}...")
-        with open(raw_runs_path, "w") as raw_runs_file:
-            json.dump([run.serialize() for run in raw_runs], raw_runs_file)
-        log.info(f"Saved {len(raw_runs)} raw runs")
-
-        log.info(f"Saving {len(traced_runs)} traced runs to {traced_runs_output_path}...")
-        IOUtils.ensure_dirs_exist_for_file(traced_runs_output_path)
-        with open(traced_runs_output_path, "w") as traced_runs_output_file:
-            TracedDataJsonIO.export_traced_data_iterable_to_jsonl(traced_runs, traced_runs_output_file)
-        log.info(f"Saved {len(traced_runs)} traced runs")
-
-    log.info(f"Saving {len(raw_contacts)} raw contacts to file '{raw_contacts_path}'...")
-    with open(raw_contacts_path, "w") as raw_contacts_file:
-        json.dump([contact.serialize() for contact in raw_contacts], raw_contacts_file)
-    log.info(f"Saved {len(raw_contacts)} contacts")
-    
-    
+    # Bring the local export of contacts up to date. This is done once, before any of the flows are fetched, so that
+    # every flow is converted against the same snapshot of contacts regardless of whether flows are fetched in parallel.
+    # The snapshot is closed once every flow has been converted, which closes its contacts database.
+    with RapidProContactsSync(rapid_pro, raw_data_dir, workspace_name, compression).sync() as raw_contacts:
+        # Download all the runs for each of the radio shows
+        flows = rapid_pro_source.activation_flow_names + rapid_pro_source.survey_flow_names
+        if rapid_pro_source.max_concurrent_flow_fetches == 1:
+            for flow in flows:
+                fetch_rapid_pro_flow(user, rapid_pro, raw_data_dir, phone_number_uuid_table, rapid_pro_source, flow,
+                                     raw_contacts, compression)
+        else:
+            log.info(f"Fetching {len(flows)} flows using up to {rapid_pro_source.max_concurrent_flow_fetches} "
+                     f"concurrent workers...")
+            with ThreadPoolExecutor(max_workers=rapid_pro_source.max_concurrent_flow_fetches) as executor:
+                # Give each flow its own client, because the clients' underlying http sessions aren't safe to share
+                # between threads.
+                flow_fetches = [
+                    executor.submit(fetch_rapid_pro_flow, user,
+                                    RapidProClient(rapid_pro_source.domain, rapid_pro_token), raw_data_dir,
+                                    phone_number_uuid_table, rapid_pro_source, flow, raw_contacts, compression)
+                    for flow in flows
+                ]
+                # Wait for every flow in submission order, so that the first failure is re-raised here.
+                for flow_fetch in flow_fetches:
+                    flow_fetch.result()
+
+
 def fetch_from_gcloud_bucket(google_cloud_credentials_file_path, raw_data_dir, gcloud_source):
     log.info("Fetching data from a gcloud bucket...")
-    for blob_url in gcloud_source.activation_flow_urls + gcloud_source.survey_flow_urls:
-        flow = blob_url.split("/")[-1]
+    blob_urls_to_local_paths = {
+        blob_url: f"{raw_data_dir}/{blob_url.split('/')[-1]}"
+        for blob_url in gcloud_source.activation_flow_urls + gcloud_source.survey_flow_urls
+    }
+
+    download_manager = BlobDownloadManager(
+        GoogleCloudBucket(google_cloud_credentials_file_path), f"{raw_data_dir}/gcloud_bucket_manifest.json",
+        gcloud_source.max_concurrent_downloads
+    )
+    download_manager.download(blob_urls_to_local_paths)
+
+
+def parse_recovery_csv_date(raw_date):
+    """
+    Parses a recovery CSV 'ReceivedOn' date, in the format "dd/mm/YYYY HH:MM" or "dd/mm/YYYY HH:MM:SS".
+
+    Dates in exactly these fixed-width formats are parsed by slicing, which is much faster than `datetime.strptime`.
+    Any other dates (for example with single-digit days) fall back to `strptime`.
+
+    :param raw_date: Date to parse.
+    :type raw_date: str
+    :return: Parsed, naive datetime.
+    :rtype: datetime.datetime
+    """
+    if len(raw_date) in {16, 19} and raw_date[2] == "/" and raw_date[5] == "/" and raw_date[10] == " " and \
+            raw_date[13] == ":" and (len(raw_date) == 16 or raw_date[16] == ":"):
+        try:
+            return datetime(
+                int(raw_date[6:10]), int(raw_date[3:5]), int(raw_date[0:2]),
+                int(raw_date[11:13]), int(raw_date[14:16]), int(raw_date[17:19]) if len(raw_date) == 19 else 0
+            )
+        except ValueError:
+            pass  # Let strptime parse or reject the date, so that errors are reported in the usual way.
 
-        traced_runs_output_path = f"{raw_data_dir}/{flow}"
-        if os.path.exists(traced_runs_output_path):
-            log.info(f"File '{traced_runs_output_path}' for flow '{flow}' already exists; skipping download")
-            continue
-        
-        log.info(f"Saving '{flow}' to file '{traced_runs_output_path}'...")
-        with open(traced_runs_output_path, "wb") as traced_runs_output_file:
-            google_cloud_utils.download_blob_to_file(
-                google_cloud_credentials_file_path, blob_url, traced_runs_output_file)
+    if len(raw_date) == len("dd/mm/YYYY HH:MM"):
+        return datetime.strptime(raw_date, "%d/%m/%Y %H:%M")
+    else:
+        return datetime.strptime(raw_date, "%d/%m/%Y %H:%M:%S")
+
+
+def convert_recovery_csv_rows_to_traced_data(user, blob_url, rows):
+    traced_runs = []
+    for row in rows:
+        localized_date = MOGADISHU_TIMEZONE.localize(parse_recovery_csv_date(row["ReceivedOn"]))
+
+        assert row["Sender"].startswith("avf-phone-uuid-"), \
+            f"The 'Sender' column for '{blob_url} contains an item that has not been de-identified " \
+            f"into Africa's Voices Foundation's de-identification format. This may be done with de_identify_csv.py."
+
+        d = {
+            "avf_phone_id": row["Sender"],
+            "message": row["Message"],
+            "received_on": localized_date.isoformat(),
+            "run_id": SHAUtils.sha_dict(row)
+        }
+
+        traced_runs.append(
+            TracedData(d, Metadata(user, Metadata.get_call_location(), TimeUtils.utc_now_as_iso_string()))
+        )
+    return traced_runs
 
 
 def fetch_from_recovery_csv(user, google_cloud_credentials_file_path, raw_data_dir, phone_number_uuid_table,
-                            recovery_csv_source):
+                            recovery_csv_source, compression=None):
     log.info("Fetching data from a recovery CSV...")
     for blob_url in recovery_csv_source.activation_flow_urls + recovery_csv_source.survey_flow_urls:
         flow_name = blob_url.split('/')[-1].split('.')[0]  # Takes the name between the last '/' and the '.csv' ending 
-        traced_runs_output_path = f"{raw_data_dir}/{flow_name}.jsonl"
-        if os.path.exists(traced_runs_output_path):
-            log.info(f"File '{traced_runs_output_path}' for blob '{blob_url}' already exists; skipping download")
+        traced_runs_output_path = with_compression(f"{raw_data_dir}/{flow_name}.jsonl", compression)
+        if find_file(traced_runs_output_path) is not None:
+            log.info(f"File '{find_file(traced_runs_output_path)}' for blob '{blob_url}' already exists; "
+                     f"skipping download")
             continue
 
-        log.info(f"Downloading recovered data from '{blob_url}'...")
-        raw_csv_string = StringIO(google_cloud_utils.download_blob_to_string(
-            google_cloud_credentials_file_path, blob_url))
-        raw_data = list(csv.DictReader(raw_csv_string))
-        log.info(f"Downloaded {len(raw_data)} recovered messages")
-
-        log.info("Converting the recovered messages to TracedData...")
-        traced_runs = []
-        for i, row in enumerate(raw_data):
-            raw_date = row["ReceivedOn"]
-            if len(raw_date) == len("dd/mm/YYYY HH:MM"):
-                parsed_raw_date = datetime.strptime(raw_date, "%d/%m/%Y %H:%M")
-            else:
-                parsed_raw_date = datetime.strptime(raw_date, "%d/%m/%Y %H:%M:%S")
-            localized_date = pytz.timezone("Africa/Mogadishu").localize(parsed_raw_date)
-
-            assert row["Sender"].startswith("avf-phone-uuid-"), \
-                f"The 'Sender' column for '{blob_url} contains an item that has not been de-identified " \
-                f"into Africa's Voices Foundation's de-identification format. This may be done with de_identify_csv.py."
-
-            d = {
-                "avf_phone_id": row["Sender"],
-                "message": row["Message"],
-                "received_on": localized_date.isoformat(),
-                "run_id": SHAUtils.sha_dict(row)
-            }
-
-            traced_runs.append(
-                TracedData(d, Metadata(user, Metadata.get_call_location(), TimeUtils.utc_now_as_iso_string()))
-            )
-        log.info("Converted the recovered messages to TracedData")
+        # Stream the recovered data through a temporary file on disk, rather than holding the entire CSV in memory.
+        with tempfile.TemporaryFile() as raw_csv_file:
+            log.info(f"Downloading recovered data from '{blob_url}'...")
+            google_cloud_utils.download_blob_to_file(google_cloud_credentials_file_path, blob_url, raw_csv_file)
+            raw_csv_file.seek(0)
+            log.info(f"Downloaded recovered data")
+
+            # Convert and export the rows a chunk at a time. The export is written to a temporary file and only moved
+            # into place once complete, because the existence of the output file causes future fetches to be skipped.
+            log.info(f"Converting the recovered messages to TracedData and exporting to {traced_runs_output_path}...")
+            IOUtils.ensure_dirs_exist_for_file(traced_runs_output_path)
+            reader = csv.DictReader(TextIOWrapper(raw_csv_file, encoding="utf-8", newline=""))
+            traced_runs_count = 0
+            with atomic_write(traced_runs_output_path) as f:
+                needs_separator = False
+                while True:
+                    rows = list(islice(reader, RECOVERY_CSV_CHUNK_SIZE))
+                    if len(rows) == 0:
+                        break
+
+                    traced_runs = convert_recovery_csv_rows_to_traced_data(user, blob_url, rows)
+                    if blob_url in recovery_csv_source.activation_flow_urls:
+                        label_somalia_operator(user, traced_runs, phone_number_uuid_table)
+
+                    buffer = StringIO()
+                    TracedDataJsonIO.export_traced_data_iterable_to_jsonl(traced_runs, buffer)
+                    chunk = buffer.getvalue()
+                    if needs_separator:
+                        f.write("\n")
+                    f.write(chunk)
+                    needs_separator = not chunk.endswith("\n")
+
+                    traced_runs_count += len(traced_runs)
+                    log.info(f"Exported {traced_runs_count} TracedData items...")
+        log.info(f"Exported {traced_runs_count} TracedData items to {traced_runs_output_path}")
+
+
+def init_facebook_client(google_cloud_credentials_file_path, raw_data_dir, facebook_source, compression=None):
+    """
+    :return: Facebook client for the given source, which limits its requests to the source's rate limit budget and
+             caches the posts and comments it downloads for the rest of this run. If the source has incremental
+             comment sync enabled, comments are synced with the exports in `raw_data_dir`.
+    :rtype: src.lib.cached_facebook_client.CachedFacebookClient
+    """
+    log.info("Downloading Facebook access token...")
+    facebook_token = google_cloud_utils.download_blob_to_string(
+        google_cloud_credentials_file_path, facebook_source.token_file_url).strip()
 
-        if blob_url in recovery_csv_source.activation_flow_urls:
-            label_somalia_operator(user, traced_runs, phone_number_uuid_table)
+    facebook = ThrottledFacebookClient(
+        FacebookClient(facebook_token), TokenBucketRateLimiter(facebook_source.max_requests_per_minute)
+    )
+    comments_sync = None
+    if facebook_source.incremental_comment_sync:
+        comments_sync = FacebookCommentsSync(facebook, raw_data_dir, compression)
+
+    return CachedFacebookClient(facebook, comments_sync)
+
+
+def fetch_facebook_engagement_metrics(facebook, facebook_source):
+    """
+    Downloads the engagement metrics for every post in a Facebook source.
+
+    :param facebook: Facebook client for this source.
+    :type facebook: src.lib.cached_facebook_client.CachedFacebookClient
+    :param facebook_source: Facebook source to download the metrics of.
+    :type facebook_source: src.lib.pipeline_configuration.FacebookSource
+    :return: Metrics for each post, as dicts with keys in FACEBOOK_METRICS_HEADERS.
+    :rtype: list of dict
+    """
+    log.info("Downloading metrics for a Facebook source...")
+    facebook_metrics = []  # of dict with keys in `FACEBOOK_METRICS_HEADERS`
+    for dataset in facebook_source.datasets:
+        for post_id in get_facebook_post_ids(facebook, facebook_source.page_id, dataset.post_ids, dataset.search):
+            post = facebook.get_post(post_id, fields=["attachments", "message", "created_time",
+                                                      "comments.filter(stream).limit(0).summary(true)"])
 
-        log.info(f"Exporting {len(traced_runs)} TracedData items to {traced_runs_output_path}...")
-        IOUtils.ensure_dirs_exist_for_file(traced_runs_output_path)
-        with open(traced_runs_output_path, "w") as f:
-            TracedDataJsonIO.export_traced_data_iterable_to_jsonl(traced_runs, f)
-        log.info(f"Exported TracedData")
+            comments = facebook.get_all_comments_on_post(post_id)
 
+            post_metrics = facebook.get_metrics_for_post(
+                post_id,
+                ["post_impressions", "post_impressions_unique", "post_engaged_users",
+                 "post_reactions_by_type_total"]
+            )
 
-def fetch_facebook_engagement_metrics(google_cloud_credentials_file_path, metrics_dir, data_sources):
+            facebook_metrics.append({
+                "Page ID": facebook_source.page_id,
+                "Dataset": dataset.name,
+                "Post URL": f"facebook.com/{post_id}",
+                "Post Created Time": post["created_time"],
+                "Post Text": post["message"],
+                "Post Type": facebook_utils.clean_post_type(post),
+                "Post Impressions": post_metrics["post_impressions"],
+                "Unique Post Impressions": post_metrics["post_impressions_unique"],
+                "Post Engaged Users": post_metrics["post_engaged_users"],
+                "Total Comments": post["comments"]["summary"]["total_count"],
+                "Visible (analysed) Comments": len(comments),
+                # post_reactions_by_type_total is a dict of reaction_type -> total, but we're only interested in
+                # the total across all types, so sum all the values.
+                "Reactions": sum([type_total for type_total in post_metrics["post_reactions_by_type_total"].values()])
+            })
+
+    return facebook_metrics
+
+
+def export_facebook_engagement_metrics(metrics_dir, facebook_metrics):
+    """
+    :param metrics_dir: Directory to write the metrics file to.
+    :type metrics_dir: str
+    :param facebook_metrics: Metrics for each post in every Facebook source, in source order, as returned by
+                             `fetch_facebook_engagement_metrics`.
+    :type facebook_metrics: list of dict
+    """
     IOUtils.ensure_dirs_exist(metrics_dir)
 
-    headers = ["Page ID", "Dataset", "Post URL", "Post Created Time", "Post Text", "Post Type", "Post Impressions",
-               "Unique Post Impressions", "Post Engaged Users", "Total Comments", "Visible (analysed) Comments",
-               "Reactions"]
-    facebook_metrics = []  # of dict with keys in `headers`
-    for source in data_sources:
-        if not isinstance(source, FacebookSource):
-            continue
-
-        log.info("Downloading metrics for a Facebook source...")
-        log.info("Downloading Facebook access token...")
-        facebook_token = google_cloud_utils.download_blob_to_string(
-            google_cloud_credentials_file_path, source.token_file_url).strip()
-
-        facebook = FacebookClient(facebook_token)
-
-        for dataset in source.datasets:
-            for post_id in get_facebook_post_ids(facebook, source.page_id, dataset.post_ids, dataset.search):
-                post = facebook.get_post(post_id, fields=["attachments", "message", "created_time",
-                                                          "comments.filter(stream).limit(0).summary(true)"])
-
-                comments = facebook.get_all_comments_on_post(post_id)
-
-                post_metrics = facebook.get_metrics_for_post(
-                    post_id,
-                    ["post_impressions", "post_impressions_unique", "post_engaged_users",
-                     "post_reactions_by_type_total"]
-                )
-
-                facebook_metrics.append({
-                    "Page ID": source.page_id,
-                    "Dataset": dataset.name,
-                    "Post URL": f"facebook.com/{post_id}",
-                    "Post Created Time": post["created_time"],
-                    "Post Text": post["message"],
-                    "Post Type": facebook_utils.clean_post_type(post),
-                    "Post Impressions": post_metrics["post_impressions"],
-                    "Unique Post Impressions": post_metrics["post_impressions_unique"],
-                    "Post Engaged Users": post_metrics["post_engaged_users"],
-                    "Total Comments": post["comments"]["summary"]["total_count"],
-                    "Visible (analysed) Comments": len(comments),
-                    # post_reactions_by_type_total is a dict of reaction_type -> total, but we're only interested in
-                    # the total across all types, so sum all the values.
-                    "Reactions": sum([type_total for type_total in post_metrics["post_reactions_by_type_total"].values()])
-                })
-
     if len(facebook_metrics) == 0:
         # No Facebook posts detected, so don't write a metrics file.
         return
@@ -253,7 +477,7 @@ def fetch_facebook_engagement_metrics(google_cloud_credentials_file_path, metric
     facebook_metrics.sort(key=lambda m: (m["Page ID"], m["Dataset"], m["Post Created Time"]))
 
     with open(f"{metrics_dir}/facebook_metrics.csv", "w") as f:
-        writer = csv.DictWriter(f, fieldnames=headers, lineterminator="\n")
+        writer = csv.DictWriter(f, fieldnames=FACEBOOK_METRICS_HEADERS, lineterminator="\n")
         writer.writeheader()
 
         for metric in facebook_metrics:
@@ -282,37 +506,124 @@ def get_facebook_post_ids(facebook_client, page_id, post_ids, search):
     return combined_post_ids
 
 
-def fetch_from_facebook(user, google_cloud_credentials_file_path, raw_data_dir, facebook_uuid_table, facebook_source):
-    log.info("Fetching data from Facebook...")
-    log.info("Downloading Facebook access token...")
-    facebook_token = google_cloud_utils.download_blob_to_string(
-        google_cloud_credentials_file_path, facebook_source.token_file_url).strip()
+def fetch_facebook_post_comments(facebook, raw_data_dir, post_id, compression=None):
+    """
+    Downloads all the comments on a post, logging the raw data returned by Facebook to
+    `{raw_data_dir}/{post_id}_comments_log.jsonl`.
+
+    :param facebook: Facebook client to use.
+    :type facebook: src.lib.cached_facebook_client.CachedFacebookClient
+    :param raw_data_dir: Directory to write the raw comments log to.
+    :type raw_data_dir: str
+    :param post_id: Id of the post to download the comments on.
+    :type post_id: str
+    :param compression: Compression format to write the raw comments log in, or None to write it uncompressed.
+    :type compression: str | None
+    :return: The comments on the post, each with the post under the key "post".
+    :rtype: list of dict
+    """
+    comments_log_path = with_compression(f"{raw_data_dir}/{post_id}_comments_log.jsonl", compression)
+    with open_file(comments_log_path, "a") as raw_comments_log_file:
+        post_comments = facebook.get_all_comments_on_post(
+            post_id, raw_export_log_file=raw_comments_log_file,
+            fields=["from{id}", "parent", "attachments", "created_time", "message"]
+        )
+
+    # Download the post and add it as context to all the comments. Adding a reference to the post under
+    # which a comment was made enables downstream features such as post-type labelling and comment context
+    # in Coda, as well as allowing us to track how many comments were made on each post.
+    post = facebook.get_post(post_id, fields=["attachments"])
+    for comment in post_comments:
+        comment["post"] = post
+
+    return post_comments
+
+
+def fetch_facebook_comments(facebook, raw_data_dir, post_ids, max_concurrent_post_fetches, compression=None):
+    """
+    Downloads all the comments on each of the given posts, using up to `max_concurrent_post_fetches` posts in
+    parallel.
+
+    :return: Dictionary of post id -> the comments on that post, as returned by `fetch_facebook_post_comments`.
+    :rtype: dict of str -> list of dict
+    """
+    # Fetch each post only once, so that concurrent fetches never write to the same comments log file.
+    post_ids = list(dict.fromkeys(post_ids))
+
+    if max_concurrent_post_fetches == 1:
+        return {
+            post_id: fetch_facebook_post_comments(facebook, raw_data_dir, post_id, compression) for post_id in post_ids
+        }
+
+    log.info(f"Fetching comments on {len(post_ids)} posts using up to {max_concurrent_post_fetches} "
+             f"concurrent workers...")
+    with ThreadPoolExecutor(max_workers=max_concurrent_post_fetches) as executor:
+        post_fetches = {
+            post_id: executor.submit(fetch_facebook_post_comments, facebook, raw_data_dir, post_id, compression)
+            for post_id in post_ids
+        }
+        # Wait for every post in submission order, so that the first failure is re-raised here.
+        return {post_id: post_fetch.result() for post_id, post_fetch in post_fetches.items()}
+
+
+def convert_facebook_comments_to_traced_data_by_comment_id(user, dataset_name, raw_comments, facebook_uuid_table):
+    """
+    Converts Facebook comments to TracedData, returning the TracedData for each comment separately.
+
+    :param user: Identifier of the user running this program, for TracedData Metadata.
+    :type user: str
+    :param dataset_name: Name of the dataset these comments belong to.
+    :type dataset_name: str
+    :param raw_comments: Comments to convert.
+    :type raw_comments: list of dict
+    :param facebook_uuid_table: Facebook id <-> UUID table.
+    :type facebook_uuid_table: id_infrastructure.firestore_uuid_table.FirestoreUuidTable
+    :return: Dictionary of comment id -> TracedData for that comment, or None if the comment was not converted to
+             TracedData.
+    :rtype: dict of str -> (core_data_modules.traced_data.TracedData | None)
+    """
+    if len(raw_comments) == 0:
+        return dict()
+
+    traced_comments = facebook_utils.convert_facebook_comments_to_traced_data(
+        user, dataset_name, raw_comments, facebook_uuid_table)
+
+    # As with runs, match the TracedData up to the comments by position if every comment was converted, otherwise
+    # convert the comments one at a time to find out which were skipped.
+    if len(traced_comments) == len(raw_comments):
+        return {comment["id"]: traced_comment for comment, traced_comment in zip(raw_comments, traced_comments)}
+
+    log.debug(f"Converted {len(traced_comments)} TracedData from {len(raw_comments)} comments; "
+              f"re-converting comment-by-comment...")
+    converted_comments = dict()
+    for comment in raw_comments:
+        traced_comments = facebook_utils.convert_facebook_comments_to_traced_data(
+            user, dataset_name, [comment], facebook_uuid_table)
+        assert len(traced_comments) <= 1
+        converted_comments[comment["id"]] = traced_comments[0] if len(traced_comments) == 1 else None
+    return converted_comments
 
-    facebook = FacebookClient(facebook_token)
+
+def fetch_from_facebook(user, facebook, raw_data_dir, facebook_uuid_table, facebook_source, compression=None):
+    log.info("Fetching data from Facebook...")
 
     for dataset in facebook_source.datasets:
         log.info(f"Exporting comments for dataset {dataset.name}...")
-        raw_comments_output_path = f"{raw_data_dir}/{dataset.name}_{facebook_source.page_id}_raw.json"
-        traced_comments_output_path = f"{raw_data_dir}/{dataset.name}_{facebook_source.page_id}.jsonl"
+        raw_comments_output_path = with_compression(
+            f"{raw_data_dir}/{dataset.name}_{facebook_source.page_id}_raw.json", compression)
+        traced_comments_output_path = with_compression(
+            f"{raw_data_dir}/{dataset.name}_{facebook_source.page_id}.jsonl", compression)
 
         # Download all the comments on all the posts in this dataset, logging the raw data returned by Facebook.
+        post_ids = get_facebook_post_ids(facebook, facebook_source.page_id, dataset.post_ids, dataset.search)
+        comments_by_post_id = fetch_facebook_comments(
+            facebook, raw_data_dir, post_ids, facebook_source.max_concurrent_post_fetches, compression)
+
+        # Combine the comments in post order, so that the raw comments are exported in the same order regardless of
+        # the order the posts were fetched in.
         raw_comments = []
-        for post_id in get_facebook_post_ids(facebook, facebook_source.page_id, dataset.post_ids, dataset.search):
-            comments_log_path = f"{raw_data_dir}/{post_id}_comments_log.jsonl"
-            with open(comments_log_path, "a") as raw_comments_log_file:
-                post_comments = facebook.get_all_comments_on_post(
-                    post_id, raw_export_log_file=raw_comments_log_file,
-                    fields=["from{id}", "parent", "attachments", "created_time", "message"]
-                )
-
-            # Download the post and add it as context to all the comments. Adding a reference to the post under
-            # which a comment was made enables downstream features such as post-type labelling and comment context
-            # in Coda, as well as allowing us to track how many comments were made on each post.
-            post = facebook.get_post(post_id, fields=["attachments"])
-            for comment in post_comments:
-                comment["post"] = post
-
-            raw_comments.extend(post_comments)
+        for post_id in post_ids:
+            raw_comments.extend(comments_by_post_id[post_id])
 
         # Facebook only returns a parent if the comment is a reply to another comment.
         # If there is no parent, set one to the empty-dict.
@@ -320,25 +631,64 @@ def fetch_from_facebook(user, google_cloud_credentials_file_path, raw_data_dir,
             if "parent" not in comment:
                 comment["parent"] = {}
 
-        # Convert the comments to TracedData.
-        traced_comments = facebook_utils.convert_facebook_comments_to_traced_data(
-            user, dataset.name, raw_comments, facebook_uuid_table)
-
         # Export to disk.
         log.info(f"Saving {len(raw_comments)} raw comments to {raw_comments_output_path}...")
         IOUtils.ensure_dirs_exist_for_file(raw_comments_output_path)
-        with open(raw_comments_output_path, "w") as raw_comments_output_file:
+        with atomic_write(raw_comments_output_path) as raw_comments_output_file:
             json.dump(raw_comments, raw_comments_output_file)
         log.info(f"Saved {len(raw_comments)} raw comments")
 
-        log.info(f"Saving {len(traced_comments)} traced comments to {traced_comments_output_path}...")
-        IOUtils.ensure_dirs_exist_for_file(traced_comments_output_path)
-        with open(traced_comments_output_path, "w") as traced_comments_output_file:
-            TracedDataJsonIO.export_traced_data_iterable_to_jsonl(traced_comments, traced_comments_output_file)
-        log.info(f"Saved {len(traced_comments)} traced comments")
+        if facebook_source.incremental_comment_sync:
+            # Convert only the comments which are new or changed since the previous export, re-using the TracedData
+            # exported then for all the other comments.
+            traced_comments_cache = TracedDataConversionCache(
+                raw_data_dir, f"{dataset.name}_{facebook_source.page_id}", {"Dataset": dataset.name}, compression)
+            cached_lines = traced_comments_cache.load()
+            comment_keys = [(comment["id"], SHAUtils.sha_dict(comment)) for comment in raw_comments]
+            comments_to_convert = [
+                comment for comment, key in zip(raw_comments, comment_keys) if key not in cached_lines]
+            log.info(f"Re-using the previous conversions of {len(raw_comments) - len(comments_to_convert)} comments; "
+                     f"converting {len(comments_to_convert)} new or changed comments...")
+
+            converted_comments = convert_facebook_comments_to_traced_data_by_comment_id(
+                user, dataset.name, comments_to_convert, facebook_uuid_table)
+            for comment, key in zip(raw_comments, comment_keys):
+                if key not in cached_lines:
+                    traced_comment = converted_comments[comment["id"]]
+                    cached_lines[key] = \
+                        None if traced_comment is None else TracedDataConversionCache.serialize_traced_data(traced_comment)
+            lines = [cached_lines[key] for key in comment_keys]
+
+            traced_comments_count = len([line for line in lines if line is not None])
+            log.info(f"Saving {traced_comments_count} traced comments to {traced_comments_output_path}...")
+            traced_comments_cache.save(comment_keys, lines)
+            log.info(f"Saved {traced_comments_count} traced comments")
+        else:
+            traced_comments = facebook_utils.convert_facebook_comments_to_traced_data(
+                user, dataset.name, raw_comments, facebook_uuid_table)
+
+            log.info(f"Saving {len(traced_comments)} traced comments to {traced_comments_output_path}...")
+            IOUtils.ensure_dirs_exist_for_file(traced_comments_output_path)
+            with atomic_write(traced_comments_output_path) as traced_comments_output_file:
+                TracedDataJsonIO.export_traced_data_iterable_to_jsonl(traced_comments, traced_comments_output_file)
+            log.info(f"Saved {len(traced_comments)} traced comments")
 
 
-def main(user, google_cloud_credentials_file_path, pipeline_configuration_file_path, raw_data_dir, metrics_dir):
+def fetch_facebook_comments_and_metrics(user, facebook, raw_data_dir, facebook_uuid_table, facebook_source,
+                                        compression=None):
+    """
+    Fetches the comments from a Facebook source, then the engagement metrics for its posts. The metrics are fetched
+    straight after the comments so that they can re-use the posts and comments just downloaded.
+
+    :return: Engagement metrics for each post in this source, as returned by `fetch_facebook_engagement_metrics`.
+    :rtype: list of dict
+    """
+    fetch_from_facebook(user, facebook, raw_data_dir, facebook_uuid_table, facebook_source, compression)
+    return fetch_facebook_engagement_metrics(facebook, facebook_source)
+
+
+def main(user, google_cloud_credentials_file_path, pipeline_configuration_file_path, raw_data_dir, metrics_dir,
+         uuid_table_cache_path=None):
     # Read the settings from the configuration file
     log.info("Loading Pipeline Configuration File...")
     with open(pipeline_configuration_file_path) as f:
@@ -352,37 +702,78 @@ def main(user, google_cloud_credentials_file_path, pipeline_configuration_file_p
         pipeline_configuration.uuid_table.firebase_credentials_file_url
     ))
 
-    uuid_table = FirestoreUuidTable.init_from_credentials(
+    firestore_uuid_table = FirestoreUuidTable.init_from_credentials(
         firestore_uuid_table_credentials,
         pipeline_configuration.uuid_table.table_name,
         pipeline_configuration.uuid_table.uuid_prefix
     )
     log.info("Initialised the Firestore UUID table")
 
-    log.info(f"Fetching data from {len(pipeline_configuration.raw_data_sources)} sources...")
+    # If requested, share a single local cache of the uuid table between all the sources, so that each id is only
+    # requested from Firestore once across all fetches.
+    if uuid_table_cache_path is not None:
+        uuid_table = CachedUuidTable(firestore_uuid_table, pipeline_configuration.uuid_table.table_name,
+                                     uuid_table_cache_path)
+    else:
+        uuid_table = firestore_uuid_table
+
+    # Share one Facebook client per source between the comments and metrics fetches, so that the posts and comments
+    # needed by both are only downloaded once.
+    facebook_clients = {
+        source: init_facebook_client(google_cloud_credentials_file_path, raw_data_dir, source,
+                                     pipeline_configuration.raw_data_compression)
+        for source in pipeline_configuration.raw_data_sources if isinstance(source, FacebookSource)
+    }
+
+    # Schedule a fetch for each source. Sources are independent of each other, so may be fetched concurrently.
+    source_fetch_concurrency = pipeline_configuration.source_fetch_concurrency
+    scheduler = SourceScheduler(source_fetch_concurrency.max_concurrent_sources,
+                                source_fetch_concurrency.max_concurrent_sources_by_type)
     for i, raw_data_source in enumerate(pipeline_configuration.raw_data_sources):
-        log.info(f"Fetching from source {i + 1}/{len(pipeline_configuration.raw_data_sources)}...")
+        name = f"source {i + 1}/{len(pipeline_configuration.raw_data_sources)}"
         if isinstance(raw_data_source, RapidProSource):
-            fetch_from_rapid_pro(user, google_cloud_credentials_file_path, raw_data_dir, uuid_table,
-                                 raw_data_source)
+            scheduler.add_task(name, "RapidPro", partial(
+                fetch_from_rapid_pro, user, google_cloud_credentials_file_path, raw_data_dir, uuid_table,
+                raw_data_source, pipeline_configuration.raw_data_compression))
         elif isinstance(raw_data_source, GCloudBucketSource):
-            fetch_from_gcloud_bucket(google_cloud_credentials_file_path, raw_data_dir, raw_data_source)
+            scheduler.add_task(name, "GCloudBucket", partial(
+                fetch_from_gcloud_bucket, google_cloud_credentials_file_path, raw_data_dir, raw_data_source))
         elif isinstance(raw_data_source, RecoveryCSVSource):
-            fetch_from_recovery_csv(user, google_cloud_credentials_file_path, raw_data_dir, uuid_table,
-                                    raw_data_source)
+            scheduler.add_task(name, "RecoveryCSV", partial(
+                fetch_from_recovery_csv, user, google_cloud_credentials_file_path, raw_data_dir, uuid_table,
+                raw_data_source, pipeline_configuration.raw_data_compression))
         elif isinstance(raw_data_source, FacebookSource):
-            fetch_from_facebook(user, google_cloud_credentials_file_path, raw_data_dir, uuid_table, raw_data_source)
+            scheduler.add_task(name, "Facebook", partial(
+                fetch_facebook_comments_and_metrics, user, facebook_clients[raw_data_source], raw_data_dir,
+                uuid_table, raw_data_source, pipeline_configuration.raw_data_compression))
         else:
             assert False, f"Unknown raw_data_source type {type(raw_data_source)}"
 
-    fetch_facebook_engagement_metrics(
-        google_cloud_credentials_file_path, metrics_dir, pipeline_configuration.raw_data_sources)
+    log.info(f"Fetching data from {len(pipeline_configuration.raw_data_sources)} sources...")
+    results = scheduler.run()
+
+    # Combine the metrics from each Facebook source in source order, so the exported metrics don't depend on the order
+    # the sources finished in.
+    facebook_metrics = []
+    for raw_data_source, result in zip(pipeline_configuration.raw_data_sources, results):
+        if isinstance(raw_data_source, FacebookSource):
+            facebook_metrics.extend(result)
+    export_facebook_engagement_metrics(metrics_dir, facebook_metrics)
+
+    if uuid_table_cache_path is not None:
+        uuid_table.log_stats()
+        uuid_table.close()
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Fetches all the raw data for this project from Rapid Pro. "
                                                  "This script must be run from its parent directory.")
 
+    parser.add_argument("--uuid-table-cache-path", metavar="uuid-table-cache-path",
+                        help="Path to a local SQLite database to cache the uuid table's mappings in, so that later "
+                             "fetches only request new ids from Firestore. The cache contains the identifiable data "
+                             "(e.g. phone numbers) in plain text, so it must be kept outside of the data root and "
+                             "protected like the uuid table itself")
     parser.add_argument("user", help="Identifier of the user launching this program")
     parser.add_argument("google_cloud_credentials_file_path", metavar="google-cloud-credentials-file-path",
                         help="Path to a Google Cloud service account credentials file to use to access the "
@@ -398,4 +789,4 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     main(args.user, args.google_cloud_credentials_file_path, args.pipeline_configuration_file_path, args.raw_data_dir,
-         args.metrics_dir)
+         args.metrics_dir, args.uuid_table_cache_path)
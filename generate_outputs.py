@@ -1,19 +1,23 @@
 import argparse
+import json
 
 from core_data_modules.logging import Logger
 from core_data_modules.traced_data.io import TracedDataJsonIO
 from core_data_modules.util import IOUtils
-from dateutil.parser import isoparse
 
-from src import LoadData, TranslateSourceKeys, AutoCode, ProductionFile, \
-    ApplyManualCodes, AnalysisFile, WSCorrection
-from src.lib import PipelineConfiguration, MessageFilters
+from src import LoadData, ParticipantStages, AutoCode, ProductionFile, ApplyManualCodes, AnalysisFile
+from src.lib import PipelineConfiguration
+from src.lib.timestamp_cache import timestamps
 
 log = Logger(__name__)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Runs the post-fetch phase of the pipeline")
 
+    parser.add_argument("--loaded-raw-data-cache-dir", nargs="?",
+                        help="Directory to keep a snapshot of the loaded raw data in, so that later runs on the same "
+                             "raw data can skip re-loading it. The directory is created if it doesn't exist. "
+                             "Snapshots are pickles, so only use a directory which is writable by trusted users")
     parser.add_argument("user", help="User launching this program")
     parser.add_argument("pipeline_run_mode", help="whether to generate analysis files or not",
                         choices=["all-stages", "auto-code-only"])
@@ -53,6 +57,7 @@ if __name__ == "__main__":
     pipeline_configuration_file_path = args.pipeline_configuration_file_path
 
     raw_data_dir = args.raw_data_dir
+    loaded_raw_data_cache_dir = args.loaded_raw_data_cache_dir
     prev_coded_dir_path = args.prev_coded_dir_path
 
     auto_coding_json_output_path = args.auto_coding_json_output_path
@@ -67,36 +72,27 @@ if __name__ == "__main__":
     # Load the pipeline configuration file
     log.info("Loading Pipeline Configuration File...")
     with open(pipeline_configuration_file_path) as f:
-        pipeline_configuration = PipelineConfiguration.from_configuration_file(f)
+        pipeline_configuration_dict = json.load(f)
+    pipeline_configuration = PipelineConfiguration.from_configuration_dict(pipeline_configuration_dict)
     Logger.set_project_name(pipeline_configuration.pipeline_name)
     log.debug(f"Pipeline name is {pipeline_configuration.pipeline_name}")
 
     log.info("Loading the raw data...")
-    data = LoadData.load_raw_data(user, raw_data_dir, pipeline_configuration)
-
-    log.info("Translating source Keys...")
-    data = TranslateSourceKeys.translate_source_keys(user, data, pipeline_configuration)
-
-    if pipeline_configuration.move_ws_messages:
-        log.info("Pre-filtering empty message objects...")
-        # This is a performance optimisation to save execution time + memory when moving WS messages, by removing
-        # the need to mark and process a high volume of empty message objects as 'NR' in WS correction.
-        # Empty message objects represent flow runs where the participants never sent a message e.g. from an advert
-        # flow run where we asked someone a question but didn't receive a response.
-        data = MessageFilters.filter_empty_messages(data,
-                                                    [plan.raw_field for plan in PipelineConfiguration.RQA_CODING_PLANS])
-
-        log.info("Moving WS messages...")
-        data = WSCorrection.move_wrong_scheme_messages(user, data, prev_coded_dir_path)
+    data = LoadData.load_raw_data(user, raw_data_dir, pipeline_configuration, loaded_raw_data_cache_dir,
+                                  pipeline_configuration_dict)
+
+    if pipeline_configuration.processing_shards == 1:
+        data = ParticipantStages.run(user, data, pipeline_configuration, prev_coded_dir_path)
     else:
-        log.info("Not moving WS messages (because the 'MoveWSMessages' key in the pipeline configuration "
-                 "json was set to 'false')")
+        log.info(f"Processing participants in {pipeline_configuration.processing_shards} shards...")
+        data = ParticipantStages.run_sharded(user, data, pipeline_configuration_file_path, prev_coded_dir_path,
+                                             pipeline_configuration.processing_shards)
 
-    log.info("Auto Coding...")
-    data = AutoCode.auto_code(user, data, pipeline_configuration, icr_output_dir, coded_dir_path)
+    log.info("Exporting auto-coded messages to Coda and ICR...")
+    AutoCode.export_auto_coded(user, data, icr_output_dir, coded_dir_path)
 
     log.info("Sorting messages by date received...")
-    data.sort(key=lambda td: isoparse(td["sent_on"]))
+    data.sort(key=lambda td: timestamps.parse(td["sent_on"]))
 
     log.info("Exporting production CSV...")
     data = ProductionFile.generate(data, production_csv_output_path)
@@ -127,4 +123,6 @@ if __name__ == "__main__":
         with open(auto_coding_json_output_path, "w") as f:
             TracedDataJsonIO.export_traced_data_iterable_to_jsonl(data, f)
 
+    timestamps.log_stats()
+
     log.info("Python script complete")
@@ -0,0 +1,124 @@
+import argparse
+import glob
+import os
+import time
+from types import SimpleNamespace
+
+from core_data_modules.logging import Logger
+
+import fetch_raw_data
+from src.lib.bucket_downloads import LocalDirectoryBucket
+from src.lib.replay import (ReplayFacebookClient, ReplayGoogleCloudStorage, ReplayLatency, ReplayRapidProClient,
+                            ReplayThrottledFacebookClient, ReplayUuidTable)
+
+log = Logger(__name__)
+
+
+def get_recorded_workspace_name(recorded_raw_data_dir, workspace_names, domain):
+    if domain in workspace_names:
+        return workspace_names[domain]
+
+    recorded_contacts_logs = glob.glob(f"{recorded_raw_data_dir}/*_contacts_log.jsonl")
+    assert len(recorded_contacts_logs) == 1, \
+        f"Can't tell which recorded workspace to replay for Rapid Pro domain '{domain}'; " \
+        f"specify it with --rapid-pro-workspace {domain}=<workspace name>"
+    return os.path.basename(recorded_contacts_logs[0])[:-len("_contacts_log.jsonl")]
+
+
+def main(user, pipeline_configuration_file_path, recorded_raw_data_dir, raw_data_dir, metrics_dir,
+         recorded_metrics_dir=None, recorded_bucket_dir=None, workspace_names=None, latency_seconds=0,
+         recorded_uuid_table_cache_path=None):
+    """
+    Runs fetch_raw_data.py against the raw export logs recorded by a previous fetch, instead of against the live
+    Rapid Pro, Facebook, Firestore, and Google Cloud Storage services, so that the fetch stage can be benchmarked and
+    regression-tested offline.
+
+    :param recorded_raw_data_dir: Raw data directory of the previous fetch to replay.
+    :type recorded_raw_data_dir: str
+    :param raw_data_dir: Directory to write the replayed fetch's raw data to. To replay an incremental fetch, this can
+                         be a copy of an older raw data directory.
+    :type raw_data_dir: str
+    :param recorded_metrics_dir: Metrics directory of the previous fetch, to replay the Facebook posts and metrics
+                                 from.
+    :type recorded_metrics_dir: str | None
+    :param recorded_bucket_dir: Directory containing the recorded Google Cloud Storage blobs, with the blob at
+                                `gs://{bucket}/{path}` stored at `{recorded_bucket_dir}/{bucket}/{path}`.
+    :type recorded_bucket_dir: str | None
+    :param workspace_names: Dictionary of Rapid Pro domain -> name of the recorded workspace to replay for that domain.
+                            Not needed if only one workspace was recorded.
+    :type workspace_names: dict of str -> str | None
+    :param latency_seconds: Latency to inject into every request made to a replayed service.
+    :type latency_seconds: float
+    :param recorded_uuid_table_cache_path: Uuid table cache of the previous fetch, to replay uuids from. Uuids which
+                                           aren't in this cache are generated locally.
+    :type recorded_uuid_table_cache_path: str | None
+    """
+    assert os.path.abspath(raw_data_dir) != os.path.abspath(recorded_raw_data_dir), \
+        "The replayed raw data must be written to a different directory to the recording, so that the recorded " \
+        "logs aren't appended to"
+
+    if workspace_names is None:
+        workspace_names = dict()
+    if recorded_bucket_dir is None:
+        recorded_bucket_dir = f"{recorded_raw_data_dir}/gcs"
+
+    latency = ReplayLatency(latency_seconds)
+    log.info(f"Replaying the fetch recorded in '{recorded_raw_data_dir}', with {latency_seconds}s latency per "
+             f"request...")
+
+    facebook = ReplayFacebookClient(recorded_raw_data_dir, recorded_metrics_dir, latency)
+
+    # Substitute the replay stand-ins for the clients fetch_raw_data uses to access live services.
+    fetch_raw_data.google_cloud_utils = ReplayGoogleCloudStorage(recorded_bucket_dir, latency)
+    fetch_raw_data.GoogleCloudBucket = lambda google_cloud_credentials_file_path: \
+        LocalDirectoryBucket(recorded_bucket_dir)
+    fetch_raw_data.FirestoreUuidTable = SimpleNamespace(
+        init_from_credentials=lambda credentials, table_name, uuid_prefix: ReplayUuidTable.from_recorded_cache(
+            recorded_uuid_table_cache_path, table_name, uuid_prefix, latency)
+    )
+    fetch_raw_data.RapidProClient = lambda domain, token: ReplayRapidProClient(
+        recorded_raw_data_dir, get_recorded_workspace_name(recorded_raw_data_dir, workspace_names, domain), latency)
+    fetch_raw_data.FacebookClient = lambda token: facebook
+    fetch_raw_data.ThrottledFacebookClient = ReplayThrottledFacebookClient
+
+    start = time.perf_counter()
+    fetch_raw_data.main(user, None, pipeline_configuration_file_path, raw_data_dir, metrics_dir)
+    log.info(f"Replayed the fetch in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replays the raw export logs recorded by a previous run of "
+                                                 "fetch_raw_data.py through local stand-ins for Rapid Pro, Facebook, "
+                                                 "Firestore and Google Cloud Storage, for benchmarking and testing "
+                                                 "the fetch stage offline. "
+                                                 "This script must be run from its parent directory.")
+
+    parser.add_argument("--recorded-metrics-dir", metavar="recorded-metrics-dir",
+                        help="Metrics directory of the recorded fetch, to replay Facebook posts and metrics from")
+    parser.add_argument("--recorded-bucket-dir", metavar="recorded-bucket-dir",
+                        help="Directory containing recorded Google Cloud Storage blobs, with one sub-directory per "
+                             "bucket. Defaults to <recorded-raw-data-dir>/gcs")
+    parser.add_argument("--rapid-pro-workspace", metavar="domain=workspace-name", action="append", default=[],
+                        help="Name of the recorded workspace to replay for a Rapid Pro domain. Only needed if more "
+                             "than one workspace was recorded. May be given more than once")
+    parser.add_argument("--recorded-uuid-table-cache-path", metavar="recorded-uuid-table-cache-path",
+                        help="Uuid table cache of the recorded fetch, to replay uuids from")
+    parser.add_argument("--latency-seconds", type=float, default=0,
+                        help="Latency to inject into each request made to a replayed service")
+
+    parser.add_argument("user", help="Identifier of the user launching this program")
+    parser.add_argument("pipeline_configuration_file_path", metavar="pipeline-configuration-file",
+                        help="Path to the pipeline configuration json file")
+    parser.add_argument("recorded_raw_data_dir", metavar="recorded-raw-data-dir",
+                        help="Raw data directory of the fetch to replay")
+    parser.add_argument("raw_data_dir", metavar="raw-data-dir",
+                        help="Path to a directory to save the replayed raw data to")
+    parser.add_argument("metrics_dir", metavar="metrics-dir",
+                        help="Path to a directory to save the replayed engagement metrics to")
+
+    args = parser.parse_args()
+
+    main(args.user, args.pipeline_configuration_file_path, args.recorded_raw_data_dir, args.raw_data_dir,
+         args.metrics_dir, args.recorded_metrics_dir, args.recorded_bucket_dir,
+         dict(workspace.split("=", 1) for workspace in args.rapid_pro_workspace), args.latency_seconds,
+         args.recorded_uuid_table_cache_path)
@@ -9,6 +9,11 @@ while [[ $# -gt 0 ]]; do
 
             CPU_PROFILE_ARG="--profile-cpu $CPU_PROFILE_OUTPUT_PATH"
             shift 2;;
+        --uuid-table-cache-path)
+            UUID_TABLE_CACHE_PATH="$2"
+
+            UUID_TABLE_CACHE_ARG="--uuid-table-cache-path $UUID_TABLE_CACHE_PATH"
+            shift 2;;
         --)
             shift
             break;;
@@ -18,7 +23,7 @@ while [[ $# -gt 0 ]]; do
 done
 
 if [[ $# -ne 4 ]]; then
-    echo "Usage: ./2_fetch_raw_data.sh [--profile-cpu <cpu-profile-output-path>] <user> <google-cloud-credentials-file-path> <pipeline-configuration-file-path> <data-root>"
+    echo "Usage: ./2_fetch_raw_data.sh [--profile-cpu <cpu-profile-output-path>] [--uuid-table-cache-path <uuid-table-cache-path>] <user> <google-cloud-credentials-file-path> <pipeline-configuration-file-path> <data-root>"
     echo "Fetches all the raw data from Rapid Pro and converts to TracedData"
     exit
 fi
@@ -37,5 +42,5 @@ fi
 mkdir -p "$DATA_ROOT/Raw Data"
 
 cd ..
-./docker-run-fetch-raw-data.sh ${CPU_PROFILE_ARG} \
+./docker-run-fetch-raw-data.sh ${CPU_PROFILE_ARG} ${UUID_TABLE_CACHE_ARG} \
     "$USER" "$GOOGLE_CLOUD_CREDENTIALS_FILE_PATH" "$PIPELINE_CONFIGURATION_FILE_PATH" "$DATA_ROOT/Raw Data" "$DATA_ROOT/Engagement Metrics"
@@ -12,6 +12,10 @@ while [[ $# -gt 0 ]]; do
             MEMORY_PROFILE_OUTPUT_PATH="$2"
             MEMORY_PROFILE_ARG="--profile-memory $MEMORY_PROFILE_OUTPUT_PATH"
             shift 2;;
+        --loaded-raw-data-cache-dir)
+            LOADED_RAW_DATA_CACHE_DIR="$2"
+            LOADED_RAW_DATA_CACHE_ARG="--loaded-raw-data-cache-dir $LOADED_RAW_DATA_CACHE_DIR"
+            shift 2;;
         --)
             shift
             break;;
@@ -21,7 +25,7 @@ while [[ $# -gt 0 ]]; do
 done
 
 if [[ $# -ne 4 ]]; then
-    echo "Usage: ./3_generate_outputs.sh [--profile-cpu <cpu-profile-output-path>] [--profile-memory <memory-profile-output-path>] <user> <pipeline-run-mode>\
+    echo "Usage: ./3_generate_outputs.sh [--profile-cpu <cpu-profile-output-path>] [--profile-memory <memory-profile-output-path>] [--loaded-raw-data-cache-dir <loaded-raw-data-cache-dir>] <user> <pipeline-run-mode>\
           <pipeline-configuration-file-path> <data-root>"
     echo "Generates ICR files, Coda files, production CSV and analysis CSVs from the raw data files produced by run scripts 1 and 2"
     exit
@@ -40,7 +44,7 @@ fi
 mkdir -p "$DATA_ROOT/Outputs"
 
 cd ..
-./docker-run-generate-outputs.sh ${CPU_PROFILE_ARG} ${MEMORY_PROFILE_ARG} \
+./docker-run-generate-outputs.sh ${CPU_PROFILE_ARG} ${MEMORY_PROFILE_ARG} ${LOADED_RAW_DATA_CACHE_ARG} \
     "$USER" "$PIPELINE_RUN_MODE" "$PIPELINE_CONFIGURATION_FILE_PATH" \
     "$DATA_ROOT/Raw Data" "$DATA_ROOT/Coded Coda Files/" "$DATA_ROOT/Outputs/auto_coding_traced_data.jsonl" \
     "$DATA_ROOT/Outputs/messages_traced_data.jsonl" "$DATA_ROOT/Outputs/individuals_traced_data.jsonl" \
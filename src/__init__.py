@@ -2,6 +2,7 @@ from .analysis_file import AnalysisFile
 from .apply_manual_codes import ApplyManualCodes
 from .auto_code import AutoCode
 from .load_data import LoadData
+from .participant_stages import ParticipantStages
 from .production_file import ProductionFile
 from .translate_source_keys import TranslateSourceKeys
 from .ws_correction import WSCorrection
@@ -123,13 +123,31 @@ class AutoCode(object):
                 )
 
     @classmethod
-    def auto_code(cls, user, data, pipeline_configuration, icr_output_dir, coda_output_dir):
+    def auto_code_messages(cls, user, data, pipeline_configuration):
+        """
+        Filters out the messages which shouldn't be coded, and runs the automatic cleaners on the rest.
+
+        This only ever looks at one message at a time, so can be run on any partition of the data independently.
+        """
         data = cls.filter_messages(data, pipeline_configuration.project_start_date,
                                    pipeline_configuration.project_end_date, pipeline_configuration.filter_test_messages)
 
         cls.run_cleaners(user, data)
+
+        return data
+
+    @classmethod
+    def export_auto_coded(cls, user, data, icr_output_dir, coda_output_dir):
+        """
+        Exports the auto-coded messages to Coda and samples them for ICR. These need all of the messages at once.
+        """
         cls.export_coda(user, data, coda_output_dir)
         cls.export_icr(data, icr_output_dir)
         cls.log_empty_string_stats(data)
 
+    @classmethod
+    def auto_code(cls, user, data, pipeline_configuration, icr_output_dir, coda_output_dir):
+        data = cls.auto_code_messages(user, data, pipeline_configuration)
+        cls.export_auto_coded(user, data, icr_output_dir, coda_output_dir)
+
         return data
@@ -0,0 +1,182 @@
+import base64
+import hashlib
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from core_data_modules.logging import Logger
+from core_data_modules.util import IOUtils
+
+log = Logger(__name__)
+
+
+def _md5_of_file(path):
+    """
+    :return: Base64-encoded MD5 hash of the file at `path`, in the same format Google Cloud Storage reports hashes in.
+    :rtype: str
+    """
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            md5.update(block)
+    return base64.b64encode(md5.digest()).decode("ascii")
+
+
+class GoogleCloudBucket(object):
+    def __init__(self, google_cloud_credentials_file_path):
+        """
+        Access to blobs in Google Cloud Storage, for use with a BlobDownloadManager.
+
+        :param google_cloud_credentials_file_path: Path to a Google Cloud service account credentials file.
+        :type google_cloud_credentials_file_path: str
+        """
+        # Imported here so that the google-cloud-storage package is only required when downloading from Google Cloud.
+        from google.cloud import storage
+
+        self._client = storage.Client.from_service_account_json(google_cloud_credentials_file_path)
+
+    def _get_blob(self, blob_url):
+        parsed_url = urlparse(blob_url)
+        assert parsed_url.scheme == "gs", f"Blob URL '{blob_url}' is not a GS URL"
+        blob = self._client.bucket(parsed_url.netloc).get_blob(parsed_url.path.lstrip("/"))
+        assert blob is not None, f"Blob '{blob_url}' does not exist"
+        return blob
+
+    def get_blob_version(self, blob_url):
+        """
+        :return: The current version of the blob at `blob_url`, as a dict with keys "Generation" and "MD5".
+        :rtype: dict of str -> str
+        """
+        blob = self._get_blob(blob_url)
+        return {"Generation": str(blob.generation), "MD5": blob.md5_hash}
+
+    def download_blob_to_file(self, blob_url, version, f):
+        """
+        Downloads the given version of the blob at `blob_url` to the binary file-like `f`.
+        """
+        blob = self._get_blob(blob_url)
+        # Download exactly the version which was checked, so the manifest always describes the downloaded file.
+        blob.download_to_file(f, if_generation_match=int(version["Generation"]))
+
+
+class LocalDirectoryBucket(object):
+    def __init__(self, root_dir):
+        """
+        Stand-in for Google Cloud Storage which serves blobs from a local directory, for running and testing
+        downloads offline.
+
+        The blob at `gs://{bucket}/{path}` is read from `{root_dir}/{bucket}/{path}`. A blob's generation is its file's
+        modification time.
+
+        :param root_dir: Directory containing one sub-directory per bucket.
+        :type root_dir: str
+        """
+        self.root_dir = root_dir
+
+    def _get_path(self, blob_url):
+        parsed_url = urlparse(blob_url)
+        assert parsed_url.scheme == "gs", f"Blob URL '{blob_url}' is not a GS URL"
+        return f"{self.root_dir}/{parsed_url.netloc}/{parsed_url.path.lstrip('/')}"
+
+    def get_blob_version(self, blob_url):
+        path = self._get_path(blob_url)
+        return {"Generation": str(os.stat(path).st_mtime_ns), "MD5": _md5_of_file(path)}
+
+    def download_blob_to_file(self, blob_url, version, f):
+        with open(self._get_path(blob_url), "rb") as blob_file:
+            shutil.copyfileobj(blob_file, f)
+
+
+class BlobDownloadManager(object):
+    # Serialises updates to each manifest file, so that managers for different sources which share a manifest can run
+    # concurrently.
+    _manifest_locks = dict()  # of manifest path -> threading.Lock
+    _manifest_locks_lock = threading.Lock()
+
+    def __init__(self, bucket, manifest_path, max_concurrent_downloads=1):
+        """
+        Downloads blobs to local files, only downloading the blobs which changed since they were last downloaded.
+
+        The version (generation and MD5 hash) of each blob is recorded in a manifest file when it is downloaded.
+        A blob is downloaded again if its current version doesn't match the manifest, or its local file is missing.
+        Files are downloaded to a temporary file then renamed into place, so a local file is never left partially
+        written.
+
+        :param bucket: Bucket to download blobs from.
+        :type bucket: GoogleCloudBucket | LocalDirectoryBucket
+        :param manifest_path: Path to the manifest file. This is created if it doesn't exist.
+        :type manifest_path: str
+        :param max_concurrent_downloads: The maximum number of blobs to check and download in parallel.
+        :type max_concurrent_downloads: int
+        """
+        self.bucket = bucket
+        self.manifest_path = manifest_path
+        self.max_concurrent_downloads = max_concurrent_downloads
+
+        with self._manifest_locks_lock:
+            if manifest_path not in self._manifest_locks:
+                self._manifest_locks[manifest_path] = threading.Lock()
+            self._manifest_lock = self._manifest_locks[manifest_path]
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return dict()
+
+    def _update_manifest(self, blob_url, entry):
+        with self._manifest_lock:
+            manifest = self._load_manifest()
+            manifest[blob_url] = entry
+            IOUtils.ensure_dirs_exist_for_file(self.manifest_path)
+            with open(f"{self.manifest_path}.tmp", "w") as f:
+                json.dump(manifest, f, indent=2)
+            os.replace(f"{self.manifest_path}.tmp", self.manifest_path)
+
+    def _sync_blob(self, blob_url, local_path, manifest_entry):
+        version = self.bucket.get_blob_version(blob_url)
+        entry = {"LocalPath": local_path, **version}
+
+        if os.path.exists(local_path):
+            if manifest_entry == entry:
+                log.debug(f"File '{local_path}' is up to date with '{blob_url}'; skipping download")
+                return False
+
+            if manifest_entry is None and _md5_of_file(local_path) == version["MD5"]:
+                # Files downloaded before the manifest existed only need recording, if they are still up to date.
+                log.debug(f"File '{local_path}' matches '{blob_url}'; recording it in the manifest")
+                self._update_manifest(blob_url, entry)
+                return False
+
+        log.info(f"Downloading '{blob_url}' to '{local_path}'...")
+        IOUtils.ensure_dirs_exist_for_file(local_path)
+        with open(f"{local_path}.tmp", "wb") as f:
+            self.bucket.download_blob_to_file(blob_url, version, f)
+        os.replace(f"{local_path}.tmp", local_path)
+        self._update_manifest(blob_url, entry)
+        return True
+
+    def download(self, blob_urls_to_local_paths):
+        """
+        Downloads each of the given blobs which aren't up to date locally.
+
+        :param blob_urls_to_local_paths: Dictionary of blob URL -> local path to download that blob to.
+        :type blob_urls_to_local_paths: dict of str -> str
+        """
+        manifest = self._load_manifest()
+
+        def sync_blob(blob_url):
+            return self._sync_blob(blob_url, blob_urls_to_local_paths[blob_url], manifest.get(blob_url))
+
+        if self.max_concurrent_downloads == 1:
+            downloaded = [sync_blob(blob_url) for blob_url in blob_urls_to_local_paths]
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_concurrent_downloads) as executor:
+                downloaded = list(executor.map(sync_blob, blob_urls_to_local_paths))
+
+        log.info(f"Downloaded {sum(downloaded)} new or changed blobs; "
+                 f"{len(downloaded) - sum(downloaded)} blobs were already up to date")
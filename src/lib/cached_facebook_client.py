@@ -0,0 +1,179 @@
+import copy
+import threading
+
+from core_data_modules.logging import Logger
+from dateutil.parser import isoparse
+
+log = Logger(__name__)
+
+
+class CachedFacebookClient(object):
+    # Fields to download for every post. This is the union of the fields needed by all the pipeline's uses of posts,
+    # so that each post only needs to be downloaded once.
+    POST_FIELDS = ["attachments", "message", "created_time", "comments.filter(stream).limit(0).summary(true)"]
+
+    # Fields to download for every comment.
+    COMMENT_FIELDS = ["from{id}", "parent", "attachments", "created_time", "message"]
+
+    def __init__(self, facebook, comments_sync=None):
+        """
+        Per-run cache of the posts and comments downloaded from Facebook, so that each post and each post's comments
+        are downloaded at most once per run, no matter how many datasets or metrics need them.
+
+        Posts are always downloaded with all of POST_FIELDS, and comments with all of COMMENT_FIELDS. Each request is
+        then answered with only the fields that were requested, in the order that Facebook returned them.
+
+        The posts published by each page are indexed by the time ranges that have been searched, so that a search
+        which overlaps a previous search only requests the parts of its range which haven't been searched yet.
+
+        This client is safe to share between threads, provided the wrapped client is.
+
+        :param facebook: Facebook client to make the requests with.
+        :type facebook: src.lib.throttled_facebook_client.ThrottledFacebookClient
+        :param comments_sync: If provided, comments are downloaded incrementally via this sync, so only the comments
+                              created since the previous run are downloaded. Otherwise, all the comments on each post
+                              are downloaded.
+        :type comments_sync: src.lib.facebook_comments_sync.FacebookCommentsSync | None
+        """
+        self.facebook = facebook
+        self.comments_sync = comments_sync
+
+        self._lock = threading.Lock()
+        self._key_locks = dict()  # of cache key -> threading.Lock
+
+        self._posts = dict()  # of post id -> post
+        self._comments = dict()  # of post id -> list of comment
+        self._page_post_ids = dict()  # of page id -> set of post id
+        self._page_searched_ranges = dict()  # of page id -> list of (datetime, datetime), sorted and non-overlapping
+
+    @staticmethod
+    def _project(obj, fields):
+        """
+        Returns a copy of a Facebook object containing only the given fields and its id.
+        """
+        if fields is None:
+            return copy.deepcopy(obj)
+
+        # Field specifications may include nested fields and modifiers e.g. "from{id}" or "comments.limit(0)", but
+        # only the field name before these is used as the key in the response.
+        keys = {field.split("{")[0].split(".")[0] for field in fields}
+        keys.add("id")
+        return {k: copy.deepcopy(v) for k, v in obj.items() if k in keys}
+
+    def _get_key_lock(self, key):
+        with self._lock:
+            if key not in self._key_locks:
+                self._key_locks[key] = threading.Lock()
+            return self._key_locks[key]
+
+    @staticmethod
+    def is_created_in_range(obj, created_after=None, created_before=None):
+        """
+        Returns whether a Facebook object was created in the time range that `get_posts_published_by_page` searches
+        when given the same bounds.
+
+        Searches are half-open, as with the Graph API's `since` and `until` parameters: objects created exactly at
+        `created_after` are included, and objects created exactly at `created_before` are not. This means a range can
+        be split into consecutive sub-ranges and searched piece by piece without missing or repeating any posts.
+
+        :param obj: Facebook object with a 'created_time'.
+        :type obj: dict
+        :param created_after: Start of the time range (inclusive), or None if the range has no start.
+        :type created_after: datetime.datetime | None
+        :param created_before: End of the time range (exclusive), or None if the range has no end.
+        :type created_before: datetime.datetime | None
+        :rtype: bool
+        """
+        created_time = isoparse(obj["created_time"])
+        return (created_after is None or created_after <= created_time) and \
+            (created_before is None or created_time < created_before)
+
+    def get_post(self, post_id, fields=None):
+        with self._get_key_lock(("post", post_id)):
+            if post_id not in self._posts:
+                self._posts[post_id] = self.facebook.get_post(post_id, fields=self.POST_FIELDS)
+            else:
+                log.debug(f"Using cached post {post_id}")
+        return self._project(self._posts[post_id], fields)
+
+    def get_all_comments_on_post(self, post_id, raw_export_log_file=None, fields=None):
+        """
+        :param raw_export_log_file: File to log the raw data returned by Facebook to. Nothing is logged if the comments
+                                    on this post were already downloaded earlier in this run.
+        :type raw_export_log_file: file-like | None
+        """
+        with self._get_key_lock(("comments", post_id)):
+            if post_id in self._comments:
+                log.debug(f"Using cached comments on post {post_id}")
+            elif self.comments_sync is not None:
+                self._comments[post_id] = self.comments_sync.sync(
+                    post_id, self.COMMENT_FIELDS, raw_export_log_file=raw_export_log_file)
+            else:
+                self._comments[post_id] = self.facebook.get_all_comments_on_post(
+                    post_id, raw_export_log_file=raw_export_log_file, fields=self.COMMENT_FIELDS)
+        return [self._project(comment, fields) for comment in self._comments[post_id]]
+
+    def _get_unsearched_ranges(self, page_id, created_after, created_before):
+        unsearched_ranges = []
+        range_start = created_after
+        for searched_start, searched_end in self._page_searched_ranges.get(page_id, []):
+            if searched_end <= range_start:
+                continue
+            if searched_start >= created_before:
+                break
+            if searched_start > range_start:
+                unsearched_ranges.append((range_start, searched_start))
+            range_start = max(range_start, searched_end)
+        if range_start < created_before:
+            unsearched_ranges.append((range_start, created_before))
+        return unsearched_ranges
+
+    def _add_searched_range(self, page_id, created_after, created_before):
+        merged_ranges = []
+        for searched_start, searched_end in sorted(self._page_searched_ranges.get(page_id, []) +
+                                                   [(created_after, created_before)]):
+            if len(merged_ranges) > 0 and searched_start <= merged_ranges[-1][1]:
+                merged_ranges[-1] = (merged_ranges[-1][0], max(merged_ranges[-1][1], searched_end))
+            else:
+                merged_ranges.append((searched_start, searched_end))
+        self._page_searched_ranges[page_id] = merged_ranges
+
+    def get_posts_published_by_page(self, page_id, fields=None, created_after=None, created_before=None):
+        """
+        :param created_after: Start of the time range to search (inclusive).
+        :type created_after: datetime.datetime
+        :param created_before: End of the time range to search (exclusive).
+        :type created_before: datetime.datetime
+        """
+        assert created_after is not None and created_before is not None, \
+            "CachedFacebookClient only supports searching bounded time ranges"
+
+        with self._get_key_lock(("page", page_id)):
+            unsearched_ranges = self._get_unsearched_ranges(page_id, created_after, created_before)
+
+            fetched_posts = []
+            for range_start, range_end in unsearched_ranges:
+                fetched_posts.extend(self.facebook.get_posts_published_by_page(
+                    page_id, fields=self.POST_FIELDS, created_after=range_start, created_before=range_end))
+            for post in fetched_posts:
+                self._posts.setdefault(post["id"], post)
+                self._page_post_ids.setdefault(page_id, set()).add(post["id"])
+            self._add_searched_range(page_id, created_after, created_before)
+
+            if unsearched_ranges == [(created_after, created_before)]:
+                # None of this range had been searched before, so return the posts exactly as Facebook returned them.
+                posts = fetched_posts
+            else:
+                log.debug(f"Using the cached index of posts on page {page_id} for the range "
+                          f"{created_after.isoformat()} to {created_before.isoformat()}")
+                posts = [
+                    self._posts[post_id] for post_id in self._page_post_ids.get(page_id, set())
+                    if self.is_created_in_range(self._posts[post_id], created_after, created_before)
+                ]
+                # Facebook returns posts newest first.
+                posts.sort(key=lambda post: isoparse(post["created_time"]), reverse=True)
+
+        return [self._project(post, fields) for post in posts]
+
+    def get_metrics_for_post(self, post_id, metrics, **kwargs):
+        return self.facebook.get_metrics_for_post(post_id, metrics, **kwargs)
@@ -0,0 +1,131 @@
+import sqlite3
+import threading
+
+from core_data_modules.logging import Logger
+from core_data_modules.util import IOUtils
+
+log = Logger(__name__)
+
+
+class CachedUuidTable(object):
+    # Maximum number of values to bind in a single SQLite query. Older SQLite builds reject queries with more than
+    # 999 bound parameters.
+    _QUERY_BATCH_SIZE = 500
+
+    def __init__(self, uuid_table, table_name, cache_path):
+        """
+        Read-through/write-through cache of a data <-> uuid table, stored in a local SQLite database.
+
+        Data <-> uuid mappings never change once they have been created, so every mapping the wrapped table returns is
+        cached indefinitely. Lookups are served from the cache where possible, and all the values which missed the
+        cache in a batch lookup are requested from the wrapped table in a single batch call.
+
+        The cache contains the identifiable data (e.g. phone numbers) alongside the uuids which de-identify it, so it
+        must be stored with the same care as the uuid table itself, and never inside the data root, which is exported
+        and backed up.
+
+        :param uuid_table: Data <-> uuid table to cache. This is normally a FirestoreUuidTable, but can be a
+                           src.lib.local_uuid_table.LocalUuidTable to run offline.
+        :type uuid_table: id_infrastructure.firestore_uuid_table.FirestoreUuidTable
+        :param table_name: Name of the wrapped table. This allows one cache file to be shared by multiple tables.
+        :type table_name: str
+        :param cache_path: Path to the SQLite database to cache the mappings in. This is created if it doesn't exist.
+        :type cache_path: str
+        """
+        self.uuid_table = uuid_table
+        self.table_name = table_name
+        self.cache_path = cache_path
+
+        self.hits = 0
+        self.misses = 0
+
+        # Lookups may be made concurrently from multiple fetch threads, so share one connection between all threads
+        # and serialise access to it. The lock is only held while accessing the database, so that lookups which miss
+        # the cache don't wait for each others' requests to the wrapped table.
+        self._lock = threading.Lock()
+        IOUtils.ensure_dirs_exist_for_file(cache_path)
+        self._db = sqlite3.connect(cache_path, check_same_thread=False)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS mappings ("
+                             "table_name TEXT NOT NULL, data TEXT NOT NULL, uuid TEXT NOT NULL, "
+                             "PRIMARY KEY (table_name, data))")
+            self._db.execute("CREATE UNIQUE INDEX IF NOT EXISTS mappings_uuid ON mappings (table_name, uuid)")
+
+    def _read_cached(self, key_column, value_column, keys):
+        cached = dict()
+        keys = list(keys)
+        for i in range(0, len(keys), self._QUERY_BATCH_SIZE):
+            batch = keys[i:i + self._QUERY_BATCH_SIZE]
+            rows = self._db.execute(
+                f"SELECT {key_column}, {value_column} FROM mappings "
+                f"WHERE table_name = ? AND {key_column} IN ({', '.join('?' * len(batch))})",
+                [self.table_name, *batch]
+            )
+            cached.update(rows)
+        return cached
+
+    def _write_cached(self, data_to_uuid):
+        with self._db:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO mappings (table_name, data, uuid) VALUES (?, ?, ?)",
+                [(self.table_name, data, uuid) for data, uuid in data_to_uuid.items()]
+            )
+
+    def _lookup_batch(self, keys, key_column, value_column, fetch_misses_fn):
+        keys = set(keys)
+        with self._lock:
+            results = self._read_cached(key_column, value_column, keys)
+        misses = [key for key in keys if key not in results]
+
+        if len(misses) > 0:
+            # Concurrent lookups may request the same misses. This is harmless, because the wrapped table returns the
+            # same mapping for each and the cache ignores mappings it already has.
+            fetched = fetch_misses_fn(misses)
+            with self._lock:
+                if key_column == "data":
+                    self._write_cached(fetched)
+                else:
+                    self._write_cached({data: uuid for uuid, data in fetched.items()})
+            results.update(fetched)
+
+        with self._lock:
+            self.hits += len(keys) - len(misses)
+            self.misses += len(misses)
+
+        log.debug(f"UUID table cache lookup of {len(keys)} {key_column} values: "
+                  f"{len(keys) - len(misses)} hits, {len(misses)} misses")
+        return results
+
+    def data_to_uuid_batch(self, list_of_data):
+        """
+        :param list_of_data: Data to look up the uuids of. New uuids are created in the wrapped table for any data which
+                             isn't in the table yet.
+        :type list_of_data: iterable of str
+        :return: Dictionary of data -> uuid.
+        :rtype: dict of str -> str
+        """
+        return self._lookup_batch(list_of_data, "data", "uuid", self.uuid_table.data_to_uuid_batch)
+
+    def uuid_to_data_batch(self, uuids):
+        """
+        :param uuids: Uuids to look up the data of.
+        :type uuids: iterable of str
+        :return: Dictionary of uuid -> data.
+        :rtype: dict of str -> str
+        """
+        return self._lookup_batch(uuids, "uuid", "data", self.uuid_table.uuid_to_data_batch)
+
+    def data_to_uuid(self, data):
+        return self.data_to_uuid_batch([data])[data]
+
+    def uuid_to_data(self, uuid):
+        return self.uuid_to_data_batch([uuid])[uuid]
+
+    def log_stats(self):
+        total = self.hits + self.misses
+        hit_rate = 0 if total == 0 else self.hits / total
+        log.info(f"UUID table cache '{self.cache_path}': {self.hits} hits, {self.misses} misses "
+                 f"({hit_rate:.1%} hit rate)")
+
+    def close(self):
+        self._db.close()
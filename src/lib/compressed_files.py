@@ -0,0 +1,143 @@
+import gzip
+import io
+import os
+from contextlib import contextmanager
+
+# File extension of each supported compression format.
+COMPRESSION_EXTENSIONS = {
+    "gzip": ".gz",
+    "zstd": ".zst"
+}
+
+
+def is_compression_available(compression):
+    """
+    :param compression: Compression format, one of the keys of COMPRESSION_EXTENSIONS.
+    :type compression: str
+    :return: Whether the packages needed to read and write files in this compression format are installed.
+             zstd needs the zstandard package, which isn't one of this project's dependencies.
+    :rtype: bool
+    """
+    if compression != "zstd":
+        return True
+
+    try:
+        import zstandard
+    except ImportError:
+        return False
+    return True
+
+
+def with_compression(path, compression):
+    """
+    :param path: Path of the uncompressed file e.g. "raw_data/flow.jsonl".
+    :type path: str
+    :param compression: Compression format, one of the keys of COMPRESSION_EXTENSIONS, or None for no compression.
+    :type compression: str | None
+    :return: Path to the file compressed in the given format e.g. "raw_data/flow.jsonl.gz".
+    :rtype: str
+    """
+    if compression is None:
+        return path
+    return f"{path}{COMPRESSION_EXTENSIONS[compression]}"
+
+
+def _split_compression(path):
+    """
+    :return: The uncompressed path of the given file, and the compression format implied by its extension.
+    :rtype: (str, str | None)
+    """
+    for compression, extension in COMPRESSION_EXTENSIONS.items():
+        if path.endswith(extension):
+            return path[:-len(extension)], compression
+    return path, None
+
+
+def compression_of(path):
+    """
+    :return: The compression format of the file at `path`, as given by its extension, or None if it is uncompressed.
+    :rtype: str | None
+    """
+    return _split_compression(path)[1]
+
+
+def _variants(path):
+    uncompressed_path, _ = _split_compression(path)
+    return [uncompressed_path] + [with_compression(uncompressed_path, compression)
+                                  for compression in COMPRESSION_EXTENSIONS]
+
+
+def find_file(path):
+    """
+    Finds the file at the given path in any compression format.
+
+    :param path: Path of the file to find, with or without a compression extension.
+    :type path: str
+    :return: Path to the file, with the extension of the format it exists in, or None if the file doesn't exist in any
+             format. If the file exists in more than one format, the most recently modified is returned.
+    :rtype: str | None
+    """
+    existing_paths = [variant for variant in _variants(path) if os.path.exists(variant)]
+    if len(existing_paths) == 0:
+        return None
+    return max(existing_paths, key=os.path.getmtime)
+
+
+def _open(path, mode, compression):
+    assert mode in {"r", "w", "a"}, f"Unsupported mode '{mode}'; compressed files can only be opened in text mode"
+
+    if compression is None:
+        return open(path, mode, encoding="utf-8")
+
+    if compression == "gzip":
+        # Appending writes a new gzip member, and reads decompress every member in turn.
+        return gzip.open(path, f"{mode}t", encoding="utf-8")
+
+    assert compression == "zstd", f"Unknown compression format '{compression}'"
+    # Imported here so that the zstandard package is only required when zstd compression is used.
+    import zstandard
+
+    if mode == "r":
+        # Appending writes a new zstd frame, so read across frames.
+        binary_file = zstandard.ZstdDecompressor().stream_reader(
+            open(path, "rb"), read_across_frames=True, closefd=True)
+    else:
+        binary_file = zstandard.ZstdCompressor().stream_writer(open(path, f"{mode}b"), closefd=True)
+    return io.TextIOWrapper(binary_file, encoding="utf-8")
+
+
+def open_file(path, mode="r"):
+    """
+    Opens a text file, transparently compressing or decompressing it according to its file extension
+    (see COMPRESSION_EXTENSIONS). Files are streamed through the compressor, so the whole file is never held in memory.
+
+    :param path: Path to the file to open.
+    :type path: str
+    :param mode: One of "r", "w", or "a".
+    :type mode: str
+    :return: Text file object.
+    :rtype: file-like
+    """
+    return _open(path, mode, compression_of(path))
+
+
+@contextmanager
+def atomic_write(path):
+    """
+    Context manager for writing a text file in the compression format given by its file extension.
+
+    The file is written to a temporary file which is only moved into place once the write is complete, so the file at
+    `path` is never left partially written. Once the new file is in place, any copies of the file in other compression
+    formats are deleted, so that readers using `find_file` never find an out of date copy.
+
+    :param path: Path to write to.
+    :type path: str
+    """
+    temp_path = f"{path}.tmp"
+    with _open(temp_path, "w", compression_of(path)) as f:
+        yield f
+    os.replace(temp_path, path)
+
+    for variant in _variants(path):
+        if variant != path and os.path.exists(variant):
+            os.remove(variant)
@@ -0,0 +1,126 @@
+import json
+
+from core_data_modules.logging import Logger
+from core_data_modules.util import IOUtils
+from dateutil.parser import isoparse
+
+from src.lib.compressed_files import atomic_write, find_file, open_file, with_compression
+
+log = Logger(__name__)
+
+
+class FacebookCommentsSync(object):
+    def __init__(self, facebook, raw_data_dir, compression=None):
+        """
+        Keeps a local export of all the comments on each Facebook post up to date.
+
+        The comments on each post are stored in `{raw_data_dir}/{post_id}_comments_raw.json`, alongside a cursor file
+        `{raw_data_dir}/{post_id}_comments_sync.json` which records the latest `created_time` seen and the fields the
+        comments were downloaded with, so that each sync only needs to request the comments created since the previous
+        sync.
+
+        Comments which are edited, hidden, or deleted after they were first downloaded are not updated by a sync.
+        Delete a post's cursor file to re-download all the comments on that post.
+
+        :param facebook: Facebook client to download comments with.
+        :type facebook: src.lib.throttled_facebook_client.ThrottledFacebookClient
+        :param raw_data_dir: Directory to store the comments exports and cursors in.
+        :type raw_data_dir: str
+        :param compression: Compression format to write the comments exports in (see
+                            src.lib.compressed_files.COMPRESSION_EXTENSIONS), or None to write them uncompressed.
+                            Previous exports are loaded in whichever format they were written in.
+        :type compression: str | None
+        """
+        self.facebook = facebook
+        self.raw_data_dir = raw_data_dir
+        self.compression = compression
+
+    def _raw_comments_path(self, post_id):
+        return with_compression(f"{self.raw_data_dir}/{post_id}_comments_raw.json", self.compression)
+
+    def _cursor_path(self, post_id):
+        return f"{self.raw_data_dir}/{post_id}_comments_sync.json"
+
+    def _load_cursor(self, post_id):
+        if find_file(self._raw_comments_path(post_id)) is None:
+            return None
+        try:
+            with open(self._cursor_path(post_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _save(self, post_id, comments, fields):
+        latest_created_time = None
+        for comment in comments:
+            if latest_created_time is None or isoparse(comment["created_time"]) > isoparse(latest_created_time):
+                latest_created_time = comment["created_time"]
+
+        raw_comments_path = self._raw_comments_path(post_id)
+        IOUtils.ensure_dirs_exist_for_file(raw_comments_path)
+        with atomic_write(raw_comments_path) as f:
+            json.dump(comments, f)
+
+        # Write the cursor last, so that it never refers to comments which haven't been saved.
+        with open(self._cursor_path(post_id), "w") as f:
+            json.dump({"LatestCreatedTime": latest_created_time, "Fields": fields}, f)
+
+    @staticmethod
+    def merge_comments(comments, new_comments):
+        """
+        Merges newly downloaded comments into a list of comments. New versions of existing comments replace the
+        existing versions in place, and all other new comments are appended in order.
+
+        :type comments: list of dict
+        :type new_comments: list of dict
+        :rtype: list of dict
+        """
+        merged = {comment["id"]: comment for comment in comments}
+        for comment in new_comments:
+            merged[comment["id"]] = comment
+        return list(merged.values())
+
+    def sync(self, post_id, fields, raw_export_log_file=None):
+        """
+        Updates the local export of the comments on a post with the comments created since the last sync, saves the
+        export and cursor, and returns all the comments on the post.
+
+        If there is no previous export for this post, or it was downloaded with different fields, all the comments
+        are downloaded from Facebook.
+
+        :param post_id: Id of the post to sync the comments on.
+        :type post_id: str
+        :param fields: Fields to download for each comment.
+        :type fields: list of str
+        :param raw_export_log_file: File to log the raw data returned by Facebook to.
+        :type raw_export_log_file: file-like | None
+        :return: All the comments on the post, in chronological order of first download.
+        :rtype: list of dict
+        """
+        cursor = self._load_cursor(post_id)
+        if cursor is not None and cursor["Fields"] != fields:
+            log.info(f"The comment fields to download changed since the comments on post {post_id} were exported; "
+                     f"will fetch all comments on this post")
+            cursor = None
+
+        if cursor is None:
+            comments = self.facebook.get_all_comments_on_post(
+                post_id, raw_export_log_file=raw_export_log_file, fields=fields)
+            log.info(f"Fetched all {len(comments)} comments on post {post_id}")
+        else:
+            with open_file(find_file(self._raw_comments_path(post_id))) as f:
+                comments = json.load(f)
+
+            if cursor["LatestCreatedTime"] is None:
+                new_comments = self.facebook.get_all_comments_on_post(
+                    post_id, raw_export_log_file=raw_export_log_file, fields=fields)
+            else:
+                # `since` is inclusive, so the comments created at exactly the cursor are downloaded again.
+                # This is harmless because downloaded comments replace the existing comments with the same id.
+                new_comments = self.facebook.get_comments_on_post_created_since(
+                    post_id, isoparse(cursor["LatestCreatedTime"]), fields, raw_export_log_file=raw_export_log_file)
+            comments = self.merge_comments(comments, new_comments)
+            log.info(f"Fetched {len(new_comments)} new comments on post {post_id}; post has {len(comments)} comments")
+
+        self._save(post_id, comments, fields)
+        return comments
@@ -0,0 +1,273 @@
+import json
+from io import StringIO
+
+from core_data_modules.traced_data import Metadata, TracedData
+from core_data_modules.traced_data.io import TracedDataJsonIO
+
+# Fields of each entry in the history of a TracedData serialized by TracedDataJsonIO. Each entry holds the data set by
+# one update and the previous entry, so the current value of a key is its value in the newest entry which sets it.
+# Entries with any other fields (e.g. those recording `hide_keys`) can't be projected.
+_SERIALIZED_ENTRY_FIELDS = {"data", "metadata", "sha", "prev"}
+
+# Public TracedData methods which aren't overridden by LazyTracedData, and so are run on the full TracedData rather
+# than on a LazyTracedData, whose attributes aren't a TracedData's.
+_DELEGATED_METHODS = ["copy", "get_history", "serialize"]
+
+# Whether TracedDataJsonIO's serialization can be projected by _project_serialized, or None if this hasn't been
+# checked yet in this process. See _is_projection_supported.
+_projection_supported = None
+
+
+def _project_serialized(serialized, projected_keys):
+    """
+    Reads the current values of the given keys from a TracedData's JSON serialization, without deserializing the
+    TracedData.
+
+    :param serialized: A TracedData, as parsed from its line of a TracedData JSONL file.
+    :type serialized: dict
+    :param projected_keys: Keys to read the values of.
+    :type projected_keys: frozenset of str
+    :return: Dictionary of projected key -> value, for each of the `projected_keys` which the TracedData contains, or
+             None if the values can't be read without deserializing the TracedData (e.g. because it has had another
+             TracedData appended to it, or has had keys hidden).
+    :rtype: dict | None
+    """
+    projected_data = dict()
+    unresolved_keys = set(projected_keys)
+    entry = serialized
+    while entry is not None and len(unresolved_keys) > 0:
+        if not isinstance(entry, dict) or entry.keys() != _SERIALIZED_ENTRY_FIELDS or \
+                not isinstance(entry["data"], dict):
+            return None
+
+        # An appended TracedData is serialized as a dict under a key of its own, and may set any of the unresolved
+        # keys, so this entry can't be projected whichever key it's under.
+        if any(isinstance(value, dict) for value in entry["data"].values()):
+            return None
+
+        for key in unresolved_keys.intersection(entry["data"].keys()):
+            projected_data[key] = entry["data"][key]
+        unresolved_keys.difference_update(entry["data"].keys())
+        entry = entry["prev"]
+
+    return projected_data
+
+
+def _is_projection_supported():
+    """
+    Checks that projecting TracedData serialized by the installed TracedDataJsonIO gives the same values as
+    deserializing it, for a TracedData which has been updated with each of `append_data`, `append_traced_data`, and
+    `hide_keys`.
+
+    A projection of a serialized TracedData is only ever used if it can be read from entries of the expected shape,
+    but this guards against a serialization which records some updates in entries of that same shape (e.g. hiding
+    a key by setting it to a marker value), which _project_serialized would misread. The check is made once per
+    process.
+
+    :return: Whether TracedData can be loaded lazily.
+    :rtype: bool
+    """
+    global _projection_supported
+    if _projection_supported is not None:
+        return _projection_supported
+
+    def metadata():
+        return Metadata("lazy_traced_data", Metadata.get_call_location(), "2021-01-01T00:00:00+00:00")
+
+    probes = []
+    for update in ["append_data", "append_traced_data", "hide_keys"]:
+        td = TracedData({"a": "a0", "b": "b0"}, metadata())
+        td.append_data({"a": "a1", "c": "c1"}, metadata())
+        if update == "append_data":
+            td.append_data({"b": "b2"}, metadata())
+        elif update == "append_traced_data":
+            td.append_traced_data("appended", TracedData({"b": "b2", "d": "d2"}, metadata()), metadata())
+        else:
+            td.hide_keys({"a", "c"}, metadata())
+        probes.append(td)
+
+    f = StringIO()
+    TracedDataJsonIO.export_traced_data_iterable_to_jsonl(probes, f)
+    lines = f.getvalue().splitlines(keepends=True)
+
+    projected_keys = frozenset({"a", "b", "c", "d", "e"})
+    _projection_supported = True
+    for line in lines:
+        projected_data = _project_serialized(json.loads(line), projected_keys)
+        decoded = TracedDataJsonIO.import_jsonl_to_traced_data_iterable(StringIO(line))[0]
+        if projected_data is not None and \
+                projected_data != {key: decoded[key] for key in projected_keys if key in decoded}:
+            _projection_supported = False
+
+    return _projection_supported
+
+
+class LazyTracedData(TracedData):
+    def __init__(self, serialized, projected_data, projected_keys):
+        """
+        Stand-in for a TracedData loaded from a TracedData JSONL file, which keeps the TracedData as its serialized JSON
+        line and only decodes the values of a projected set of keys.
+
+        Reads of projected keys, and of keys set since loading, are served without decoding the rest of the TracedData.
+        Updates made with `append_data`, `append_traced_data`, and `hide_keys` are recorded, and are replayed onto the
+        full TracedData the first time anything else is needed from it (e.g. an unprojected key, its history, or its
+        serialization). From then on, this object delegates everything to that TracedData, so it behaves exactly as if
+        the TracedData had been loaded eagerly.
+
+        This is a TracedData, so that it can be passed anywhere a TracedData is expected. The TracedData methods in
+        _DELEGATED_METHODS, and every read of TracedData's private attributes (e.g. by another TracedData this is
+        appended to), are delegated to the full TracedData.
+
+        :param serialized: The TracedData's line of a TracedData JSONL file.
+        :type serialized: str
+        :param projected_data: The TracedData's values of each of the `projected_keys` which it contains.
+        :type projected_data: dict
+        :param projected_keys: Keys whose values were decoded into `projected_data`.
+        :type projected_keys: frozenset of str
+        """
+        # TracedData.__init__ isn't called, because this object doesn't hold any TracedData state of its own.
+        # Attributes are prefixed with `_lazy_` so that they can't shadow TracedData's private attributes.
+        self._lazy_serialized = serialized
+        self._lazy_data = dict(projected_data)
+        # Keys whose presence in the TracedData is known without decoding it. Any of these keys which isn't in
+        # self._lazy_data isn't in the TracedData.
+        self._lazy_known_keys = set(projected_keys)
+        self._lazy_updates = []  # of (TracedData method name, args), in the order they were made
+        self._lazy_traced_data = None
+
+    @classmethod
+    def from_jsonl_line(cls, line, projected_keys):
+        """
+        Loads a line of a TracedData JSONL file, decoding only the values of the projected keys.
+
+        If the projected keys can't be read without deserializing the TracedData (including when the installed
+        TracedDataJsonIO's serialization can't be projected at all), the TracedData is deserialized eagerly instead, so
+        that the line is only ever deserialized once.
+
+        :param line: Line of a TracedData JSONL file.
+        :type line: str
+        :param projected_keys: Keys to decode the values of.
+        :type projected_keys: frozenset of str
+        :rtype: LazyTracedData | core_data_modules.traced_data.TracedData
+        """
+        projected_data = _project_serialized(json.loads(line), projected_keys) if _is_projection_supported() else None
+        if projected_data is None:
+            return TracedDataJsonIO.import_jsonl_to_traced_data_iterable(StringIO(line))[0]
+        return cls(line, projected_data, projected_keys)
+
+    def is_materialised(self):
+        return self._lazy_traced_data is not None
+
+    def materialise(self):
+        """
+        :return: The full TracedData, with all the updates made to this object applied.
+        :rtype: core_data_modules.traced_data.TracedData
+        """
+        if self._lazy_traced_data is None:
+            td = TracedDataJsonIO.import_jsonl_to_traced_data_iterable(StringIO(self._lazy_serialized))[0]
+            for method_name, args in self._lazy_updates:
+                getattr(td, method_name)(*args)
+
+            self._lazy_traced_data = td
+            self._lazy_serialized = None
+            self._lazy_data = None
+            self._lazy_known_keys = None
+            self._lazy_updates = None
+        return self._lazy_traced_data
+
+    def projection_matches_decoded(self):
+        """
+        Materialises this TracedData, and checks that the values of the projected keys which were read when it was
+        loaded are the same as the values in the fully decoded TracedData.
+
+        :return: Whether the projected values match the decoded values.
+        :rtype: bool
+        """
+        assert not self.is_materialised() and len(self._lazy_updates) == 0, \
+            "The projection can only be checked before this TracedData is updated or materialised"
+        projected_data = self._lazy_data
+        projected_keys = self._lazy_known_keys
+
+        td = self.materialise()
+        return projected_data == {key: td[key] for key in projected_keys if key in td}
+
+    def append_data(self, new_data, new_metadata):
+        if self._lazy_traced_data is not None:
+            return self._lazy_traced_data.append_data(new_data, new_metadata)
+
+        self._lazy_updates.append(("append_data", (new_data, new_metadata)))
+        self._lazy_data.update(new_data)
+        self._lazy_known_keys.update(new_data.keys())
+
+    def append_traced_data(self, key_of_appended, traced_data, new_metadata):
+        if self._lazy_traced_data is not None:
+            return self._lazy_traced_data.append_traced_data(key_of_appended, traced_data, new_metadata)
+
+        if isinstance(traced_data, LazyTracedData):
+            traced_data = traced_data.materialise()
+        # The keys which the appended TracedData adds to this one are only known after decoding it, so only the
+        # values of projected keys are kept.
+        self._lazy_updates.append(("append_traced_data", (key_of_appended, traced_data, new_metadata)))
+        self._lazy_data.update({key: traced_data[key] for key in self._lazy_known_keys if key in traced_data})
+
+    def hide_keys(self, keys, new_metadata):
+        if self._lazy_traced_data is not None:
+            return self._lazy_traced_data.hide_keys(keys, new_metadata)
+
+        self._lazy_updates.append(("hide_keys", (keys, new_metadata)))
+        for key in keys:
+            self._lazy_data.pop(key, None)
+        self._lazy_known_keys.update(keys)
+
+    def __getitem__(self, key):
+        if self._lazy_traced_data is None and key in self._lazy_known_keys:
+            return self._lazy_data[key]
+        return self.materialise()[key]
+
+    def __contains__(self, key):
+        if self._lazy_traced_data is None and key in self._lazy_known_keys:
+            return key in self._lazy_data
+        return key in self.materialise()
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def __iter__(self):
+        return iter(self.materialise())
+
+    def __len__(self):
+        return len(self.materialise())
+
+    def keys(self):
+        return self.materialise().keys()
+
+    def items(self):
+        return self.materialise().items()
+
+    def values(self):
+        return self.materialise().values()
+
+    def __getstate__(self):
+        return self.__dict__.copy()
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def __getattr__(self, name):
+        # Only called for attributes not found on this object, i.e. TracedData's private attributes such as `_data`
+        # and `_prev`. Special names and this object's own attributes are never delegated, so that e.g. copying or
+        # unpickling an instance, which looks these up before its attributes are set, doesn't recurse.
+        if name.startswith("__") or name.startswith("_lazy_"):
+            raise AttributeError(name)
+        return getattr(self.materialise(), name)
+
+
+def _delegate_to_materialised(method_name):
+    def delegated(self, *args, **kwargs):
+        return getattr(self.materialise(), method_name)(*args, **kwargs)
+    delegated.__name__ = method_name
+    return delegated
+
+
+for _method_name in _DELEGATED_METHODS:
+    setattr(LazyTracedData, _method_name, _delegate_to_materialised(_method_name))
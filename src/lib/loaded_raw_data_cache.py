@@ -0,0 +1,130 @@
+import glob
+import hashlib
+import json
+import mmap
+import os
+import pickle
+import time
+
+from core_data_modules.logging import Logger
+from core_data_modules.util import IOUtils
+
+log = Logger(__name__)
+
+
+class LoadedRawDataCache(object):
+    # Version of the loaded data format. Increment this whenever a change to LoadData changes the data it produces
+    # from the same raw data files, so that snapshots written by earlier versions are no longer used.
+    VERSION = 2
+
+    _HASH_BLOCK_SIZE_BYTES = 1024 * 1024
+
+    def __init__(self, cache_dir):
+        """
+        Content-addressed cache of the data produced by LoadData.load_raw_data.
+
+        Each snapshot is stored as a pickle at `{cache_dir}/{key}.pickle`, where the key is a hash of the contents of
+        the raw data files the data was loaded from and of everything else the loaded data depends on. A snapshot is
+        therefore only ever used if none of its inputs have changed since it was written, and doesn't need to be
+        explicitly invalidated. Only the most recently written snapshot is kept.
+
+        Snapshots are pickles, and loading a pickle can run arbitrary code, so the cache directory must only be
+        writable by users trusted to run the pipeline. Keep it outside the data root, which is shared more widely.
+
+        :param cache_dir: Directory to store the snapshots in. This is created if it doesn't exist.
+        :type cache_dir: str
+        """
+        self.cache_dir = cache_dir
+
+    @classmethod
+    def _hash_file(cls, path):
+        file_hash = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(cls._HASH_BLOCK_SIZE_BYTES), b""):
+                file_hash.update(block)
+        return file_hash.hexdigest()
+
+    @classmethod
+    def get_key(cls, user, pipeline_configuration_dict, raw_flow_paths, projected_keys=None):
+        """
+        :param user: Identifier of the user the data is loaded by, which is recorded in the loaded TracedData's
+                     Metadata.
+        :type user: str
+        :param pipeline_configuration_dict: The pipeline configuration the data is loaded with, as parsed from the
+                                            pipeline configuration file. The whole configuration is part of the key,
+                                            so that changing any configuration option invalidates the snapshot.
+        :type pipeline_configuration_dict: dict
+        :param raw_flow_paths: Paths to the raw data files of the activation flows then the survey flows.
+        :type raw_flow_paths: list of str
+        :param projected_keys: Keys which the activation messages were lazily loaded with, or None if they were loaded
+                               eagerly.
+        :type projected_keys: collection of str | None
+        :return: Key of the snapshot of the data loaded from the given inputs.
+        :rtype: str
+        """
+        key = hashlib.sha256()
+        key.update(json.dumps({
+            "Version": cls.VERSION,
+            "User": user,
+            "PipelineConfiguration": pipeline_configuration_dict,
+            "ProjectedKeys": None if projected_keys is None else sorted(projected_keys),
+            # The hashes are of the files as stored, so re-compressing a file also invalidates the snapshot.
+            "RawFlowFiles": [[os.path.basename(path), cls._hash_file(path)] for path in raw_flow_paths]
+        }, sort_keys=True).encode("utf-8"))
+        return key.hexdigest()
+
+    def _snapshot_path(self, key):
+        return f"{self.cache_dir}/{key}.pickle"
+
+    def load(self, key):
+        """
+        :param key: Key of the snapshot to load, as returned by `get_key`.
+        :type key: str
+        :return: The data in the snapshot with the given key, or None if there is no usable snapshot with that key.
+        :rtype: list of core_data_modules.traced_data.TracedData | None
+        """
+        snapshot_path = self._snapshot_path(key)
+        if not os.path.exists(snapshot_path):
+            log.info(f"No loaded raw data snapshot found at '{snapshot_path}'")
+            return None
+
+        start = time.perf_counter()
+        try:
+            # Unpickle directly from a memory map of the file, rather than reading it into a separate buffer first.
+            with open(snapshot_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as snapshot:
+                data = pickle.loads(snapshot)
+        except Exception as e:
+            # e.g. the snapshot was written by an incompatible version of a library the TracedData depends on.
+            log.warning(f"Failed to load the loaded raw data snapshot at '{snapshot_path}', ignoring it: {e!r}")
+            return None
+        log.info(f"Loaded {len(data)} TracedData from the snapshot at '{snapshot_path}' in "
+                 f"{time.perf_counter() - start:.1f}s")
+        return data
+
+    def save(self, key, data):
+        """
+        Saves a snapshot of the given data under the given key, replacing any other snapshots in the cache.
+
+        :param key: Key to save the snapshot under, as returned by `get_key`.
+        :type key: str
+        :param data: Data to save.
+        :type data: list of core_data_modules.traced_data.TracedData
+        """
+        snapshot_path = self._snapshot_path(key)
+        temp_path = f"{snapshot_path}.tmp"
+        IOUtils.ensure_dirs_exist_for_file(snapshot_path)
+
+        log.info(f"Saving a snapshot of {len(data)} loaded TracedData to '{snapshot_path}'...")
+        try:
+            with open(temp_path, "wb") as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, RecursionError) as e:
+            # The cache is only an optimisation, so continue without it rather than failing the pipeline.
+            log.warning(f"Failed to save a snapshot of the loaded raw data, continuing without one: {e!r}")
+            os.remove(temp_path)
+            return
+        os.replace(temp_path, snapshot_path)
+
+        for other_snapshot_path in glob.glob(f"{self.cache_dir}/*.pickle"):
+            if other_snapshot_path != snapshot_path:
+                os.remove(other_snapshot_path)
@@ -0,0 +1,43 @@
+from uuid import uuid4
+
+
+class LocalUuidTable(object):
+    def __init__(self, uuid_prefix, data_to_uuid=None):
+        """
+        In-memory data <-> uuid table with the same batch interface as
+        id_infrastructure.firestore_uuid_table.FirestoreUuidTable, for running and testing the pipeline offline.
+
+        Counts the batch calls made to it, so that callers can check how many requests a real table would have
+        received.
+
+        :param uuid_prefix: Prefix to give the uuids this table creates.
+        :type uuid_prefix: str
+        :param data_to_uuid: Mappings to initialise this table with.
+        :type data_to_uuid: dict of str -> str | None
+        """
+        self.uuid_prefix = uuid_prefix
+        self._data_to_uuid = dict() if data_to_uuid is None else dict(data_to_uuid)
+        self._uuid_to_data = {uuid: data for data, uuid in self._data_to_uuid.items()}
+
+        self.batch_calls = 0
+
+    def data_to_uuid_batch(self, list_of_data):
+        self.batch_calls += 1
+        results = dict()
+        for data in list_of_data:
+            if data not in self._data_to_uuid:
+                new_uuid = f"{self.uuid_prefix}{uuid4()}"
+                self._data_to_uuid[data] = new_uuid
+                self._uuid_to_data[new_uuid] = data
+            results[data] = self._data_to_uuid[data]
+        return results
+
+    def uuid_to_data_batch(self, uuids):
+        self.batch_calls += 1
+        return {uuid: self._uuid_to_data[uuid] for uuid in uuids}
+
+    def data_to_uuid(self, data):
+        return self.data_to_uuid_batch([data])[data]
+
+    def uuid_to_data(self, uuid):
+        return self.uuid_to_data_batch([uuid])[uuid]
@@ -1,5 +1,6 @@
 from core_data_modules.logging import Logger
-from dateutil.parser import isoparse
+
+from src.lib.timestamp_cache import timestamps
 
 log = Logger(__name__)
 
@@ -95,7 +96,7 @@ class MessageFilters(object):
         filtered = []
         for td in messages:
             for time_key in time_keys:
-                if time_key in td and start_time_inclusive <= isoparse(td[time_key]) < end_time_inclusive:
+                if time_key in td and start_time_inclusive <= timestamps.parse(td[time_key]) < end_time_inclusive:
                     filtered.append(td)
                     break
 
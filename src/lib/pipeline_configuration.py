@@ -8,6 +8,7 @@ from core_data_modules.data_models import validators
 from dateutil.parser import isoparse
 
 from configuration import coding_plans
+from src.lib.compressed_files import COMPRESSION_EXTENSIONS, is_compression_available
 
 
 class PipelineConfiguration(object):
@@ -21,7 +22,8 @@ class PipelineConfiguration(object):
     def __init__(self, pipeline_name, raw_data_sources, uuid_table, operations_dashboard, timestamp_remappings,
                  source_key_remappings, project_start_date, project_end_date, filter_test_messages, move_ws_messages,
                  memory_profile_upload_bucket, data_archive_upload_bucket, bucket_dir_path,
-                 automated_analysis, drive_upload=None):
+                 automated_analysis, drive_upload=None, source_fetch_concurrency=None, raw_data_compression=None,
+                 max_load_processes=1, lazy_raw_data_loading=False, processing_shards=1):
         """
         :param pipeline_name: The name of this pipeline.
         :type pipeline_name: str
@@ -57,7 +59,29 @@ class PipelineConfiguration(object):
         :type bucket_dir_path: str
         :param automated_analysis: Different Automated analysis Script Configurations
         :type automated_analysis: AutomatedAnalysis
+        :param drive_upload: Configuration for uploading outputs to Google Drive, or None to skip Drive upload.
+        :type drive_upload: DriveUpload | None
+        :param source_fetch_concurrency: How many raw data sources to fetch in parallel. If None, sources are fetched
+                                         one after another.
+        :type source_fetch_concurrency: SourceFetchConcurrency | None
+        :param raw_data_compression: Compression format to write the raw data files in, one of "gzip" or "zstd", or None
+                                     to write uncompressed files. Raw data files are always read in the format given
+                                     by their file extension, so this can be changed between runs.
+        :type raw_data_compression: str | None
+        :param max_load_processes: The maximum number of processes to use to parse the raw data files when loading them
+                                   for processing.
+        :type max_load_processes: int
+        :param lazy_raw_data_loading: Whether to load the raw activation messages lazily, materialising only the keys
+                                      returned by `get_referenced_keys` until a stage needs the rest of a message.
+        :type lazy_raw_data_loading: bool
+        :param processing_shards: The number of shards to partition the participants into in the generate outputs
+                                  stage, to process each participant's messages in parallel. If 1, all the messages are
+                                  processed in a single process.
+        :type processing_shards: int
         """
+        if source_fetch_concurrency is None:
+            source_fetch_concurrency = SourceFetchConcurrency()
+
         self.pipeline_name = pipeline_name
         self.raw_data_sources = raw_data_sources
         self.uuid_table = uuid_table
@@ -73,6 +97,11 @@ class PipelineConfiguration(object):
         self.data_archive_upload_bucket = data_archive_upload_bucket
         self.automated_analysis = automated_analysis
         self.bucket_dir_path = bucket_dir_path
+        self.source_fetch_concurrency = source_fetch_concurrency
+        self.raw_data_compression = raw_data_compression
+        self.max_load_processes = max_load_processes
+        self.lazy_raw_data_loading = lazy_raw_data_loading
+        self.processing_shards = processing_shards
 
         PipelineConfiguration.RQA_CODING_PLANS = coding_plans.get_rqa_coding_plans(self.pipeline_name)
         PipelineConfiguration.DEMOG_CODING_PLANS = coding_plans.get_demog_coding_plans(self.pipeline_name)
@@ -129,6 +158,16 @@ class PipelineConfiguration(object):
         if "DriveUpload" in configuration_dict:
             drive_upload_paths = DriveUpload.from_configuration_dict(configuration_dict["DriveUpload"])
 
+        source_fetch_concurrency = None
+        if "SourceFetchConcurrency" in configuration_dict:
+            source_fetch_concurrency = SourceFetchConcurrency.from_configuration_dict(
+                configuration_dict["SourceFetchConcurrency"])
+
+        raw_data_compression = configuration_dict.get("RawDataCompression")
+        max_load_processes = configuration_dict.get("MaxLoadProcesses", 1)
+        lazy_raw_data_loading = configuration_dict.get("LazyRawDataLoading", False)
+        processing_shards = configuration_dict.get("ProcessingShards", 1)
+
         memory_profile_upload_bucket = configuration_dict["MemoryProfileUploadBucket"]
         data_archive_upload_bucket = configuration_dict["DataArchiveUploadBucket"]
         bucket_dir_path = configuration_dict["BucketDirPath"]
@@ -136,12 +175,36 @@ class PipelineConfiguration(object):
         return cls(pipeline_name, raw_data_sources, uuid_table, operations_dashboard, timestamp_remappings,
                    source_key_remappings, project_start_date, project_end_date, filter_test_messages,
                    move_ws_messages, memory_profile_upload_bucket, data_archive_upload_bucket, bucket_dir_path,
-                   automated_analysis, drive_upload_paths)
+                   automated_analysis, drive_upload_paths, source_fetch_concurrency, raw_data_compression,
+                   max_load_processes, lazy_raw_data_loading, processing_shards)
 
     @classmethod
     def from_configuration_file(cls, f):
         return cls.from_configuration_dict(json.load(f))
 
+    def get_referenced_keys(self):
+        """
+        :return: The keys of the raw messages which this configuration and the coding plans refer to, i.e. the keys
+                 which the pipeline stages read from most messages.
+        :rtype: set of str
+        """
+        # Includes the keys which source key translation sets on every message, so that checking for them doesn't
+        # need the rest of the message.
+        keys = {"uid", "avf_phone_id", "test_run", "sent_on", "rqa_message", "show_pipeline_key"}
+
+        for remapping in self.source_key_remappings:
+            keys.update({remapping.source_key, remapping.pipeline_key})
+        for remapping in self.timestamp_remappings:
+            keys.add(remapping.time_key)
+
+        for plan in PipelineConfiguration.RQA_CODING_PLANS + PipelineConfiguration.SURVEY_CODING_PLANS:
+            keys.update({plan.raw_field, plan.time_field, plan.run_id_field, plan.id_field})
+            for cc in plan.coding_configurations:
+                keys.add(cc.raw_field)
+
+        keys.discard(None)
+        return keys
+
     def validate(self):
         validators.validate_string(self.pipeline_name, "pipeline_name")
 
@@ -173,6 +236,26 @@ class PipelineConfiguration(object):
                 "drive_upload is not of type DriveUpload"
             self.drive_upload.validate()
 
+        assert isinstance(self.source_fetch_concurrency, SourceFetchConcurrency), \
+            "source_fetch_concurrency is not of type SourceFetchConcurrency"
+        self.source_fetch_concurrency.validate()
+
+        if self.raw_data_compression is not None:
+            validators.validate_string(self.raw_data_compression, "raw_data_compression")
+            assert self.raw_data_compression in COMPRESSION_EXTENSIONS, \
+                f"raw_data_compression must be one of {list(COMPRESSION_EXTENSIONS)}, but was " \
+                f"'{self.raw_data_compression}'"
+            assert is_compression_available(self.raw_data_compression), \
+                f"raw_data_compression is '{self.raw_data_compression}', but the package needed for this compression " \
+                f"format isn't installed (zstd needs the zstandard package)"
+
+        validators.validate_int(self.max_load_processes, "max_load_processes")
+        assert self.max_load_processes >= 1, "max_load_processes must be at least 1"
+        validators.validate_bool(self.lazy_raw_data_loading, "lazy_raw_data_loading")
+
+        validators.validate_int(self.processing_shards, "processing_shards")
+        assert self.processing_shards >= 1, "processing_shards must be at least 1"
+
         validators.validate_url(self.memory_profile_upload_bucket, "memory_profile_upload_bucket", "gs")
         validators.validate_url(self.data_archive_upload_bucket, "data_archive_upload_bucket", "gs")
         validators.validate_string(self.bucket_dir_path, "bucket_dir_path")
@@ -193,7 +276,8 @@ class RawDataSource(ABC):
 
 
 class RapidProSource(RawDataSource):
-    def __init__(self, domain, token_file_url, activation_flow_names, survey_flow_names, test_contact_uuids):
+    def __init__(self, domain, token_file_url, activation_flow_names, survey_flow_names, test_contact_uuids,
+                 max_concurrent_flow_fetches=1):
         """
         :param domain: URL of the Rapid Pro server to download data from.
         :type domain: str
@@ -207,12 +291,16 @@ class RapidProSource(RawDataSource):
                                    Runs for any of those test contacts will be tagged with {'test_run': True},
                                    and dropped when the pipeline is run with "FilterTestMessages" set to true.
         :type test_contact_uuids: list of str
+        :param max_concurrent_flow_fetches: The maximum number of flows to download and convert in parallel.
+                                            If 1, flows are fetched one after another.
+        :type max_concurrent_flow_fetches: int
         """
         self.domain = domain
         self.token_file_url = token_file_url
         self.activation_flow_names = activation_flow_names
         self.survey_flow_names = survey_flow_names
         self.test_contact_uuids = test_contact_uuids
+        self.max_concurrent_flow_fetches = max_concurrent_flow_fetches
 
         self.validate()
 
@@ -229,8 +317,10 @@ class RapidProSource(RawDataSource):
         activation_flow_names = configuration_dict.get("ActivationFlowNames", [])
         survey_flow_names = configuration_dict.get("SurveyFlowNames", [])
         test_contact_uuids = configuration_dict.get("TestContactUUIDs", [])
+        max_concurrent_flow_fetches = configuration_dict.get("MaxConcurrentFlowFetches", 1)
 
-        return cls(domain, token_file_url, activation_flow_names, survey_flow_names, test_contact_uuids)
+        return cls(domain, token_file_url, activation_flow_names, survey_flow_names, test_contact_uuids,
+                   max_concurrent_flow_fetches)
 
     def validate(self):
         validators.validate_string(self.domain, "domain")
@@ -248,6 +338,9 @@ class RapidProSource(RawDataSource):
         for i, contact_uuid in enumerate(self.test_contact_uuids):
             validators.validate_string(contact_uuid, f"test_contact_uuids[{i}]")
 
+        validators.validate_int(self.max_concurrent_flow_fetches, "max_concurrent_flow_fetches")
+        assert self.max_concurrent_flow_fetches >= 1, "max_concurrent_flow_fetches must be at least 1"
+
 
 class AbstractRemoteURLSource(RawDataSource):
     def __init__(self, activation_flow_urls, survey_flow_urls):
@@ -280,9 +373,33 @@ class AbstractRemoteURLSource(RawDataSource):
 
 
 class GCloudBucketSource(AbstractRemoteURLSource):
-    def __init__(self, activation_flow_urls, survey_flow_urls):
+    def __init__(self, activation_flow_urls, survey_flow_urls, max_concurrent_downloads=1):
+        """
+        :param activation_flow_urls: GS URLs to download radio show response runs data from.
+        :type activation_flow_urls: list of str
+        :param survey_flow_urls: GS URLs to download survey response runs data from.
+        :type survey_flow_urls: list of str
+        :param max_concurrent_downloads: The maximum number of blobs to download in parallel.
+                                         If 1, blobs are downloaded one after another.
+        :type max_concurrent_downloads: int
+        """
+        self.max_concurrent_downloads = max_concurrent_downloads
         super().__init__(activation_flow_urls, survey_flow_urls)
 
+    @classmethod
+    def from_configuration_dict(cls, configuration_dict):
+        activation_flow_urls = configuration_dict.get("ActivationFlowURLs", [])
+        survey_flow_urls = configuration_dict.get("SurveyFlowURLs", [])
+        max_concurrent_downloads = configuration_dict.get("MaxConcurrentDownloads", 1)
+
+        return cls(activation_flow_urls, survey_flow_urls, max_concurrent_downloads)
+
+    def validate(self):
+        super().validate()
+
+        validators.validate_int(self.max_concurrent_downloads, "max_concurrent_downloads")
+        assert self.max_concurrent_downloads >= 1, "max_concurrent_downloads must be at least 1"
+
 
 class RecoveryCSVSource(AbstractRemoteURLSource):
     def __init__(self, activation_flow_urls, survey_flow_urls):
@@ -290,10 +407,33 @@ class RecoveryCSVSource(AbstractRemoteURLSource):
 
 
 class FacebookSource(RawDataSource):
-    def __init__(self, page_id, token_file_url, datasets):
+    def __init__(self, page_id, token_file_url, datasets, max_concurrent_post_fetches=1, max_requests_per_minute=None,
+                 incremental_comment_sync=False):
+        """
+        :param page_id: ID of the page to download comments from.
+        :type page_id: str
+        :param token_file_url: GS URL of a text file containing the page authorisation token.
+        :type token_file_url: str
+        :param datasets: Datasets to download comments for.
+        :type datasets: list of FacebookDataset
+        :param max_concurrent_post_fetches: The maximum number of posts to download comments from in parallel.
+                                            If 1, posts are fetched one after another.
+        :type max_concurrent_post_fetches: int
+        :param max_requests_per_minute: The maximum rate to make requests to Facebook at, shared between all the
+                                        concurrent fetches. If None, requests are only slowed down when Facebook
+                                        reports that a rate limit has been reached.
+        :type max_requests_per_minute: int | None
+        :param incremental_comment_sync: Whether to only download the comments created since the previous fetch, and
+                                         only convert the new comments to TracedData. If False, all the comments are
+                                         downloaded and converted on every fetch.
+        :type incremental_comment_sync: bool
+        """
         self.page_id = page_id
         self.token_file_url = token_file_url
         self.datasets = datasets
+        self.max_concurrent_post_fetches = max_concurrent_post_fetches
+        self.max_requests_per_minute = max_requests_per_minute
+        self.incremental_comment_sync = incremental_comment_sync
 
         self.validate()
 
@@ -302,8 +442,12 @@ class FacebookSource(RawDataSource):
         page_id = configuration_dict["PageID"]
         token_file_url = configuration_dict["TokenFileURL"]
         datasets = [FacebookDataset.from_configuration_dict(d) for d in configuration_dict["Datasets"]]
+        max_concurrent_post_fetches = configuration_dict.get("MaxConcurrentPostFetches", 1)
+        max_requests_per_minute = configuration_dict.get("MaxRequestsPerMinute")
+        incremental_comment_sync = configuration_dict.get("IncrementalCommentSync", False)
 
-        return cls(page_id, token_file_url, datasets)
+        return cls(page_id, token_file_url, datasets, max_concurrent_post_fetches, max_requests_per_minute,
+                   incremental_comment_sync)
 
     def validate(self):
         validators.validate_string(self.page_id, "page_id")
@@ -314,6 +458,15 @@ class FacebookSource(RawDataSource):
             assert isinstance(dataset, FacebookDataset), f"datasets[{i}] is not of type FacebookDataset"
             dataset.validate()
 
+        validators.validate_int(self.max_concurrent_post_fetches, "max_concurrent_post_fetches")
+        assert self.max_concurrent_post_fetches >= 1, "max_concurrent_post_fetches must be at least 1"
+
+        if self.max_requests_per_minute is not None:
+            validators.validate_int(self.max_requests_per_minute, "max_requests_per_minute")
+            assert self.max_requests_per_minute >= 1, "max_requests_per_minute must be at least 1"
+
+        validators.validate_bool(self.incremental_comment_sync, "incremental_comment_sync")
+
     # TODO: Rename to refer to datasets instead of flows, since 'flows' don't really make sense for Facebook
     def get_activation_flow_names(self):
         return [f"{dataset.name}_{self.page_id}" for dataset in self.datasets]
@@ -378,6 +531,48 @@ class FacebookSearch(object):
         validators.validate_datetime(self.end_date, "end_date")
 
 
+class SourceFetchConcurrency(object):
+    SOURCE_TYPES = ["RapidPro", "GCloudBucket", "RecoveryCSV", "Facebook"]
+
+    def __init__(self, max_concurrent_sources=1, max_concurrent_sources_by_type=None):
+        """
+        :param max_concurrent_sources: The maximum number of raw data sources to fetch in parallel.
+                                       If 1, sources are fetched one after another.
+        :type max_concurrent_sources: int
+        :param max_concurrent_sources_by_type: The maximum number of sources of each SourceType to fetch in parallel,
+                                               for example to avoid fetching from two workspaces on the same Rapid Pro
+                                               server at once. Source types which aren't in this dict are only
+                                               limited by `max_concurrent_sources`.
+        :type max_concurrent_sources_by_type: dict of str -> int | None
+        """
+        if max_concurrent_sources_by_type is None:
+            max_concurrent_sources_by_type = dict()
+
+        self.max_concurrent_sources = max_concurrent_sources
+        self.max_concurrent_sources_by_type = max_concurrent_sources_by_type
+
+        self.validate()
+
+    @classmethod
+    def from_configuration_dict(cls, configuration_dict):
+        max_concurrent_sources = configuration_dict.get("MaxConcurrentSources", 1)
+        max_concurrent_sources_by_type = configuration_dict.get("MaxConcurrentSourcesByType")
+
+        return cls(max_concurrent_sources, max_concurrent_sources_by_type)
+
+    def validate(self):
+        validators.validate_int(self.max_concurrent_sources, "max_concurrent_sources")
+        assert self.max_concurrent_sources >= 1, "max_concurrent_sources must be at least 1"
+
+        validators.validate_dict(self.max_concurrent_sources_by_type, "max_concurrent_sources_by_type")
+        for source_type, max_concurrent in self.max_concurrent_sources_by_type.items():
+            assert source_type in self.SOURCE_TYPES, \
+                f"Unknown SourceType '{source_type}' in max_concurrent_sources_by_type. " \
+                f"Must be one of {self.SOURCE_TYPES}"
+            validators.validate_int(max_concurrent, f"max_concurrent_sources_by_type[{source_type}]")
+            assert max_concurrent >= 1, f"max_concurrent_sources_by_type[{source_type}] must be at least 1"
+
+
 class UuidTable(object):
     def __init__(self, firebase_credentials_file_url, table_name, uuid_prefix):
         """
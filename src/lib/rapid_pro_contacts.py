@@ -0,0 +1,320 @@
+import json
+import sqlite3
+import threading
+
+from core_data_modules.logging import Logger
+from core_data_modules.util import IOUtils
+from dateutil.parser import isoparse
+from temba_client.v2 import Contact
+
+from src.lib.compressed_files import find_file, open_file, with_compression
+
+log = Logger(__name__)
+
+
+class ContactsStore(object):
+    # Maximum number of values to bind in a single SQLite query. Older SQLite builds reject queries with more than
+    # 999 bound parameters.
+    _QUERY_BATCH_SIZE = 500
+
+    def __init__(self, db_path):
+        """
+        Uuid-indexed store of the serialized contacts in a Rapid Pro workspace, in a local SQLite database.
+
+        Each contact is stored as its serialized JSON alongside its `modified_on`, so contacts can be looked up and
+        updated individually without deserializing the rest of the workspace.
+
+        :param db_path: Path to the SQLite database. This is created if it doesn't exist.
+        :type db_path: str
+        """
+        self.db_path = db_path
+
+        # Lookups may be made concurrently from multiple flow fetch threads, so share one connection between all
+        # threads and serialise access to it.
+        self._lock = threading.Lock()
+        IOUtils.ensure_dirs_exist_for_file(db_path)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS contacts ("
+                             "uuid TEXT PRIMARY KEY, modified_on TEXT NOT NULL, contact TEXT NOT NULL)")
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM contacts").fetchone()[0]
+
+    def latest_modified_on(self):
+        """
+        :return: The latest `modified_on` of any contact in this store, or None if the store is empty.
+        :rtype: datetime.datetime | None
+        """
+        with self._lock:
+            modified_ons = [modified_on for modified_on, in self._db.execute("SELECT modified_on FROM contacts")]
+        return max((isoparse(modified_on) for modified_on in modified_ons), default=None)
+
+    def upsert(self, contacts):
+        """
+        Adds the given contacts to this store, replacing any stored versions of the same contacts.
+
+        :param contacts: Contacts to add.
+        :type contacts: iterable of temba_client.v2.Contact
+        """
+        rows = [(contact.uuid, contact.modified_on.isoformat(), json.dumps(contact.serialize()))
+                for contact in contacts]
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO contacts (uuid, modified_on, contact) VALUES (?, ?, ?)", rows)
+
+    def get_serialized(self, contact_uuids):
+        """
+        :param contact_uuids: Uuids of the contacts to look up.
+        :type contact_uuids: iterable of str
+        :return: Dictionary of contact uuid -> (modified_on, serialized contact JSON), for each of the given contacts
+                 which is in this store.
+        :rtype: dict of str -> (str, str)
+        """
+        contact_uuids = list(contact_uuids)
+        results = dict()
+        with self._lock:
+            for i in range(0, len(contact_uuids), self._QUERY_BATCH_SIZE):
+                batch = contact_uuids[i:i + self._QUERY_BATCH_SIZE]
+                rows = self._db.execute(
+                    f"SELECT uuid, modified_on, contact FROM contacts WHERE uuid IN ({', '.join('?' * len(batch))})",
+                    batch
+                )
+                results.update({contact_uuid: (modified_on, contact) for contact_uuid, modified_on, contact in rows})
+        return results
+
+    def uuids(self):
+        """
+        :return: The uuids of all the contacts in this store.
+        :rtype: list of str
+        """
+        with self._lock:
+            return [contact_uuid for contact_uuid, in self._db.execute("SELECT uuid FROM contacts")]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class ContactsSnapshot(object):
+    def __init__(self, store):
+        """
+        Uuid-indexed view of the contacts in a Rapid Pro workspace at the time of a sync.
+
+        Contacts are read from the store and deserialized lazily, the first time they are looked up, so the cost of
+        using a snapshot grows with the number of contacts looked up rather than with the size of the workspace.
+        The store must not be modified while the snapshot is in use.
+
+        This snapshot is safe to share between threads. It owns the store, so closing the snapshot (or leaving a `with`
+        block which uses it) closes the store.
+
+        :param store: Store to read the contacts from.
+        :type store: ContactsStore
+        """
+        self._store = store
+        self._length = len(store)
+
+        self._lock = threading.Lock()
+        self._serialized = dict()  # of contact uuid -> (modified_on, serialized contact JSON) | None if not in store
+        self._contacts = dict()  # of contact uuid -> temba_client.v2.Contact
+
+    def __len__(self):
+        return self._length
+
+    def close(self):
+        self._store.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def preload(self, contact_uuids):
+        """
+        Reads the given contacts from the store in batches, so that later lookups of those contacts don't need to
+        query the store one contact at a time.
+
+        :param contact_uuids: Uuids of the contacts to read.
+        :type contact_uuids: iterable of str
+        """
+        with self._lock:
+            contact_uuids = [
+                contact_uuid for contact_uuid in set(contact_uuids) if contact_uuid not in self._serialized]
+        serialized = self._store.get_serialized(contact_uuids)
+        with self._lock:
+            for contact_uuid in contact_uuids:
+                self._serialized[contact_uuid] = serialized.get(contact_uuid)
+
+    def _get_serialized(self, contact_uuid):
+        if contact_uuid not in self._serialized:
+            self.preload([contact_uuid])
+        return self._serialized[contact_uuid]
+
+    def __contains__(self, contact_uuid):
+        return self._get_serialized(contact_uuid) is not None
+
+    def __getitem__(self, contact_uuid):
+        contact = self.get(contact_uuid)
+        if contact is None:
+            raise KeyError(contact_uuid)
+        return contact
+
+    def get(self, contact_uuid, default=None):
+        serialized = self._get_serialized(contact_uuid)
+        if serialized is None:
+            return default
+
+        with self._lock:
+            if contact_uuid not in self._contacts:
+                self._contacts[contact_uuid] = Contact.deserialize(json.loads(serialized[1]))
+            return self._contacts[contact_uuid]
+
+    def modified_on(self, contact_uuid):
+        """
+        :param contact_uuid: Uuid of the contact to look up.
+        :type contact_uuid: str
+        :return: The contact's `modified_on`, in ISO 8601 format, or None if the contact isn't in this snapshot.
+                 This doesn't require the contact to be deserialized.
+        :rtype: str | None
+        """
+        serialized = self._get_serialized(contact_uuid)
+        return None if serialized is None else serialized[0]
+
+    def contacts(self):
+        """
+        :return: All the contacts in this snapshot. This deserializes every contact in the workspace.
+        :rtype: list of temba_client.v2.Contact
+        """
+        contact_uuids = self._store.uuids()
+        self.preload(contact_uuids)
+        return [self[contact_uuid] for contact_uuid in contact_uuids]
+
+    def contacts_for_runs(self, runs):
+        """
+        Returns the contacts in this snapshot which are referenced by the given runs.
+
+        Runs whose contact is not in this snapshot (e.g. because the contact was deleted) are ignored here, exactly as
+        they would be had the full list of contacts been used.
+
+        :param runs: Runs to get the contacts of.
+        :type runs: iterable of temba_client.v2.Run
+        :return: The contacts referenced by `runs`.
+        :rtype: list of temba_client.v2.Contact
+        """
+        contact_uuids = list(dict.fromkeys(run.contact.uuid for run in runs))
+        self.preload(contact_uuids)
+        return [self[contact_uuid] for contact_uuid in contact_uuids if contact_uuid in self]
+
+
+class RapidProContactsSync(object):
+    def __init__(self, rapid_pro, raw_data_dir, workspace_name, compression=None):
+        """
+        Keeps a local store of all the contacts in a Rapid Pro workspace up to date.
+
+        The contacts are stored in a ContactsStore at `{raw_data_dir}/{workspace_name}_contacts.sqlite`, alongside a
+        watermark file `{raw_data_dir}/{workspace_name}_contacts_sync.json` which records the latest `modified_on`
+        seen, so that each sync only needs to request the contacts which were modified since the previous sync, and
+        only needs to write those contacts to the store.
+
+        A legacy `{raw_data_dir}/{workspace_name}_contacts_raw.json` export, in any compression format, is migrated
+        into the store the first time the store is synced.
+
+        :param rapid_pro: Rapid Pro client for the workspace to sync.
+        :type rapid_pro: rapid_pro_tools.rapid_pro_client.RapidProClient
+        :param raw_data_dir: Directory to store the contacts, watermark, and raw export log in.
+        :type raw_data_dir: str
+        :param workspace_name: Name of the Rapid Pro workspace being synced.
+        :type workspace_name: str
+        :param compression: Compression format to write the raw export log in (see
+                            src.lib.compressed_files.COMPRESSION_EXTENSIONS), or None to write it uncompressed.
+        :type compression: str | None
+        """
+        self.rapid_pro = rapid_pro
+        self.contacts_db_path = f"{raw_data_dir}/{workspace_name}_contacts.sqlite"
+        self.legacy_raw_contacts_path = f"{raw_data_dir}/{workspace_name}_contacts_raw.json"
+        self.contacts_log_path = with_compression(f"{raw_data_dir}/{workspace_name}_contacts_log.jsonl", compression)
+        self.watermark_path = f"{raw_data_dir}/{workspace_name}_contacts_sync.json"
+
+    def _load_watermark(self):
+        try:
+            with open(self.watermark_path) as f:
+                return isoparse(json.load(f)["LatestModifiedOn"])
+        except FileNotFoundError:
+            return None
+
+    def _save_watermark(self, latest_modified_on):
+        with open(self.watermark_path, "w") as f:
+            json.dump({"LatestModifiedOn": latest_modified_on.isoformat()}, f)
+
+    def _migrate_legacy_raw_contacts_file(self, store):
+        """
+        Imports the contacts in a legacy contacts export file into the given store, if the store is empty.
+
+        The legacy file is left in place, so that it can still be used if the pipeline is rolled back to a version
+        which doesn't use the store. It is ignored once the store contains any contacts.
+        """
+        legacy_raw_contacts_path = find_file(self.legacy_raw_contacts_path)
+        if legacy_raw_contacts_path is None or len(store) > 0:
+            return
+
+        log.info(f"Migrating raw contacts from legacy file '{legacy_raw_contacts_path}' to "
+                 f"'{self.contacts_db_path}'...")
+        with open_file(legacy_raw_contacts_path) as f:
+            raw_contacts = [Contact.deserialize(contact_json) for contact_json in json.load(f)]
+        store.upsert(raw_contacts)
+        log.info(f"Migrated {len(raw_contacts)} contacts")
+
+    def sync(self):
+        """
+        Updates the local store of contacts with the contacts modified since the last sync, saves the watermark, and
+        returns a snapshot of the updated contacts.
+
+        If there are no previously stored contacts, all the contacts are fetched from Rapid Pro.
+
+        :return: Snapshot of all the contacts in the workspace. The snapshot holds the store's database connection open,
+                 so close it once it is no longer needed, e.g. by using it in a `with` block.
+        :rtype: ContactsSnapshot
+        """
+        store = ContactsStore(self.contacts_db_path)
+        self._migrate_legacy_raw_contacts_file(store)
+
+        stored_contacts_count = len(store)
+        if stored_contacts_count > 0:
+            log.info(f"Found {stored_contacts_count} raw contacts in '{self.contacts_db_path}'")
+            watermark = self._load_watermark()
+            if watermark is None:
+                # Exports written before watermarks were introduced don't have a watermark file, so derive it from the
+                # contacts themselves.
+                watermark = store.latest_modified_on()
+        else:
+            log.info(f"No contacts found in '{self.contacts_db_path}', will fetch all contacts from the Rapid Pro "
+                     f"server")
+            watermark = None
+
+        with open_file(self.contacts_log_path, "a") as raw_contacts_log_file:
+            if watermark is None:
+                updated_contacts = self.rapid_pro.get_raw_contacts(raw_export_log_file=raw_contacts_log_file)
+            else:
+                log.info(f"Fetching contacts modified since {watermark.isoformat()}...")
+                # The range start is inclusive, so contacts modified exactly at the watermark are fetched again.
+                # This is harmless because updated contacts replace the existing contacts with the same uuid.
+                updated_contacts = self.rapid_pro.get_raw_contacts(
+                    range_start_inclusive=watermark, raw_export_log_file=raw_contacts_log_file)
+        log.info(f"Fetched {len(updated_contacts)} new or updated contacts")
+
+        # Write only the new or updated contacts. The store is written before the watermark, so that the watermark
+        # never refers to contacts which haven't been saved.
+        log.info(f"Saving {len(updated_contacts)} new or updated contacts to '{self.contacts_db_path}'...")
+        store.upsert(updated_contacts)
+        snapshot = ContactsSnapshot(store)
+        log.info(f"Workspace has {len(snapshot)} contacts")
+
+        for contact in updated_contacts:
+            if watermark is None or contact.modified_on > watermark:
+                watermark = contact.modified_on
+        if watermark is not None:
+            self._save_watermark(watermark)
+
+        return snapshot
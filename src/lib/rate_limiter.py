@@ -0,0 +1,67 @@
+import threading
+import time
+
+
+class TokenBucketRateLimiter(object):
+    def __init__(self, requests_per_minute=None, burst_size=None):
+        """
+        Thread-safe token bucket rate limiter, for sharing a request budget between concurrent workers.
+
+        Tokens are added to the bucket at a constant rate of `requests_per_minute`, up to a maximum of `burst_size`
+        tokens. Each request takes one token from the bucket, waiting for a token to become available if the bucket is
+        empty.
+
+        All requests can also be paused for a period, for example after a server reports that a rate limit has been
+        reached.
+
+        :param requests_per_minute: Maximum sustained rate of requests. If None, requests are only limited by pauses.
+        :type requests_per_minute: int | None
+        :param burst_size: Maximum number of requests which can be made at once after a period of inactivity.
+                           Defaults to 1 (no bursts).
+        :type burst_size: int | None
+        """
+        if burst_size is None:
+            burst_size = 1
+
+        self.requests_per_minute = requests_per_minute
+        self.burst_size = burst_size
+
+        self._lock = threading.Lock()
+        self._tokens = burst_size
+        self._last_refill = time.monotonic()
+        self._paused_until = 0
+
+    def _refill(self, now):
+        elapsed = now - self._last_refill
+        self._tokens = min(self.burst_size, self._tokens + elapsed * self.requests_per_minute / 60)
+        self._last_refill = now
+
+    def acquire(self):
+        """
+        Blocks until a request may be made, then takes a token for it.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait_seconds = self._paused_until - now
+                elif self.requests_per_minute is None:
+                    return
+                else:
+                    self._refill(now)
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait_seconds = (1 - self._tokens) * 60 / self.requests_per_minute
+            time.sleep(wait_seconds)
+
+    def pause(self, seconds):
+        """
+        Prevents any requests from being made for the given number of seconds.
+        If requests are already paused for longer than this, the existing pause is kept.
+
+        :param seconds: Number of seconds to pause requests for.
+        :type seconds: float
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
@@ -0,0 +1,203 @@
+import json
+import os
+
+from core_data_modules.logging import Logger
+from core_data_modules.util import IOUtils
+from dateutil.parser import isoparse
+from temba_client.v2 import Run
+
+from src.lib.compressed_files import atomic_write, open_file, with_compression
+
+log = Logger(__name__)
+
+
+class RawRunsStore(object):
+    # Number of delta segments to allow before all the segments are compacted into a single segment.
+    MAX_SEGMENTS = 16
+
+    def __init__(self, raw_data_dir, flow_name, compression=None):
+        """
+        Append-only, segmented store of the raw runs exported from a Rapid Pro flow.
+
+        The store is a directory `{raw_data_dir}/{flow_name}_raw_runs` containing:
+         - Segment files, each containing one serialized run per line. Each fetch appends a new segment containing
+           only the runs which were new or modified since the previous fetch.
+         - An index file, listing the segments in the order they were written along with the range of run
+           `modified_on` values each segment contains.
+
+        When a run appears in more than one segment, the version in the latest segment is the current version.
+        Once there are more than MAX_SEGMENTS segments, the store is compacted into a single segment containing only
+        the current version of each run.
+
+        :param raw_data_dir: Directory containing the raw data for this pipeline.
+        :type raw_data_dir: str
+        :param flow_name: Name of the flow this store contains the runs of.
+        :type flow_name: str
+        :param compression: Compression format to write new segments in (see
+                            src.lib.compressed_files.COMPRESSION_EXTENSIONS), or None to write them uncompressed.
+                            Existing segments are read in whichever format they were written in.
+        :type compression: str | None
+        """
+        self.store_dir = f"{raw_data_dir}/{flow_name}_raw_runs"
+        self.compression = compression
+        self.index_path = f"{self.store_dir}/index.json"
+        self.legacy_raw_runs_path = f"{raw_data_dir}/{flow_name}_raw.json"
+
+    @staticmethod
+    def _write_atomically(path, write_fn):
+        with atomic_write(path) as f:
+            write_fn(f)
+
+    def _load_index(self):
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"Segments": [], "NextSegmentNumber": 0}
+
+    def _save_index(self, index):
+        self._write_atomically(self.index_path, lambda f: json.dump(index, f, indent=2))
+
+    def exists(self):
+        return os.path.exists(self.index_path)
+
+    def latest_modified_on(self):
+        """
+        :return: The latest `modified_on` of any run in this store, or None if the store is empty.
+        :rtype: datetime.datetime | None
+        """
+        segments = self._load_index()["Segments"]
+        if len(segments) == 0:
+            return None
+        return max(isoparse(segment["MaxModifiedOn"]) for segment in segments)
+
+    def iter_runs(self):
+        """
+        Streams every run version in this store, oldest segment first.
+
+        Runs which have been modified since they were first stored are yielded once for each stored version.
+
+        :return: Generator of all the stored run versions.
+        :rtype: generator of temba_client.v2.Run
+        """
+        for segment in self._load_index()["Segments"]:
+            with open_file(f"{self.store_dir}/{segment['FileName']}") as f:
+                for line in f:
+                    yield Run.deserialize(json.loads(line))
+
+    @staticmethod
+    def merge_runs(runs, new_runs):
+        """
+        Merges new runs into a list of runs, in the same order that `load_runs` would return them had `new_runs` been
+        appended to a store containing `runs`.
+
+        New versions of runs in `runs` replace the old versions in place, and runs which aren't in `runs` are added to
+        the end. This is the same order as RapidProClient.update_raw_runs_with_latest_modified, which matters because
+        the order of the exported runs decides which run is used when a participant's runs are coalesced.
+
+        :param runs: Current version of every run, in load order.
+        :type runs: list of temba_client.v2.Run
+        :param new_runs: New runs, or new versions of runs in `runs`.
+        :type new_runs: list of temba_client.v2.Run
+        :return: The current version of every run after merging.
+        :rtype: list of temba_client.v2.Run
+        """
+        merged = {run.id: run for run in runs}
+        for run in new_runs:
+            merged[run.id] = run
+        return list(merged.values())
+
+    def load_runs(self):
+        """
+        Loads the current version of every run in this store.
+
+        Runs are returned in the order they were first stored, with each run at its latest version.
+
+        :return: The current version of every run in this store.
+        :rtype: list of temba_client.v2.Run
+        """
+        return self.merge_runs([], self.iter_runs())
+
+    def _write_segment(self, index, runs):
+        """
+        Writes the given runs to a new segment file, and returns the index entry for that segment.
+        The caller is responsible for adding the entry to the index and saving it.
+        """
+        IOUtils.ensure_dirs_exist(self.store_dir)
+        segment_file_name = with_compression(f"segment_{index['NextSegmentNumber']:05}.jsonl", self.compression)
+        index["NextSegmentNumber"] += 1
+
+        def write_segment(f):
+            for run in runs:
+                f.write(json.dumps(run.serialize()))
+                f.write("\n")
+        self._write_atomically(f"{self.store_dir}/{segment_file_name}", write_segment)
+
+        modified_ons = [run.modified_on for run in runs]
+        return {
+            "FileName": segment_file_name,
+            "RunCount": len(runs),
+            "MinModifiedOn": min(modified_ons).isoformat(),
+            "MaxModifiedOn": max(modified_ons).isoformat()
+        }
+
+    def append(self, runs):
+        """
+        Appends a new segment containing the given runs. If this takes the store over MAX_SEGMENTS segments,
+        the store is then compacted.
+
+        :param runs: Runs to append. These should be new runs, or new versions of runs already in the store.
+        :type runs: list of temba_client.v2.Run
+        """
+        index = self._load_index()
+
+        if len(runs) == 0:
+            # Make sure the index exists, so that this store is recognised as having been populated even if the
+            # flow doesn't have any runs yet.
+            if not self.exists():
+                IOUtils.ensure_dirs_exist(self.store_dir)
+                self._save_index(index)
+            return
+
+        segment = self._write_segment(index, runs)
+        index["Segments"].append(segment)
+        self._save_index(index)
+        log.info(f"Appended {len(runs)} runs to '{self.store_dir}/{segment['FileName']}'")
+
+        if len(index["Segments"]) > self.MAX_SEGMENTS:
+            self.compact()
+
+    def compact(self):
+        """
+        Rewrites this store as a single segment containing only the current version of each run.
+        """
+        index = self._load_index()
+        old_segments = index["Segments"]
+        runs = self.load_runs()
+        log.info(f"Compacting {len(old_segments)} segments in '{self.store_dir}' into 1 segment of {len(runs)} runs...")
+
+        # Write the compacted segment and switch the index over to it before deleting anything, so that the store
+        # is never left without a complete copy of the runs.
+        index["Segments"] = [self._write_segment(index, runs)] if len(runs) > 0 else []
+        self._save_index(index)
+
+        for segment in old_segments:
+            os.remove(f"{self.store_dir}/{segment['FileName']}")
+        log.info(f"Compacted '{self.store_dir}'")
+
+    def migrate_legacy_raw_runs_file(self):
+        """
+        Imports the runs in a legacy `{flow_name}_raw.json` file, if one exists and this store hasn't been created
+        yet.
+
+        The legacy file is left in place, so that it can still be used if the pipeline is rolled back to a version
+        which doesn't use this store. It is ignored once the store exists.
+        """
+        if self.exists() or not os.path.exists(self.legacy_raw_runs_path):
+            return
+
+        log.info(f"Migrating raw runs from legacy file '{self.legacy_raw_runs_path}' to '{self.store_dir}'...")
+        with open(self.legacy_raw_runs_path) as f:
+            runs = [Run.deserialize(run_json) for run_json in json.load(f)]
+        self.append(runs)
+        log.info(f"Migrated {len(runs)} runs")
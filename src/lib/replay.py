@@ -0,0 +1,309 @@
+import csv
+import glob
+import json
+import math
+import os
+import sqlite3
+import time
+
+from core_data_modules.logging import Logger
+from dateutil.parser import isoparse
+from rapid_pro_tools.rapid_pro_client import RapidProClient
+from temba_client.v2 import Contact, Run
+
+from src.lib.bucket_downloads import LocalDirectoryBucket
+from src.lib.cached_facebook_client import CachedFacebookClient
+from src.lib.compressed_files import COMPRESSION_EXTENSIONS, open_file, with_compression
+from src.lib.local_uuid_table import LocalUuidTable
+from src.lib.throttled_facebook_client import ThrottledFacebookClient
+
+log = Logger(__name__)
+
+
+class ReplayLatency(object):
+    def __init__(self, seconds_per_request=0, items_per_page=250):
+        """
+        Simulated network latency for the replay stand-ins.
+
+        :param seconds_per_request: Time to wait for each simulated request.
+        :type seconds_per_request: float
+        :param items_per_page: Number of items returned by each simulated request, when serving paginated results.
+        :type items_per_page: int
+        """
+        self.seconds_per_request = seconds_per_request
+        self.items_per_page = items_per_page
+
+    def wait(self, item_count=0):
+        """
+        Waits for as long as it would take to make the requests needed to download `item_count` paginated items.
+        Always waits for at least one request.
+        """
+        if self.seconds_per_request > 0:
+            time.sleep(self.seconds_per_request * max(1, math.ceil(item_count / self.items_per_page)))
+
+
+def _read_raw_export_log(log_path):
+    """
+    Reads the objects in a raw export log. Each line of the log is either a JSON list of objects, a JSON object, or
+    a page of Graph API results with the objects under "data".
+
+    If the log was written in more than one compression format, because the raw data compression was changed between
+    fetches, all the formats are read, oldest first.
+
+    :param log_path: Path to the uncompressed log.
+    :type log_path: str
+    :return: All the objects in the log, in the order they were logged.
+    :rtype: list of dict
+    """
+    objects = []
+    log_paths = [with_compression(log_path, compression) for compression in [None, *COMPRESSION_EXTENSIONS]]
+    log_paths = sorted([path for path in log_paths if os.path.exists(path)], key=os.path.getmtime)
+    if len(log_paths) == 0:
+        log.warning(f"No recorded log found at '{log_path}'; replaying no data for it")
+        return objects
+
+    for path in log_paths:
+        with open_file(path) as f:
+            for line in f:
+                if line.strip() == "":
+                    continue
+                logged = json.loads(line)
+                if isinstance(logged, list):
+                    objects.extend(logged)
+                elif "data" in logged:
+                    objects.extend(logged["data"])
+                else:
+                    objects.append(logged)
+    return objects
+
+
+def _latest_versions(objects, id_key):
+    """
+    :return: The last logged version of each object, in the order each object was first logged.
+    :rtype: list of dict
+    """
+    latest = dict()
+    for obj in objects:
+        latest[obj[id_key]] = obj
+    return list(latest.values())
+
+
+class ReplayRapidProClient(RapidProClient):
+    def __init__(self, recording_dir, workspace_name, latency):
+        """
+        Stand-in for a RapidProClient which serves the contacts and runs recorded in the raw export logs of a previous
+        fetch, instead of downloading them from Rapid Pro. Conversion to TracedData is inherited from
+        RapidProClient unchanged.
+
+        Flow ids are the flow names, because the recorded logs are named by flow.
+
+        :param recording_dir: Raw data directory of the previous fetch.
+        :type recording_dir: str
+        :param workspace_name: Name of the recorded workspace. The contacts are served from
+                               `{recording_dir}/{workspace_name}_contacts_log.jsonl`.
+        :type workspace_name: str
+        :param latency: Latency to simulate for each request.
+        :type latency: ReplayLatency
+        """
+        super().__init__("https://replay.invalid", "replay-token")
+        self.recording_dir = recording_dir
+        self.workspace_name = workspace_name
+        self.latency = latency
+
+    @staticmethod
+    def _log_fetched(raw_export_log_file, objects):
+        if raw_export_log_file is not None:
+            json.dump([obj.serialize() for obj in objects], raw_export_log_file)
+            raw_export_log_file.write("\n")
+
+    def get_workspace_name(self):
+        self.latency.wait()
+        return self.workspace_name
+
+    def get_flow_id(self, flow_name):
+        self.latency.wait()
+        return flow_name
+
+    def get_raw_contacts(self, range_start_inclusive=None, range_end_exclusive=None, raw_export_log_file=None):
+        contacts = [Contact.deserialize(contact_json) for contact_json in _latest_versions(
+            _read_raw_export_log(f"{self.recording_dir}/{self.workspace_name}_contacts_log.jsonl"), "uuid")]
+        contacts = [
+            contact for contact in contacts
+            if (range_start_inclusive is None or contact.modified_on >= range_start_inclusive) and
+               (range_end_exclusive is None or contact.modified_on < range_end_exclusive)
+        ]
+        self.latency.wait(len(contacts))
+        self._log_fetched(raw_export_log_file, contacts)
+        return contacts
+
+    def get_raw_runs_for_flow_id(self, flow_id, range_start_inclusive=None, range_end_exclusive=None,
+                                 raw_export_log_file=None, ignore_archives=False):
+        runs = [Run.deserialize(run_json) for run_json in _latest_versions(
+            _read_raw_export_log(f"{self.recording_dir}/{flow_id}_log.jsonl"), "id")]
+        runs = [
+            run for run in runs
+            if (range_start_inclusive is None or run.modified_on >= range_start_inclusive) and
+               (range_end_exclusive is None or run.modified_on < range_end_exclusive)
+        ]
+        self.latency.wait(len(runs))
+        self._log_fetched(raw_export_log_file, runs)
+        return runs
+
+
+class ReplayFacebookClient(object):
+    def __init__(self, recording_dir, recorded_metrics_dir, latency):
+        """
+        Stand-in for a FacebookClient which serves the posts and comments recorded by a previous fetch.
+
+        Comments are served from the `{post_id}_comments_log.jsonl` raw export logs. Posts are reconstructed from the
+        post attachments in the `*_raw.json` comment exports (in any compression format), and from the post text,
+        created time, and engagement metrics in `{recorded_metrics_dir}/facebook_metrics.csv` if it exists. Page
+        searches can only find posts which are in the recorded metrics.
+
+        :param recording_dir: Raw data directory of the previous fetch.
+        :type recording_dir: str
+        :param recorded_metrics_dir: Metrics directory of the previous fetch, or None.
+        :type recorded_metrics_dir: str | None
+        :param latency: Latency to simulate for each request.
+        :type latency: ReplayLatency
+        """
+        self.recording_dir = recording_dir
+        self.latency = latency
+
+        self._posts = dict()  # of post id -> post
+        self._page_post_ids = dict()  # of page id -> list of post id
+        self._post_metrics = dict()  # of post id -> dict of metric -> value
+
+        raw_comments_paths = []
+        for compression in [None, *COMPRESSION_EXTENSIONS]:
+            raw_comments_paths.extend(glob.glob(with_compression(f"{recording_dir}/*_raw.json", compression)))
+        for raw_comments_path in raw_comments_paths:
+            with open_file(raw_comments_path) as f:
+                raw_comments = json.load(f)
+            if not isinstance(raw_comments, list):
+                continue
+            for comment in raw_comments:
+                if isinstance(comment, dict) and "post" in comment:
+                    self._posts.setdefault(comment["post"]["id"], dict()).update(comment["post"])
+
+        metrics_path = None if recorded_metrics_dir is None else f"{recorded_metrics_dir}/facebook_metrics.csv"
+        if metrics_path is not None and os.path.exists(metrics_path):
+            with open(metrics_path) as f:
+                for row in csv.DictReader(f):
+                    post_id = row["Post URL"].split("/")[-1]
+                    post = self._posts.setdefault(post_id, {"id": post_id})
+                    post["message"] = row["Post Text"]
+                    post["created_time"] = row["Post Created Time"]
+                    post["comments"] = {"data": [], "summary": {"total_count": int(row["Total Comments"])}}
+                    self._page_post_ids.setdefault(row["Page ID"], []).append(post_id)
+                    self._post_metrics[post_id] = {
+                        "post_impressions": int(row["Post Impressions"]),
+                        "post_impressions_unique": int(row["Unique Post Impressions"]),
+                        "post_engaged_users": int(row["Post Engaged Users"]),
+                        "post_reactions_by_type_total": {"like": int(row["Reactions"])}
+                    }
+
+    def _get_comments(self, post_id):
+        return _latest_versions(_read_raw_export_log(f"{self.recording_dir}/{post_id}_comments_log.jsonl"), "id")
+
+    @staticmethod
+    def _log_fetched(raw_export_log_file, objects):
+        if raw_export_log_file is not None:
+            raw_export_log_file.write(f"{json.dumps({'data': objects})}\n")
+
+    def get_post(self, post_id, fields=None):
+        self.latency.wait()
+        return CachedFacebookClient._project(self._posts.get(post_id, {"id": post_id}), fields)
+
+    def get_all_comments_on_post(self, post_id, raw_export_log_file=None, fields=None):
+        comments = [CachedFacebookClient._project(comment, fields) for comment in self._get_comments(post_id)]
+        self.latency.wait(len(comments))
+        self._log_fetched(raw_export_log_file, comments)
+        return comments
+
+    def get_comments_on_post_created_since(self, post_id, since, fields, raw_export_log_file=None):
+        comments = [
+            CachedFacebookClient._project(comment, fields) for comment in self._get_comments(post_id)
+            if isoparse(comment["created_time"]) >= since
+        ]
+        self.latency.wait(len(comments))
+        self._log_fetched(raw_export_log_file, comments)
+        return comments
+
+    def get_posts_published_by_page(self, page_id, fields=None, created_after=None, created_before=None):
+        posts = [
+            CachedFacebookClient._project(self._posts[post_id], fields)
+            for post_id in self._page_post_ids.get(page_id, [])
+            if CachedFacebookClient.is_created_in_range(self._posts[post_id], created_after, created_before)
+        ]
+        self.latency.wait(len(posts))
+        return posts
+
+    def get_metrics_for_post(self, post_id, metrics):
+        assert post_id in self._post_metrics, f"No metrics were recorded for post {post_id}"
+        self.latency.wait()
+        return {metric: self._post_metrics[post_id][metric] for metric in metrics}
+
+
+class ReplayThrottledFacebookClient(ThrottledFacebookClient):
+    def get_comments_on_post_created_since(self, post_id, since, fields, raw_export_log_file=None):
+        # Serve incremental comment requests from the replay client, rather than from the Graph API.
+        return self._call(self.facebook.get_comments_on_post_created_since, post_id, since, fields,
+                          raw_export_log_file=raw_export_log_file)
+
+
+class ReplayUuidTable(LocalUuidTable):
+    def __init__(self, uuid_prefix, data_to_uuid, latency):
+        """
+        Stand-in for a FirestoreUuidTable, which simulates the latency of each batch request.
+        """
+        super().__init__(uuid_prefix, data_to_uuid)
+        self.latency = latency
+
+    @classmethod
+    def from_recorded_cache(cls, cache_path, table_name, uuid_prefix, latency):
+        """
+        Initialises a table with the mappings in a recorded src.lib.cached_uuid_table.CachedUuidTable cache, if one is
+        given and it exists.
+        """
+        data_to_uuid = dict()
+        if cache_path is not None and os.path.exists(cache_path):
+            db = sqlite3.connect(cache_path)
+            data_to_uuid = dict(db.execute("SELECT data, uuid FROM mappings WHERE table_name = ?", [table_name]))
+            db.close()
+        log.info(f"Loaded {len(data_to_uuid)} recorded uuid table mappings from '{cache_path}'")
+        return cls(uuid_prefix, data_to_uuid, latency)
+
+    def data_to_uuid_batch(self, list_of_data):
+        self.latency.wait()
+        return super().data_to_uuid_batch(list_of_data)
+
+    def uuid_to_data_batch(self, uuids):
+        self.latency.wait()
+        return super().uuid_to_data_batch(uuids)
+
+
+class ReplayGoogleCloudStorage(object):
+    def __init__(self, bucket_dir, latency):
+        """
+        Stand-in for `storage.google_cloud.google_cloud_utils`, which serves blobs from a local directory laid out as
+        for a src.lib.bucket_downloads.LocalDirectoryBucket.
+
+        Blobs which weren't recorded, such as credentials files, are served as an empty JSON object, which the other
+        replay stand-ins ignore.
+        """
+        self.bucket = LocalDirectoryBucket(bucket_dir)
+        self.latency = latency
+
+    def download_blob_to_string(self, google_cloud_credentials_file_path, blob_url):
+        self.latency.wait()
+        try:
+            with open(self.bucket._get_path(blob_url)) as f:
+                return f.read()
+        except FileNotFoundError:
+            log.debug(f"Blob '{blob_url}' was not recorded; serving an empty JSON object")
+            return "{}"
+
+    def download_blob_to_file(self, google_cloud_credentials_file_path, blob_url, f):
+        self.latency.wait()
+        self.bucket.download_blob_to_file(blob_url, None, f)
@@ -0,0 +1,94 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from core_data_modules.logging import Logger
+
+log = Logger(__name__)
+
+
+class SourceScheduler(object):
+    def __init__(self, max_concurrent_sources=1, max_concurrent_sources_by_type=None):
+        """
+        Runs independent source fetch tasks concurrently, subject to an overall concurrency limit and a concurrency
+        limit for each type of source, and records how long each task took.
+
+        :param max_concurrent_sources: The maximum number of tasks to run at once. If 1, tasks are run one after
+                                       another in the order they were added.
+        :type max_concurrent_sources: int
+        :param max_concurrent_sources_by_type: The maximum number of tasks of each source type to run at once.
+                                               Source types not in this dict are only limited by
+                                               `max_concurrent_sources`.
+        :type max_concurrent_sources_by_type: dict of str -> int | None
+        """
+        if max_concurrent_sources_by_type is None:
+            max_concurrent_sources_by_type = dict()
+
+        self.max_concurrent_sources = max_concurrent_sources
+        self._type_semaphores = {
+            source_type: threading.BoundedSemaphore(max_concurrent)
+            for source_type, max_concurrent in max_concurrent_sources_by_type.items()
+        }
+        self._tasks = []  # of (str, str, callable)
+        self.timings = []  # of (str, str, float), in the order the tasks were added
+
+    def add_task(self, name, source_type, fetch_fn):
+        """
+        :param name: Name of this task, for logging.
+        :type name: str
+        :param source_type: Type of source this task fetches from, for limiting the concurrency of each source type.
+        :type source_type: str
+        :param fetch_fn: Function to run, with no arguments. Its return value is returned by `run`.
+        :type fetch_fn: callable
+        """
+        self._tasks.append((name, source_type, fetch_fn))
+
+    def _run_task(self, name, source_type, fetch_fn):
+        semaphore = self._type_semaphores.get(source_type)
+        if semaphore is not None:
+            semaphore.acquire()
+        try:
+            log.info(f"Fetching from {name}...")
+            start = time.perf_counter()
+            result = fetch_fn()
+            duration = time.perf_counter() - start
+            log.info(f"Fetched from {name} in {duration:.1f}s")
+            return result, duration
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+
+    def run(self):
+        """
+        Runs all the added tasks, then logs a summary of how long each took.
+
+        If any task fails, the error of the first failing task in the order the tasks were added is re-raised once all
+        the running tasks have finished.
+
+        :return: The value returned by each task, in the order the tasks were added.
+        :rtype: list
+        """
+        start = time.perf_counter()
+        if self.max_concurrent_sources == 1:
+            task_results = [self._run_task(*task) for task in self._tasks]
+        else:
+            log.info(f"Fetching from {len(self._tasks)} sources using up to {self.max_concurrent_sources} "
+                     f"concurrent workers...")
+            with ThreadPoolExecutor(max_workers=self.max_concurrent_sources) as executor:
+                task_runs = [executor.submit(self._run_task, *task) for task in self._tasks]
+                task_results = [task_run.result() for task_run in task_runs]
+        total_duration = time.perf_counter() - start
+
+        self.timings = [
+            (name, source_type, duration) for (name, source_type, _), (_, duration) in zip(self._tasks, task_results)
+        ]
+        self.log_timing_summary(total_duration)
+
+        return [result for result, _ in task_results]
+
+    def log_timing_summary(self, total_duration):
+        log.info("Source fetch timings:")
+        for name, source_type, duration in self.timings:
+            log.info(f"  {name} ({source_type}): {duration:.1f}s")
+        log.info(f"  Total wall-clock time: {total_duration:.1f}s "
+                 f"(sum of source times: {sum(duration for _, _, duration in self.timings):.1f}s)")
@@ -0,0 +1,127 @@
+import json
+
+from core_data_modules.logging import Logger
+from requests.exceptions import HTTPError
+
+log = Logger(__name__)
+
+
+class ThrottledFacebookClient(object):
+    # Graph API error codes which indicate that a rate limit was reached.
+    # See https://developers.facebook.com/docs/graph-api/overview/rate-limiting
+    THROTTLING_ERROR_CODES = {4, 17, 32, 613, 80001, 80002, 80003, 80004, 80005, 80006, 80008, 80014}
+
+    # Graph API response headers which report the usage of a Business Use Case rate limit, including the estimated
+    # time until throttled requests will be accepted again.
+    BUSINESS_USE_CASE_USAGE_HEADERS = ["X-Business-Use-Case-Usage", "X-Ad-Account-Usage"]
+
+    def __init__(self, facebook, rate_limiter, max_retries=5, initial_backoff_seconds=60):
+        """
+        Wraps a FacebookClient so that every request is made within a shared rate limit budget, and requests which
+        are rejected by Facebook's rate limits are retried once Facebook will accept them again.
+
+        This client is safe to share between threads, provided the wrapped FacebookClient is.
+
+        :param facebook: Facebook client to make the requests with.
+        :type facebook: social_media_tools.facebook.FacebookClient
+        :param rate_limiter: Rate limiter to take a token from before each request. Throttling responses pause this
+                             rate limiter, so that all the workers sharing it back off together.
+        :type rate_limiter: src.lib.rate_limiter.TokenBucketRateLimiter
+        :param max_retries: Maximum number of times to retry a throttled request before re-raising the error.
+        :type max_retries: int
+        :param initial_backoff_seconds: Time to wait before the first retry of a throttled request, if Facebook doesn't
+                                        report how long to wait. This doubles on every subsequent retry.
+        :type initial_backoff_seconds: float
+        """
+        self.facebook = facebook
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.initial_backoff_seconds = initial_backoff_seconds
+
+    def _get_throttling_backoff_seconds(self, response, attempt):
+        """
+        :return: Number of seconds to wait before retrying the request which produced the given response, or None if
+                 the response wasn't rejected because of a rate limit.
+        :rtype: float | None
+        """
+        if response is None:
+            return None
+
+        try:
+            error_code = response.json().get("error", {}).get("code")
+        except ValueError:
+            error_code = None
+        if response.status_code != 429 and error_code not in self.THROTTLING_ERROR_CODES:
+            return None
+
+        backoff_seconds = self.initial_backoff_seconds * 2 ** attempt
+        for header in self.BUSINESS_USE_CASE_USAGE_HEADERS:
+            if header not in response.headers:
+                continue
+            for usages in json.loads(response.headers[header]).values():
+                for usage in usages:
+                    # estimated_time_to_regain_access is in minutes.
+                    backoff_seconds = max(backoff_seconds, usage.get("estimated_time_to_regain_access", 0) * 60)
+
+        return backoff_seconds
+
+    def _call(self, method, *args, **kwargs):
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            try:
+                return method(*args, **kwargs)
+            except HTTPError as ex:
+                backoff_seconds = self._get_throttling_backoff_seconds(ex.response, attempt)
+                if backoff_seconds is None or attempt >= self.max_retries:
+                    raise
+
+                log.warning(f"Facebook request was throttled (attempt {attempt + 1}/{self.max_retries + 1}); "
+                            f"pausing all Facebook requests for {backoff_seconds} seconds before retrying...")
+                self.rate_limiter.pause(backoff_seconds)
+                attempt += 1
+
+    def get_post(self, post_id, **kwargs):
+        return self._call(self.facebook.get_post, post_id, **kwargs)
+
+    def get_all_comments_on_post(self, post_id, **kwargs):
+        # If a throttled request is retried after some pages of comments were downloaded, those pages are written
+        # to the `raw_export_log_file` again when they are re-downloaded.
+        return self._call(self.facebook.get_all_comments_on_post, post_id, **kwargs)
+
+    def get_posts_published_by_page(self, page_id, **kwargs):
+        return self._call(self.facebook.get_posts_published_by_page, page_id, **kwargs)
+
+    def get_metrics_for_post(self, post_id, metrics, **kwargs):
+        return self._call(self.facebook.get_metrics_for_post, post_id, metrics, **kwargs)
+
+    def get_comments_on_post_created_since(self, post_id, since, fields, raw_export_log_file=None):
+        """
+        Downloads the comments on a post which were created at or after the given time.
+
+        FacebookClient can only download all the comments on a post, so this makes the same request as
+        `FacebookClient.get_all_comments_on_post`, through the same paged request method (and so with the same Graph
+        API version, comment filter, paging, and raw export logging), with only the `since` parameter added.
+
+        :param post_id: Id of the post to download the comments on.
+        :type post_id: str
+        :param since: Time to download the comments created since.
+        :type since: datetime.datetime
+        :param fields: Fields to download for each comment.
+        :type fields: list of str
+        :param raw_export_log_file: File to log the raw data returned by Facebook to.
+        :type raw_export_log_file: file-like | None
+        :return: The comments on the post created since `since`.
+        :rtype: list of dict
+        """
+        return self._call(
+            self.facebook._make_paged_get_request,
+            f"/{post_id}/comments",
+            {
+                "fields": ",".join(fields),
+                "limit": 100,
+                "filter": "stream",
+                "since": int(since.timestamp())
+            },
+            raw_export_log_file=raw_export_log_file
+        )
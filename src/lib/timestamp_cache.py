@@ -0,0 +1,63 @@
+from datetime import datetime
+from functools import lru_cache
+
+from core_data_modules.logging import Logger
+from dateutil.parser import isoparse
+
+log = Logger(__name__)
+
+
+class TimestampCache(object):
+    # Maximum number of distinct timestamps to keep parsed. Each entry takes a few hundred bytes.
+    MAX_SIZE = 2 ** 18
+
+    def __init__(self, max_size=MAX_SIZE):
+        """
+        Bounded, least-recently-used cache of parsed ISO 8601 timestamps.
+
+        The same timestamps are parsed by several pipeline stages in turn (e.g. each message's 'sent_on' is parsed
+        when remapping radio shows, when filtering by the project time range, by the engagement type cleaners, and
+        when sorting), so parsing them once and sharing the results avoids most of the cost of parsing.
+
+        Timestamps in the format written by `datetime.isoformat`, which is the format of the timestamps in the raw
+        data from Rapid Pro, are parsed with the much faster `datetime.fromisoformat`. All other timestamps are parsed
+        with `dateutil.parser.isoparse`.
+
+        :param max_size: Maximum number of parsed timestamps to keep.
+        :type max_size: int
+        """
+        self._parse = lru_cache(maxsize=max_size)(self._parse_uncached)
+
+    @staticmethod
+    def _parse_uncached(timestamp):
+        # `fromisoformat` only accepts exactly the formats that `isoformat` writes, and gives the same datetime as
+        # `isoparse` for all of them. The separator check excludes the formats with a space in place of the 'T'.
+        if len(timestamp) > 10 and timestamp[10] == "T":
+            try:
+                return datetime.fromisoformat(timestamp)
+            except ValueError:
+                pass  # e.g. "24:00" times or a "Z" time zone, which `isoparse` understands.
+        return isoparse(timestamp)
+
+    def parse(self, timestamp):
+        """
+        :param timestamp: ISO 8601 timestamp to parse.
+        :type timestamp: str
+        :return: The parsed timestamp.
+        :rtype: datetime.datetime
+        """
+        return self._parse(timestamp)
+
+    def log_stats(self):
+        """
+        Logs how many of the timestamps parsed so far were served from this cache.
+        """
+        cache_info = self._parse.cache_info()
+        lookups = cache_info.hits + cache_info.misses
+        hit_rate = cache_info.hits / lookups if lookups > 0 else 0
+        log.info(f"Timestamp cache: {lookups} lookups, {cache_info.hits} hits ({hit_rate:.1%}), "
+                 f"{cache_info.currsize}/{cache_info.maxsize} timestamps cached")
+
+
+# Cache shared by all the pipeline stages which parse timestamps.
+timestamps = TimestampCache()
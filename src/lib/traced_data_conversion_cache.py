@@ -0,0 +1,120 @@
+import json
+import os
+from io import StringIO
+
+from core_data_modules.logging import Logger
+from core_data_modules.traced_data.io import TracedDataJsonIO
+from core_data_modules.util import IOUtils
+
+from src.lib.compressed_files import atomic_write, find_file, open_file, with_compression
+
+log = Logger(__name__)
+
+
+class TracedDataConversionCache(object):
+    # Increment this whenever the index format, or any conversion of raw data to TracedData which is cached, changes,
+    # so that previous conversions are discarded.
+    VERSION = 1
+
+    def __init__(self, raw_data_dir, name, fingerprint, compression=None):
+        """
+        Cache of the TracedData JSONL lines previously exported for each item of some raw data (e.g. the runs in a Rapid
+        Pro flow, or the comments on a Facebook page), so that only new or changed items need to be converted to
+        TracedData again.
+
+        The cache re-uses the exported TracedData file `{raw_data_dir}/{name}.jsonl`, alongside an index file
+        `{raw_data_dir}/{name}_traced_data_index.json` which records, for each item, the key the item was converted
+        with and whether the conversion produced a line in the TracedData file.
+
+        An item's key may be any tuple of JSON primitives which changes whenever the item's conversion would, for
+        example (run id, run modified_on, contact modified_on) for a Rapid Pro run.
+
+        :param raw_data_dir: Directory containing the raw data for this pipeline.
+        :type raw_data_dir: str
+        :param name: Name of the exported TracedData file, without its extension.
+        :type name: str
+        :param fingerprint: JSON-serializable description of any configuration which affects the conversion, for
+                            example the test contact uuids. Previous conversions made with a different fingerprint
+                            are discarded.
+        :type fingerprint: dict
+        :param compression: Compression format to save the TracedData file in (see
+                            src.lib.compressed_files.COMPRESSION_EXTENSIONS), or None to save it uncompressed.
+                            Previous exports are loaded in whichever format they were saved in.
+        :type compression: str | None
+        """
+        self.traced_data_path = with_compression(f"{raw_data_dir}/{name}.jsonl", compression)
+        self.index_path = f"{raw_data_dir}/{name}_traced_data_index.json"
+        self.fingerprint = {"Version": self.VERSION, **fingerprint}
+
+    @staticmethod
+    def serialize_traced_data(td):
+        """
+        :param td: TracedData to serialize.
+        :type td: core_data_modules.traced_data.TracedData
+        :return: `td` serialized as a line of a TracedData JSONL file, including the trailing newline.
+        :rtype: str
+        """
+        buffer = StringIO()
+        TracedDataJsonIO.export_traced_data_iterable_to_jsonl([td], buffer)
+        line = buffer.getvalue()
+        if not line.endswith("\n"):
+            line += "\n"
+        return line
+
+    def load(self):
+        """
+        Loads the previous conversions.
+
+        :return: Dictionary of item key -> previously exported line for that item, or None if the previous conversion
+                 of that item didn't produce any TracedData. If there is no usable previous export, returns an empty
+                 dict.
+        :rtype: dict of tuple -> (str | None)
+        """
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            log.info(f"No TracedData index found at '{self.index_path}'; all items will be converted")
+            return dict()
+
+        if index["Fingerprint"] != self.fingerprint:
+            log.info(f"The conversion settings changed since '{self.traced_data_path}' was exported; "
+                     f"all items will be converted")
+            return dict()
+
+        traced_data_path = find_file(self.traced_data_path)
+        if traced_data_path is None or os.path.getsize(traced_data_path) != index["TracedDataFileSize"]:
+            log.warning(f"'{self.traced_data_path}' has changed since it was indexed; all items will be converted")
+            return dict()
+
+        cached_lines = dict()
+        with open_file(traced_data_path) as f:
+            for *key, has_line in index["Items"]:
+                cached_lines[tuple(key)] = f.readline() if has_line else None
+        return cached_lines
+
+    def save(self, keys, lines):
+        """
+        Exports the TracedData file and its index.
+
+        :param keys: Cache key of each item, in export order.
+        :type keys: list of tuple
+        :param lines: Exported line for each item in `keys`, or None if the item has no TracedData.
+        :type lines: list of (str | None)
+        """
+        assert len(keys) == len(lines)
+
+        IOUtils.ensure_dirs_exist_for_file(self.traced_data_path)
+        with atomic_write(self.traced_data_path) as f:
+            for line in lines:
+                if line is not None:
+                    f.write(line)
+
+        index = {
+            "Fingerprint": self.fingerprint,
+            "TracedDataFileSize": os.path.getsize(self.traced_data_path),
+            "Items": [[*key, line is not None] for key, line in zip(keys, lines)]
+        }
+        with open(f"{self.index_path}.tmp", "w") as f:
+            json.dump(index, f)
+        os.replace(f"{self.index_path}.tmp", self.index_path)
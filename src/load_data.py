@@ -1,62 +1,346 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import StringIO
+
 from core_data_modules.logging import Logger
-from core_data_modules.traced_data import TracedData, Metadata
+from core_data_modules.traced_data import Metadata
 from core_data_modules.traced_data.io import TracedDataJsonIO
 from core_data_modules.util import TimeUtils
 
+from src.lib.compressed_files import compression_of, find_file, open_file
+from src.lib.lazy_traced_data import LazyTracedData
+from src.lib.loaded_raw_data_cache import LoadedRawDataCache
+
 log = Logger(__name__)
 
+# Marker in the keys that Rapid Pro runs' TracedData record their run ids under, e.g. "Gender (Run ID) - demog".
+RUN_ID_KEY_MARKER = " (Run ID) - "
+
+
+def _import_jsonl(f, projected_keys):
+    if projected_keys is None:
+        return TracedDataJsonIO.import_jsonl_to_traced_data_iterable(f)
+
+    lines = [line for line in f if line.strip() != ""]
+    traced_data = [LazyTracedData.from_jsonl_line(line, projected_keys) for line in lines]
+
+    # Check the projection against a full decode of the first lazily loaded TracedData, and load everything eagerly
+    # if they differ, so that a change to the TracedData JSONL format can only ever cost the benefit of lazy loading.
+    first_lazy_td = next((td for td in traced_data if isinstance(td, LazyTracedData)), None)
+    if first_lazy_td is not None and not first_lazy_td.projection_matches_decoded():
+        log.warning("Projected values don't match the fully decoded TracedData; loading this data eagerly instead")
+        return TracedDataJsonIO.import_jsonl_to_traced_data_iterable(StringIO("".join(lines)))
+    return traced_data
+
+
+def _load_jsonl_range(path, start, end, projected_keys=None):
+    """
+    Loads the TracedData in a range of lines of a TracedData JSONL file.
+
+    This is a module-level function so that it can be run in a worker process.
+
+    :param path: Path to the file to load.
+    :type path: str
+    :param start: Byte offset of the first line to load, or None to load the whole file.
+    :type start: int | None
+    :param end: Byte offset of the end of the last line to load, or None to load the whole file.
+    :type end: int | None
+    :param projected_keys: If set, loads each TracedData as a LazyTracedData which only decodes these keys.
+    :type projected_keys: frozenset of str | None
+    :return: The loaded TracedData, and the time taken to load it in seconds.
+    :rtype: (list of core_data_modules.traced_data.TracedData | list of LazyTracedData, float)
+    """
+    start_time = time.perf_counter()
+    if start is None:
+        with open_file(path) as f:
+            traced_data = _import_jsonl(f, projected_keys)
+    else:
+        with open(path, "rb") as f:
+            f.seek(start)
+            lines = f.read(end - start).decode("utf-8")
+        traced_data = _import_jsonl(StringIO(lines), projected_keys)
+    return traced_data, time.perf_counter() - start_time
+
 
 class LoadData(object):
+    # Uncompressed raw data files larger than this are split into line ranges of about this size, so that the ranges
+    # can be parsed in parallel. Compressed files can't be read from an arbitrary offset, so are always parsed whole.
+    LINE_RANGE_SIZE_BYTES = 32 * 1024 * 1024
+
+    @classmethod
+    def _split_into_line_ranges(cls, path):
+        """
+        :return: (start, end) byte offsets of consecutive ranges of whole lines which together cover the file at `path`,
+                 or [(None, None)] if the file must be parsed whole.
+        :rtype: list of (int | None, int | None)
+        """
+        if compression_of(path) is not None or os.path.getsize(path) <= cls.LINE_RANGE_SIZE_BYTES:
+            return [(None, None)]
+
+        file_size = os.path.getsize(path)
+        line_ranges = []
+        with open(path, "rb") as f:
+            start = 0
+            while start < file_size:
+                # Extend each range to the end of the line it would otherwise end in the middle of.
+                f.seek(min(start + cls.LINE_RANGE_SIZE_BYTES, file_size))
+                f.readline()
+                end = f.tell()
+                line_ranges.append((start, end))
+                start = end
+        return line_ranges
+
     @staticmethod
-    def load_datasets(raw_data_dir, flow_names):
+    def _find_raw_flow_paths(raw_data_dir, flow_names):
+        """
+        :return: Path to the raw data file of each of the given flows, in the same order as `flow_names`.
+        :rtype: list of str
+        """
+        raw_flow_paths = []
+        for flow_name in flow_names:
+            # Raw data files may be compressed, in which case the format is given by the file's extension.
+            raw_flow_path = find_file(f"{raw_data_dir}/{flow_name}.jsonl")
+            assert raw_flow_path is not None, f"No raw data file found for flow '{flow_name}' in '{raw_data_dir}'"
+            raw_flow_paths.append(raw_flow_path)
+        return raw_flow_paths
+
+    @classmethod
+    def load_datasets(cls, raw_data_dir, flow_names, max_load_processes=1, lazy_flow_names=None, projected_keys=None):
+        """
+        Loads the TracedData JSONL file for each of the given flows.
+
+        If `max_load_processes` is more than 1, the files are parsed in a pool of that many processes, with large files
+        split into ranges of lines which are parsed in parallel. The TracedData are always returned in the same order
+        as in the files.
+
+        :param raw_data_dir: Directory containing the raw data files.
+        :type raw_data_dir: str
+        :param flow_names: Names of the flows to load.
+        :type flow_names: list of str
+        :param max_load_processes: The maximum number of processes to parse the files with.
+        :type max_load_processes: int
+        :param lazy_flow_names: Names of the flows to load as LazyTracedData, which only decode the `projected_keys`
+                                until more is needed from them.
+        :type lazy_flow_names: collection of str | None
+        :param projected_keys: Keys to decode when loading the `lazy_flow_names`.
+        :type projected_keys: collection of str | None
+        :return: The TracedData loaded for each flow, in the same order as `flow_names`.
+        :rtype: list of list of core_data_modules.traced_data.TracedData
+        """
+        raw_flow_paths = cls._find_raw_flow_paths(raw_data_dir, flow_names)
+
+        if lazy_flow_names is None:
+            lazy_flow_names = []
+        projected_keys_by_flow = [
+            frozenset(projected_keys) if flow_name in lazy_flow_names else None for flow_name in flow_names
+        ]
+
+        def log_loaded(i, raw_flow_path, runs, load_duration):
+            file_size = os.path.getsize(raw_flow_path)
+            # Guard against a zero duration for tiny files.
+            load_duration = max(load_duration, 1e-6)
+            log.info(f"Loaded {i + 1}/{len(flow_names)}: {len(runs)} runs from {raw_flow_path} in "
+                     f"{load_duration:.2f}s ({len(runs) / load_duration:.0f} rows/s, "
+                     f"{file_size / load_duration / (1024 * 1024):.1f} MB/s)")
+
         datasets = []
-        for i, flow_name in enumerate(flow_names):
-            raw_flow_path = f"{raw_data_dir}/{flow_name}.jsonl"
-            log.info(f"Loading {i + 1}/{len(flow_names)}: {raw_flow_path}...")
-            with open(raw_flow_path, "r") as f:
-                runs = TracedDataJsonIO.import_jsonl_to_traced_data_iterable(f)
-            log.info(f"Loaded {len(runs)} runs")
-            datasets.append(runs)
+        if max_load_processes == 1:
+            for i, (raw_flow_path, flow_projected_keys) in enumerate(zip(raw_flow_paths, projected_keys_by_flow)):
+                log.info(f"Loading {i + 1}/{len(flow_names)}: {raw_flow_path}...")
+                runs, load_duration = _load_jsonl_range(raw_flow_path, None, None, flow_projected_keys)
+                log_loaded(i, raw_flow_path, runs, load_duration)
+                datasets.append(runs)
+            return datasets
+
+        log.info(f"Loading {len(flow_names)} files using up to {max_load_processes} processes...")
+        with ProcessPoolExecutor(max_workers=max_load_processes) as executor:
+            # Submit every range of every file before waiting for any, so that all the workers are kept busy.
+            range_loads = [
+                [executor.submit(_load_jsonl_range, raw_flow_path, start, end, flow_projected_keys)
+                 for start, end in cls._split_into_line_ranges(raw_flow_path)]
+                for raw_flow_path, flow_projected_keys in zip(raw_flow_paths, projected_keys_by_flow)
+            ]
+
+            # Reassemble each file's ranges in order. The reported load time is the total time spent parsing a file
+            # across all workers.
+            for i, (raw_flow_path, file_range_loads) in enumerate(zip(raw_flow_paths, range_loads)):
+                runs = []
+                load_duration = 0
+                for range_load in file_range_loads:
+                    range_runs, range_load_duration = range_load.result()
+                    runs.extend(range_runs)
+                    load_duration += range_load_duration
+                log_loaded(i, raw_flow_path, runs, load_duration)
+                datasets.append(runs)
+
         return datasets
 
-    @staticmethod
-    def coalesce_traced_runs_by_key(user, traced_runs, coalesce_key):
-        coalesced_runs = dict()
+    @classmethod
+    def coalesce_traced_runs_by_key(cls, user, traced_runs, coalesce_key):
+        """
+        Coalesces the runs which share the same value for `coalesce_key` into a single TracedData.
+
+        The first run for each key is kept, and the data from all of that key's later runs is appended to it in a
+        single update, where later runs take precedence over earlier ones. The Rapid Pro run ids of the runs which were
+        merged are recorded in that update's Metadata source, so the provenance of the merged data stays with it.
 
+        :param user: Identifier of the user running this program, for TracedData Metadata.
+        :type user: str
+        :param traced_runs: Runs to coalesce.
+        :type traced_runs: iterable of core_data_modules.traced_data.TracedData
+        :param coalesce_key: Key to coalesce the runs on.
+        :type coalesce_key: str
+        :return: One TracedData for each distinct value of `coalesce_key`, in order of first appearance.
+        :rtype: list of core_data_modules.traced_data.TracedData
+        """
+        runs_by_key = dict()  # of coalesce key value -> list of TracedData
         for run in traced_runs:
-            if run[coalesce_key] not in coalesced_runs:
-                coalesced_runs[run[coalesce_key]] = run
-            else:
-                coalesced_runs[run[coalesce_key]].append_data(
-                    dict(run.items()), Metadata(user, Metadata.get_call_location(), TimeUtils.utc_now_as_iso_string()))
+            runs_by_key.setdefault(run[coalesce_key], []).append(run)
+
+        coalesced_runs = []
+        merged_runs_count = 0
+        for runs in runs_by_key.values():
+            coalesced_run = runs[0]
+            if len(runs) > 1:
+                merged_data = dict()
+                merged_run_ids = dict()  # of run id -> None, in order of first appearance
+                for run in runs[1:]:
+                    for key, value in run.items():
+                        merged_data[key] = value
+                        if RUN_ID_KEY_MARKER in key:
+                            merged_run_ids[str(value)] = None
+
+                coalesced_run.append_data(
+                    merged_data,
+                    Metadata(user, f"{Metadata.get_call_location()} (coalesced {len(runs) - 1} runs, run ids "
+                                   f"[{', '.join(merged_run_ids)}])", TimeUtils.utc_now_as_iso_string())
+                )
+                merged_runs_count += len(runs) - 1
+            coalesced_runs.append(coalesced_run)
 
-        return list(coalesced_runs.values())
+        log.info(f"Coalesced {merged_runs_count} runs into {len(coalesced_runs)} runs by '{coalesce_key}'")
+        return coalesced_runs
 
     @staticmethod
     def combine_raw_datasets(user, messages_datasets, surveys_datasets):
+        """
+        Combines the messages datasets into a single list of messages, and appends to each message the survey responses
+        of the participant who sent it, joining on "avf_phone_id".
+
+        This produces the same data as calling
+        `TracedData.update_iterable(user, "avf_phone_id", data, surveys_dataset, "survey_responses")` for each survey
+        dataset in turn, so where survey datasets share keys, the datasets later in `surveys_datasets` take precedence.
+        However, rather than scanning every message once per survey dataset, the survey datasets are indexed by
+        "avf_phone_id" once, each participant's survey responses are merged once, and each message has a single
+        update appended.
+
+        :param user: Identifier of the user running this program, for TracedData Metadata.
+        :type user: str
+        :param messages_datasets: Datasets of messages to combine.
+        :type messages_datasets: list of list of core_data_modules.traced_data.TracedData
+        :param surveys_datasets: Datasets of survey responses, with at most one TracedData per "avf_phone_id" in each
+                                 dataset, in increasing order of precedence.
+        :type surveys_datasets: list of list of core_data_modules.traced_data.TracedData
+        :return: All the messages, with the survey responses appended.
+        :rtype: list of core_data_modules.traced_data.TracedData
+        """
         data = []
 
         for messages_dataset in messages_datasets:
             data.extend(messages_dataset)
 
+        # Index the survey responses from every dataset by participant, in precedence order.
+        survey_responses_by_phone_id = dict()  # of avf_phone_id -> list of TracedData
         for surveys_dataset in surveys_datasets:
-            TracedData.update_iterable(user, "avf_phone_id", data, surveys_dataset, "survey_responses")
+            # If a dataset contains more than one TracedData for a participant, only the last is used.
+            dataset_lut = {td["avf_phone_id"]: td for td in surveys_dataset}
+            for phone_id, td in dataset_lut.items():
+                survey_responses_by_phone_id.setdefault(phone_id, []).append(td)
+
+        # Merge each participant's survey responses into a single TracedData, the first time one of their messages
+        # needs it. The survey datasets themselves are not modified.
+        merged_survey_responses = dict()  # of avf_phone_id -> TracedData
+
+        def get_merged_survey_responses(phone_id):
+            if phone_id not in merged_survey_responses:
+                survey_responses = survey_responses_by_phone_id[phone_id]
+                merged = survey_responses[0]
+                if len(survey_responses) > 1:
+                    merged = merged.copy()
+                    for td in survey_responses[1:]:
+                        merged.append_traced_data(
+                            "survey_responses", td,
+                            Metadata(user, Metadata.get_call_location(), TimeUtils.utc_now_as_iso_string())
+                        )
+                merged_survey_responses[phone_id] = merged
+            return merged_survey_responses[phone_id]
+
+        for td in data:
+            if td["avf_phone_id"] in survey_responses_by_phone_id:
+                td.append_traced_data(
+                    "survey_responses", get_merged_survey_responses(td["avf_phone_id"]),
+                    Metadata(user, Metadata.get_call_location(), TimeUtils.utc_now_as_iso_string())
+                )
 
         return data
 
     @classmethod
-    def load_raw_data(cls, user, raw_data_dir, pipeline_configuration):
+    def load_raw_data(cls, user, raw_data_dir, pipeline_configuration, cache_dir=None,
+                      pipeline_configuration_dict=None):
+        """
+        Loads the raw data files of all the flows in the pipeline configuration, and combines them into a single list
+        of messages with the survey responses of the participant who sent each message appended.
+
+        If `cache_dir` is given, a snapshot of the combined data is kept there, keyed by the contents of the raw data
+        files and the whole pipeline configuration. If a snapshot matching the current raw data files and configuration
+        exists, it is returned instead of re-loading and re-combining the raw data.
+
+        :param user: Identifier of the user running this program, for TracedData Metadata.
+        :type user: str
+        :param raw_data_dir: Directory containing the raw data files.
+        :type raw_data_dir: str
+        :param pipeline_configuration: Pipeline configuration.
+        :type pipeline_configuration: PipelineConfiguration
+        :param cache_dir: Directory to keep a snapshot of the loaded data in, or None to always load the raw data.
+                          See LoadedRawDataCache for the trust requirements on this directory.
+        :type cache_dir: str | None
+        :param pipeline_configuration_dict: The pipeline configuration, as parsed from the pipeline configuration file.
+                                            Required if `cache_dir` is given, to key the snapshot on.
+        :type pipeline_configuration_dict: dict | None
+        :return: The combined data.
+        :rtype: list of core_data_modules.traced_data.TracedData
+        """
         activation_flow_names = []
         survey_flow_names = []
         for raw_data_source in pipeline_configuration.raw_data_sources:
             activation_flow_names.extend(raw_data_source.get_activation_flow_names())
             survey_flow_names.extend(raw_data_source.get_survey_flow_names())
-            
-        log.info("Loading activation datasets...")
-        activation_datasets = cls.load_datasets(raw_data_dir, activation_flow_names)
 
-        log.info("Loading survey datasets...")
-        survey_datasets = cls.load_datasets(raw_data_dir, survey_flow_names)
+        # The survey runs are always loaded eagerly, because coalescing them reads every key anyway.
+        projected_keys = None
+        if pipeline_configuration.lazy_raw_data_loading:
+            projected_keys = pipeline_configuration.get_referenced_keys()
+
+        if cache_dir is not None:
+            assert pipeline_configuration_dict is not None, \
+                "The pipeline configuration dict must be given to key the loaded raw data snapshot on"
+            cache = LoadedRawDataCache(cache_dir)
+            log.info("Checking for a snapshot of the loaded raw data...")
+            cache_key = cache.get_key(user, pipeline_configuration_dict,
+                                      cls._find_raw_flow_paths(raw_data_dir, activation_flow_names + survey_flow_names),
+                                      projected_keys)
+            data = cache.load(cache_key)
+            if data is not None:
+                return data
+
+        # Load the activation and survey datasets together, so that all the files can be parsed in parallel.
+        log.info("Loading activation and survey datasets...")
+        datasets = cls.load_datasets(raw_data_dir, activation_flow_names + survey_flow_names,
+                                     pipeline_configuration.max_load_processes,
+                                     activation_flow_names if projected_keys is not None else None, projected_keys)
+        activation_datasets = datasets[:len(activation_flow_names)]
+        survey_datasets = datasets[len(activation_flow_names):]
 
         # Add survey data to the messages
         log.info("Combining Datasets...")
@@ -65,4 +349,7 @@ class LoadData(object):
             coalesced_survey_datasets.append(cls.coalesce_traced_runs_by_key(user, dataset, "avf_phone_id"))
         data = cls.combine_raw_datasets(user, activation_datasets, coalesced_survey_datasets)
 
+        if cache_dir is not None:
+            cache.save(cache_key, data)
+
         return data
@@ -0,0 +1,190 @@
+import heapq
+import multiprocessing
+import sys
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from core_data_modules.logging import Logger
+
+from src.auto_code import AutoCode
+from src.lib import PipelineConfiguration, MessageFilters
+from src.lib.timestamp_cache import timestamps
+from src.translate_source_keys import TranslateSourceKeys
+from src.ws_correction import WSCorrection
+
+log = Logger(__name__)
+
+# Recursion limit needed to pickle TracedData with long histories when sending them to and from the shard workers.
+# Pickling recurses once per update in a TracedData's history.
+_SHARD_RECURSION_LIMIT = 15000
+
+# Pipeline configuration of a shard worker process, loaded once when the worker starts.
+_worker_pipeline_configuration = None
+
+
+def _init_shard_worker(pipeline_configuration_file_path):
+    global _worker_pipeline_configuration
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), _SHARD_RECURSION_LIMIT))
+    with open(pipeline_configuration_file_path) as f:
+        _worker_pipeline_configuration = PipelineConfiguration.from_configuration_file(f)
+    Logger.set_project_name(_worker_pipeline_configuration.pipeline_name)
+
+
+def _run_shard(user, keyed_data, prev_coded_dir_path):
+    keyed_outputs = ParticipantStages.run_keyed(user, keyed_data, _worker_pipeline_configuration, prev_coded_dir_path)
+    # Each worker has its own timestamp cache, so report each one's use separately.
+    timestamps.log_stats()
+    return keyed_outputs
+
+
+class ParticipantStages(object):
+    """
+    The generate outputs stages which process each participant's messages independently of every other participant's:
+    source key translation, WS correction, message filtering, and automatic cleaning.
+    """
+
+    @staticmethod
+    def run_keyed(user, keyed_data, pipeline_configuration, prev_coded_dir_path):
+        """
+        Runs the participant stages on messages which are each tagged with a sort key, and tags the output messages
+        with sort keys such that sorting all of the outputs of any partition of the input by participant gives the
+        outputs in the same order as running this on the whole input at once.
+
+        :param user: Identifier of the user running this program, for TracedData Metadata.
+        :type user: str
+        :param keyed_data: (sort key, TracedData) for each message, in increasing order of sort key.
+        :type keyed_data: list of (tuple, core_data_modules.traced_data.TracedData)
+        :param pipeline_configuration: Pipeline configuration.
+        :type pipeline_configuration: PipelineConfiguration
+        :param prev_coded_dir_path: Directory containing the Coda files generated by a previous run of this pipeline.
+        :type prev_coded_dir_path: str
+        :return: (sort key, TracedData) for each output message, in increasing order of sort key.
+        :rtype: list of (tuple, core_data_modules.traced_data.TracedData)
+        """
+        # The stages either update messages in place or filter them, except for WS correction, so messages are
+        # tracked by identity. `keyed_data` keeps every input message alive, so no two messages share an id.
+        keys = {id(td): key for key, td in keyed_data}
+        data = [td for _, td in keyed_data]
+
+        log.info("Translating source Keys...")
+        data = TranslateSourceKeys.translate_source_keys(user, data, pipeline_configuration)
+
+        if pipeline_configuration.move_ws_messages:
+            log.info("Pre-filtering empty message objects...")
+            # This is a performance optimisation to save execution time + memory when moving WS messages, by removing
+            # the need to mark and process a high volume of empty message objects as 'NR' in WS correction.
+            # Empty message objects represent flow runs where the participants never sent a message e.g. from an
+            # advert flow run where we asked someone a question but didn't receive a response.
+            data = MessageFilters.filter_empty_messages(
+                data, [plan.raw_field for plan in PipelineConfiguration.RQA_CODING_PLANS])
+
+            # WS correction outputs new messages, grouped by participant in order of each participant's first input
+            # message, so key the outputs by the key of that message then by output position.
+            first_message_keys = dict()  # of uid -> sort key
+            for td in data:
+                first_message_keys.setdefault(td["uid"], keys[id(td)])
+
+            log.info("Moving WS messages...")
+            data = WSCorrection.move_wrong_scheme_messages(user, data, prev_coded_dir_path)
+            keys = {id(td): (first_message_keys[td["uid"]], i) for i, td in enumerate(data)}
+            assert all(keys[id(prev_td)] < keys[id(td)] for prev_td, td in zip(data, data[1:])), \
+                "WS correction didn't group its output by participant in order of first message, so the output " \
+                "can't be ordered consistently between shards"
+        else:
+            log.info("Not moving WS messages (because the 'MoveWSMessages' key in the pipeline configuration "
+                     "json was set to 'false')")
+
+        log.info("Auto Coding...")
+        data = AutoCode.auto_code_messages(user, data, pipeline_configuration)
+
+        return [(keys[id(td)], td) for td in data]
+
+    @classmethod
+    def run(cls, user, data, pipeline_configuration, prev_coded_dir_path):
+        """
+        Runs the participant stages on all the messages in this process.
+
+        :param user: Identifier of the user running this program, for TracedData Metadata.
+        :type user: str
+        :param data: Messages to process.
+        :type data: list of core_data_modules.traced_data.TracedData
+        :param pipeline_configuration: Pipeline configuration.
+        :type pipeline_configuration: PipelineConfiguration
+        :param prev_coded_dir_path: Directory containing the Coda files generated by a previous run of this pipeline.
+        :type prev_coded_dir_path: str
+        :return: The processed messages.
+        :rtype: list of core_data_modules.traced_data.TracedData
+        """
+        keyed_data = [((i,), td) for i, td in enumerate(data)]
+        return [td for _, td in cls.run_keyed(user, keyed_data, pipeline_configuration, prev_coded_dir_path)]
+
+    @classmethod
+    def run_sharded(cls, user, data, pipeline_configuration_file_path, prev_coded_dir_path, shards):
+        """
+        Runs the participant stages on the messages in a pool of worker processes, with each worker processing the
+        messages of a different shard of the participants, then merges the shards' outputs.
+
+        The output is the same as the output of `run`, in the same order.
+
+        :param user: Identifier of the user running this program, for TracedData Metadata.
+        :type user: str
+        :param data: Messages to process.
+        :type data: list of core_data_modules.traced_data.TracedData
+        :param pipeline_configuration_file_path: Path to the pipeline configuration json file, for the workers to load.
+        :type pipeline_configuration_file_path: str
+        :param prev_coded_dir_path: Directory containing the Coda files generated by a previous run of this pipeline.
+        :type prev_coded_dir_path: str
+        :param shards: Number of shards to partition the participants into, each processed by its own worker.
+        :type shards: int
+        :return: The processed messages.
+        :rtype: list of core_data_modules.traced_data.TracedData
+        """
+        keyed_shards = cls.partition(data, shards)
+        log.info(f"Partitioned {len(data)} messages into {shards} shards of "
+                 f"{', '.join(str(len(keyed_shard)) for keyed_shard in keyed_shards)} messages")
+
+        # The messages are pickled in this process to send them to the workers, so this process needs the same
+        # recursion limit as the workers.
+        sys.setrecursionlimit(max(sys.getrecursionlimit(), _SHARD_RECURSION_LIMIT))
+
+        # Workers are spawned rather than forked, and load their own copy of the pipeline configuration, because
+        # constructing a PipelineConfiguration adds to the coding plans stored on the class.
+        with ProcessPoolExecutor(max_workers=shards, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_shard_worker,
+                                 initargs=(pipeline_configuration_file_path,)) as executor:
+            shard_results = [executor.submit(_run_shard, user, keyed_shard, prev_coded_dir_path)
+                             for keyed_shard in keyed_shards]
+            keyed_outputs = [shard_result.result() for shard_result in shard_results]
+
+        return cls.merge(keyed_outputs)
+
+    @staticmethod
+    def partition(data, shards):
+        """
+        Partitions messages into shards by participant, tagging each message with a sort key for `run_keyed`.
+
+        :param data: Messages to partition.
+        :type data: list of core_data_modules.traced_data.TracedData
+        :param shards: Number of shards to partition the messages into.
+        :type shards: int
+        :return: (sort key, TracedData) for each message in each shard, in increasing order of sort key.
+        :rtype: list of list of (tuple, core_data_modules.traced_data.TracedData)
+        """
+        # Shard by a hash which is stable between processes (unlike `hash`), so that each participant's messages are
+        # all processed by the same worker.
+        keyed_shards = [[] for _ in range(shards)]
+        for i, td in enumerate(data):
+            keyed_shards[zlib.crc32(td["uid"].encode("utf-8")) % shards].append(((i,), td))
+        return keyed_shards
+
+    @staticmethod
+    def merge(keyed_outputs):
+        """
+        Merges the outputs of running `run_keyed` on each shard returned by `partition`.
+
+        :param keyed_outputs: The output of `run_keyed` for each shard.
+        :type keyed_outputs: list of list of (tuple, core_data_modules.traced_data.TracedData)
+        :return: The messages in all the shards' outputs, in the same order as the output of `run`.
+        :rtype: list of core_data_modules.traced_data.TracedData
+        """
+        return [td for _, td in heapq.merge(*keyed_outputs, key=lambda keyed_td: keyed_td[0])]
@@ -1,216 +1,383 @@
-from datetime import datetime
+from bisect import bisect_right
+from datetime import datetime, timedelta
 
 import pytz
 from core_data_modules.logging import Logger
 from core_data_modules.traced_data import Metadata
 from core_data_modules.util import TimeUtils
-from dateutil.parser import isoparse
 
 from src.lib import PipelineConfiguration
+from src.lib.lazy_traced_data import LazyTracedData
+from src.lib.timestamp_cache import timestamps
 
 log = Logger(__name__)
 
+_EPOCH = pytz.utc.localize(datetime(1970, 1, 1))
 
-class TranslateSourceKeys(object):
-    @classmethod
-    def set_show_ids(cls, user, data, pipeline_configuration):
+
+def _to_epoch_microseconds(dt):
+    # Integer arithmetic, so that the whole range from datetime.min to datetime.max is represented exactly.
+    return (dt - _EPOCH) // timedelta(microseconds=1)
+
+
+class _PendingTranslation(object):
+    def __init__(self, td):
         """
-        Sets a show pipeline key for each message, using the presence of source keys to determine which show each
-        message belongs to.
+        A TracedData as it will be once the updates made by translating its source keys are applied.
+
+        Updates are accumulated here, and reads see the accumulated updates, so that all the translation steps can be
+        applied to a TracedData before any of them are committed to it.
+
+        :param td: TracedData being translated.
+        :type td: TracedData
+        """
+        self.td = td
+        self.updated = dict()
+        self.hidden_keys = set()
+
+    def __contains__(self, key):
+        if key in self.updated:
+            return True
+        if key in self.hidden_keys:
+            return False
+        return key in self.td
+
+    def __getitem__(self, key):
+        if key in self.updated:
+            return self.updated[key]
+        if key in self.hidden_keys:
+            raise KeyError(key)
+        return self.td[key]
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def keys_in(self, lookup):
+        """
+        :param lookup: Dictionary to look the keys of this TracedData up in.
+        :type lookup: dict
+        :return: The keys of this TracedData which are also keys of `lookup`.
+        :rtype: set
+        """
+        if isinstance(self.td, LazyTracedData) and not self.td.is_materialised():
+            # Listing the keys of a lazily loaded TracedData would decode all of it. Source keys are always projected
+            # when loading lazily, so probe for each of the lookup's keys instead.
+            candidate_keys = lookup.keys()
+        else:
+            candidate_keys = self.td.keys()
+
+        keys = {key for key in candidate_keys if key in lookup and key in self}
+        keys.update(key for key in self.updated if key in lookup)
+        return keys
+
+    def append_data(self, new_data):
+        self.updated.update(new_data)
+        self.hidden_keys.difference_update(new_data.keys())
+
+    def hide_keys(self, keys):
+        for key in keys:
+            self.updated.pop(key, None)
+        self.hidden_keys.update(keys)
+
+    def commit(self, user):
+        """
+        Applies the accumulated updates to the TracedData, with at most one call to `hide_keys` followed by at most one
+        call to `append_data`.
 
         :param user: Identifier of the user running this program, for TracedData Metadata.
         :type user: str
-        :param data: TracedData objects to set the show ids of.
-        :type data: iterable of TracedData
-        :param pipeline_configuration: Pipeline configuration.
-        :type pipeline_configuration: PipelineConfiguration
+        :return: The number of updates which were applied.
+        :rtype: int
         """
-        for td in data:
-            show_dict = dict()
+        updates_count = 0
 
-            for remapping in pipeline_configuration.source_key_remappings:
-                if not remapping.is_activation_message:
-                    continue
+        # Keys which aren't in the TracedData don't need hiding. Keys which were hidden and then set again aren't in
+        # self.hidden_keys, and are set by the append below.
+        hidden_keys = {key for key in self.hidden_keys if key in self.td}
+        if len(hidden_keys) > 0:
+            self.td.hide_keys(hidden_keys, Metadata(user, Metadata.get_call_location(),
+                                                    TimeUtils.utc_now_as_iso_string()))
+            updates_count += 1
 
-                if td.get(remapping.source_key) is not None:
-                    assert "rqa_message" not in show_dict
-                    show_dict["rqa_message"] = td[remapping.source_key]
-                    show_dict["show_pipeline_key"] = remapping.pipeline_key
+        if len(self.updated) > 0:
+            self.td.append_data(self.updated, Metadata(user, Metadata.get_call_location(),
+                                                       TimeUtils.utc_now_as_iso_string()))
+            updates_count += 1
 
-            td.append_data(show_dict, Metadata(user, Metadata.get_call_location(), TimeUtils.utc_now_as_iso_string()))
+        return updates_count
 
-    @classmethod
-    def _remap_radio_show_by_time_range(cls, user, data, time_key, show_pipeline_key_to_remap_to,
-                                        range_start=None, range_end=None, time_to_adjust_to=None):
+
+class _CompiledSourceKeyRemappings(object):
+    def __init__(self, source_key_remappings):
         """
-        Remaps radio show messages received in the given time range to another radio show.
+        Lookup tables of the source key remappings, so that each message only needs to be checked for the source keys
+        it contains, rather than for every configured source key.
 
-        Optionally adjusts the datetime of re-mapped messages to a constant.
+        :param source_key_remappings: Source key remappings, in the order they are configured.
+        :type source_key_remappings: list of SourceKeyRemapping
+        """
+        self.activation_pipeline_keys = dict()  # of source key -> list of pipeline key
+        self.pipeline_keys = dict()  # of source key -> list of (precedence, pipeline key)
+        for precedence, remapping in enumerate(source_key_remappings):
+            if remapping.is_activation_message:
+                self.activation_pipeline_keys.setdefault(remapping.source_key, []).append(remapping.pipeline_key)
+            else:
+                self.pipeline_keys.setdefault(remapping.source_key, []).append((precedence, remapping.pipeline_key))
 
-        :param user: Identifier of the user running this program, for TracedData Metadata.
-        :type user: str
-        :param data: TracedData objects to set the show ids of.
-        :type data: iterable of TracedData
-        :param time_key: Key in each TracedData of an ISO 8601-formatted datetime string to read the message sent on
-                         time from.
-        :type time_key: str
-        :param show_pipeline_key_to_remap_to: Pipeline key to assign to messages received within the given time range.
-        :type show_pipeline_key_to_remap_to: str
-        :param range_start: Start datetime for the time range to remap radio show messages from, inclusive.
-                            If None, defaults to the beginning of time.
-        :type range_start: datetime | None
-        :param range_end: End datetime for the time range to remap radio show messages from, exclusive.
-                          If None, defaults to the end of time.
-        :type range_end: datetime | None
-        :param time_to_adjust_to: Datetime to assign to the `time_key` field of re-mapped shows.
-                                  If None, re-mapped shows will not have timestamps re-adjusted.
-        :type time_to_adjust_to: datetime | None
-        """
-        if range_start is None:
-            range_start = pytz.utc.localize(datetime.min)
-        if range_end is None:
-            range_end = pytz.utc.localize(datetime.max)
-
-        log.info(f"Remapping messages in time range {range_start.isoformat()} to {range_end.isoformat()} "
-                 f"to show {show_pipeline_key_to_remap_to}...")
-
-        remapped_count = 0
-        for td in data:
-            if time_key in td and range_start <= isoparse(td[time_key]) < range_end:
-                remapped_count += 1
 
-                remapped = {
-                    "show_pipeline_key": show_pipeline_key_to_remap_to
-                }
-                if time_to_adjust_to is not None:
-                    remapped[time_key] = time_to_adjust_to.isoformat()
+class _TimestampRemappingIndex(object):
+    def __init__(self, timestamp_remappings):
+        """
+        Interval index of the timestamp remappings, so that the remappings which apply to a message can be found with
+        a binary search of the message's timestamp, rather than by testing the message against every remapping.
 
-                td.append_data(remapped,
-                               Metadata(user, Metadata.get_call_location(), TimeUtils.utc_now_as_iso_string()))
+        For each time key, the time ranges of the remappings of that key split time into consecutive segments, in each
+        of which the same remappings apply. Segments are stored as the sorted list of their start times, alongside the
+        indices of the remappings which apply in each segment, in configuration order.
+
+        :param timestamp_remappings: Timestamp remappings, in the order they are configured.
+        :type timestamp_remappings: list of TimestampRemapping
+        """
+        self.timestamp_remappings = timestamp_remappings
+
+        # Datetimes to adjust each remapping's time key to, as ISO strings and as epoch microseconds.
+        self._adjusted_time_strings = []
+        self._adjusted_times = []
+        for remapping in timestamp_remappings:
+            if remapping.time_to_adjust_to is None:
+                self._adjusted_time_strings.append(None)
+                self._adjusted_times.append(None)
+            else:
+                self._adjusted_time_strings.append(remapping.time_to_adjust_to.isoformat())
+                self._adjusted_times.append(_to_epoch_microseconds(remapping.time_to_adjust_to))
+
+        self._segments = dict()  # of time key -> (list of segment start time, list of list of remapping index)
+        for time_key in {remapping.time_key for remapping in timestamp_remappings}:
+            ranges = [
+                (i, _to_epoch_microseconds(remapping.range_start_inclusive),
+                 _to_epoch_microseconds(remapping.range_end_exclusive))
+                for i, remapping in enumerate(timestamp_remappings) if remapping.time_key == time_key
+            ]
+            segment_starts = sorted({start for _, start, _ in ranges} | {end for _, _, end in ranges})
+            segment_remappings = [
+                [i for i, start, end in ranges if start <= segment_start < end] for segment_start in segment_starts
+            ]
+            self._segments[time_key] = (segment_starts, segment_remappings)
+
+    def get_matching_remappings(self, td):
+        """
+        Returns the remappings which apply to a message, with the same result as testing the message against each
+        remapping in turn and applying each remapping as soon as it matches. In particular, once a remapping which
+        adjusts the message's timestamp applies, the later remappings are tested against the adjusted timestamp.
+
+        :param td: Message to find the remappings of.
+        :type td: _PendingTranslation
+        :return: Indices of the remappings which apply to the message, in configuration order.
+        :rtype: list of int
+        """
+        matching_remappings = []
+        for time_key, (segment_starts, segment_remappings) in self._segments.items():
+            if time_key not in td:
+                continue
+
+            # The timestamp is parsed once, however many remappings there are for this time key.
+            time = _to_epoch_microseconds(timestamps.parse(td[time_key]))
+            last_matching_remapping = -1
+            while True:
+                segment = bisect_right(segment_starts, time) - 1
+                if segment < 0:
+                    break
+
+                # Find the next remapping in this segment after the last one which applied.
+                candidate_remappings = segment_remappings[segment]
+                next_candidate = bisect_right(candidate_remappings, last_matching_remapping)
+                if next_candidate == len(candidate_remappings):
+                    break
+
+                last_matching_remapping = candidate_remappings[next_candidate]
+                matching_remappings.append(last_matching_remapping)
+                if self._adjusted_times[last_matching_remapping] is not None:
+                    time = self._adjusted_times[last_matching_remapping]
+
+        # Remappings of different time keys are independent, except that the last one to apply sets the show.
+        return sorted(matching_remappings)
+
+    def get_adjusted_time_string(self, remapping_index):
+        """
+        :return: The ISO string to adjust the time key of messages to when the remapping with the given index applies,
+                 or None if the remapping doesn't adjust timestamps.
+        :rtype: str | None
+        """
+        return self._adjusted_time_strings[remapping_index]
 
-        log.info(f"Remapped {remapped_count} messages to show {show_pipeline_key_to_remap_to}")
 
+class TranslateSourceKeys(object):
     @classmethod
-    def remap_radio_shows(cls, user, data, pipeline_configuration):
+    def set_show_id(cls, td, remappings):
         """
-        Remaps radio shows which were in the wrong flow, and therefore have the wrong key/values set, to have the
-        key/values they would have had if they had been received by the correct flow.
+        Sets a show pipeline key for a message, using the presence of source keys to determine which show the message
+        belongs to.
 
-        :param user: Identifier of the user running this program, for TracedData Metadata.
-        :type user: str
-        :param data: TracedData objects to move the radio show messages in.
-        :type data: iterable of TracedData
-        :param pipeline_configuration: Pipeline configuration.
-        :type pipeline_configuration: PipelineConfiguration
+        :param td: Message to set the show id of.
+        :type td: _PendingTranslation
+        :param remappings: Source key remappings.
+        :type remappings: _CompiledSourceKeyRemappings
         """
-        for remapping in pipeline_configuration.timestamp_remappings:
-            cls._remap_radio_show_by_time_range(
-                user, data, remapping.time_key, remapping.show_pipeline_key_to_remap_to,
-                remapping.range_start_inclusive, remapping.range_end_exclusive, remapping.time_to_adjust_to
-            )
+        show_dict = dict()
+
+        for source_key in td.keys_in(remappings.activation_pipeline_keys):
+            if td[source_key] is None:
+                continue
+
+            for pipeline_key in remappings.activation_pipeline_keys[source_key]:
+                assert "rqa_message" not in show_dict
+                show_dict["rqa_message"] = td[source_key]
+                show_dict["show_pipeline_key"] = pipeline_key
+
+        td.append_data(show_dict)
 
     @classmethod
-    def remap_key_names(cls, user, data, pipeline_configuration):
+    def remap_radio_show(cls, td, timestamp_remappings, remapped_counts):
         """
-        Remaps key names.
-        
-        :param user: Identifier of the user running this program, for TracedData Metadata.
-        :type user: str
-        :param data: TracedData objects to remap the key names of.
-        :type data: iterable of TracedData
-        :param pipeline_configuration: Pipeline configuration.
-        :type pipeline_configuration: PipelineConfiguration
+        Remaps a radio show message received in the time range of any of the configured timestamp remappings to
+        another radio show, applying the remappings in the order they are configured.
+
+        Optionally adjusts the datetime of re-mapped messages to a constant.
+
+        :param td: Message to remap.
+        :type td: _PendingTranslation
+        :param timestamp_remappings: Timestamp remappings.
+        :type timestamp_remappings: _TimestampRemappingIndex
+        :param remapped_counts: Number of messages remapped by each of the timestamp remappings so far. This is
+                                updated with the remappings of this message.
+        :type remapped_counts: list of int
         """
-        for td in data:
-            old_keys = set()
-            remapped = dict()
+        for i in timestamp_remappings.get_matching_remappings(td):
+            remapping = timestamp_remappings.timestamp_remappings[i]
+            remapped_counts[i] += 1
 
-            for remapping in pipeline_configuration.source_key_remappings:
-                if remapping.is_activation_message:
-                    continue
+            remapped = {
+                "show_pipeline_key": remapping.show_pipeline_key_to_remap_to
+            }
+            adjusted_time_string = timestamp_remappings.get_adjusted_time_string(i)
+            if adjusted_time_string is not None:
+                remapped[remapping.time_key] = adjusted_time_string
+
+            td.append_data(remapped)
 
-                source_key = remapping.source_key
-                pipeline_key = remapping.pipeline_key
-                
-                if source_key in td and pipeline_key not in td:
-                    old_keys.add(source_key)
+    @classmethod
+    def remap_key_names(cls, td, remappings):
+        """
+        Remaps key names.
 
-                    # Some "old keys" translate to the same new key. This is sometimes desirable, for example if we ask
-                    # the same demog question to the same person in multiple places, we should take take their
-                    # newest response. However, if their newest response is "null" in the more recent data source,
-                    # taking the newest response would cause loss of some valuable responses. This check ensures we
-                    # are taking the most recent response, unless the most response is "null" and there was a more
-                    # substantive response in the past.
-                    if td[source_key] is None and remapped.get(pipeline_key) is not None:
-                        continue
+        :param td: Message to remap the key names of.
+        :type td: _PendingTranslation
+        :param remappings: Source key remappings.
+        :type remappings: _CompiledSourceKeyRemappings
+        """
+        old_keys = set()
+        remapped = dict()
+
+        # Apply the remappings of the source keys in this message in the order they are configured, because where
+        # more than one source key remaps to the same pipeline key, later remappings take precedence.
+        matching_remappings = sorted(
+            (precedence, source_key, pipeline_key)
+            for source_key in td.keys_in(remappings.pipeline_keys)
+            for precedence, pipeline_key in remappings.pipeline_keys[source_key]
+        )
+        for _, source_key, pipeline_key in matching_remappings:
+            if pipeline_key not in td:
+                old_keys.add(source_key)
+
+                # Some "old keys" translate to the same new key. This is sometimes desirable, for example if we ask
+                # the same demog question to the same person in multiple places, we should take take their
+                # newest response. However, if their newest response is "null" in the more recent data source,
+                # taking the newest response would cause loss of some valuable responses. This check ensures we
+                # are taking the most recent response, unless the most response is "null" and there was a more
+                # substantive response in the past.
+                if td[source_key] is None and remapped.get(pipeline_key) is not None:
+                    continue
 
-                    remapped[pipeline_key] = td[source_key]
+                remapped[pipeline_key] = td[source_key]
 
-            td.hide_keys(old_keys, Metadata(user, Metadata.get_call_location(), TimeUtils.utc_now_as_iso_string()))
-            td.append_data(remapped, Metadata(user, Metadata.get_call_location(), TimeUtils.utc_now_as_iso_string()))
+        td.hide_keys(old_keys)
+        td.append_data(remapped)
 
     @classmethod
-    def set_rqa_raw_keys_from_show_ids(cls, user, data):
+    def set_rqa_raw_key_from_show_id(cls, td):
         """
         Despite the earlier phases of this pipeline stage using a common 'rqa_message' field and then a
         'show_pipeline_key' field to identify which radio show a message belonged to, the rest of the pipeline still
         uses the presence of a raw field for each show to determine which show a message belongs to.
         This function translates from the new 'show_id' method back to the old 'raw field presence` method.
-        
+
         TODO: Update the rest of the pipeline to use show_ids, and/or perform remapping before combining the datasets.
 
-        :param user: Identifier of the user running this program, for TracedData Metadata.
-        :type user: str
-        :param data: TracedData objects to set raw radio show message fields for.
-        :type data: iterable of TracedData
+        :param td: Message to set the raw radio show message field for.
+        :type td: _PendingTranslation
         """
-        for td in data:
-            if "show_pipeline_key" in td:
-                td.append_data({td["show_pipeline_key"]: td["rqa_message"]},
-                               Metadata(user, Metadata.get_call_location(), TimeUtils.utc_now_as_iso_string()))
+        if "show_pipeline_key" in td:
+            td.append_data({td["show_pipeline_key"]: td["rqa_message"]})
 
     @classmethod
-    def hide_null_messages(cls, user, data):
+    def hide_null_messages(cls, td):
         """
-        Hides messages which were null.
+        Hides a message's null messages.
 
-        :param user: Identifier of the user running this program, for TracedData Metadata.
-        :type user: str
-        :param data: TracedData objects to search for null messages in and hide.
-        :type data: iterable of TracedData
+        :param td: Message to search for null messages in and hide.
+        :type td: _PendingTranslation
         """
-        for td in data:
-            null_keys = set()
-            for plan in PipelineConfiguration.RQA_CODING_PLANS + PipelineConfiguration.SURVEY_CODING_PLANS:
-                if plan.raw_field in td and td[plan.raw_field] is None:
-                    null_keys.update({plan.raw_field, plan.time_field})
-            td.hide_keys(null_keys, Metadata(user, Metadata.get_call_location(), TimeUtils.utc_now_as_iso_string()))
+        null_keys = set()
+        for plan in PipelineConfiguration.RQA_CODING_PLANS + PipelineConfiguration.SURVEY_CODING_PLANS:
+            if plan.raw_field in td and td[plan.raw_field] is None:
+                null_keys.update({plan.raw_field, plan.time_field})
+        td.hide_keys(null_keys)
 
     @classmethod
     def translate_source_keys(cls, user, data, pipeline_configuration):
         """
         Remaps the keys of rqa messages in the wrong dataset into the correct one, and remaps all source keys to
         more usable keys that can be used by the rest of the pipeline.
-        
+
+        All the translation steps are applied to each message in turn, in a single pass over the data, and each
+        message's translation is committed as at most two TracedData updates (one to hide keys and one to set them),
+        rather than one update per step.
+
         TODO: Break this function such that the show remapping phase happens in one class, and the source remapping
               in another?
         """
-        # Set the show pipeline key for each message, using the presence of source keys in the TracedData.
-        # These are necessary in order to be able to remap radio shows and key names separately (because data
-        # can't be 'deleted' from TracedData).
-        cls.set_show_ids(user, data, pipeline_configuration)
+        source_key_remappings = _CompiledSourceKeyRemappings(pipeline_configuration.source_key_remappings)
+        timestamp_remappings = _TimestampRemappingIndex(pipeline_configuration.timestamp_remappings)
+        remapped_counts = [0] * len(pipeline_configuration.timestamp_remappings)
+        updates_count = 0
+        for td in data:
+            pending = _PendingTranslation(td)
+
+            # Set the show pipeline key for each message, using the presence of source keys in the TracedData.
+            # These are necessary in order to be able to remap radio shows and key names separately (because data
+            # can't be 'deleted' from TracedData).
+            cls.set_show_id(pending, source_key_remappings)
+
+            # Move rqa messages which ended up in the wrong flow to the correct one.
+            cls.remap_radio_show(pending, timestamp_remappings, remapped_counts)
+
+            # Remap the keys used by the data sources to more usable names that will be used by the rest of the
+            # pipeline.
+            cls.remap_key_names(pending, source_key_remappings)
 
-        # Move rqa messages which ended up in the wrong flow to the correct one.
-        cls.remap_radio_shows(user, data, pipeline_configuration)
+            # Convert from the new show key format to the raw field format still used by the rest of the pipeline.
+            cls.set_rqa_raw_key_from_show_id(pending)
 
-        # Remap the keys used by the data sources to more usable names that will be used by the rest of the pipeline.
-        cls.remap_key_names(user, data, pipeline_configuration)
+            # Some Text inputs from Rapid Pro sources can be null. We don't know why, but there's no useful messages in
+            # those cases so hide them (which means the rest of the pipeline will treat those as NA).
+            cls.hide_null_messages(pending)
 
-        # Convert from the new show key format to the raw field format still used by the rest of the pipeline.
-        cls.set_rqa_raw_keys_from_show_ids(user, data)
+            updates_count += pending.commit(user)
 
-        # Some Text inputs from Rapid Pro sources can be null. We don't know why, but there's no useful messages in
-        # those cases so hide them (which means the rest of the pipeline will treat those as NA).
-        cls.hide_null_messages(user, data)
+        for remapping, remapped_count in zip(pipeline_configuration.timestamp_remappings, remapped_counts):
+            log.info(f"Remapped {remapped_count} messages in time range "
+                     f"{remapping.range_start_inclusive.isoformat()} to {remapping.range_end_exclusive.isoformat()} "
+                     f"to show {remapping.show_pipeline_key_to_remap_to}")
+        log.info(f"Translated the source keys of {len(data)} messages with {updates_count} TracedData updates")
 
         return data
@@ -0,0 +1,110 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from src.lib.bucket_downloads import BlobDownloadManager, LocalDirectoryBucket
+
+
+class _CountingBucket(LocalDirectoryBucket):
+    def __init__(self, root_dir):
+        super().__init__(root_dir)
+        self.downloaded_blob_urls = []
+
+    def download_blob_to_file(self, blob_url, version, f):
+        self.downloaded_blob_urls.append(blob_url)
+        super().download_blob_to_file(blob_url, version, f)
+
+
+class TestBlobDownloadManager(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.bucket_dir = f"{self.test_dir}/bucket"
+        self.local_dir = f"{self.test_dir}/local"
+        self.manifest_path = f"{self.local_dir}/manifest.json"
+        self.bucket = _CountingBucket(self.bucket_dir)
+
+        self.blob_urls_to_local_paths = dict()
+        for i in range(3):
+            self._write_blob(f"blob_{i}.csv", f"contents {i}", mtime_ns=1)
+            self.blob_urls_to_local_paths[f"gs://test-bucket/blob_{i}.csv"] = f"{self.local_dir}/blob_{i}.csv"
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def _write_blob(self, name, contents, mtime_ns):
+        path = f"{self.bucket_dir}/test-bucket/{name}"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(contents)
+        # LocalDirectoryBucket uses the modification time as the blob's generation, so set it explicitly rather than
+        # relying on the file system's timestamp resolution.
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+    def _download(self, max_concurrent_downloads=1):
+        self.bucket.downloaded_blob_urls = []
+        BlobDownloadManager(self.bucket, self.manifest_path, max_concurrent_downloads).download(
+            self.blob_urls_to_local_paths)
+        return sorted(self.bucket.downloaded_blob_urls)
+
+    def _read_local(self, i):
+        with open(f"{self.local_dir}/blob_{i}.csv") as f:
+            return f.read()
+
+    def test_download_all_then_none(self):
+        self.assertEqual(self._download(), sorted(self.blob_urls_to_local_paths))
+        for i in range(3):
+            self.assertEqual(self._read_local(i), f"contents {i}")
+
+        with open(self.manifest_path) as f:
+            manifest = json.load(f)
+        self.assertEqual(set(manifest), set(self.blob_urls_to_local_paths))
+        self.assertEqual(manifest["gs://test-bucket/blob_0.csv"]["LocalPath"], f"{self.local_dir}/blob_0.csv")
+
+        # Nothing changed, so nothing is downloaded again.
+        self.assertEqual(self._download(), [])
+
+    def test_changed_blob_is_downloaded_again(self):
+        self._download()
+
+        self._write_blob("blob_1.csv", "new contents", mtime_ns=2)
+        self.assertEqual(self._download(), ["gs://test-bucket/blob_1.csv"])
+        self.assertEqual(self._read_local(1), "new contents")
+
+    def test_new_generation_with_same_contents_is_downloaded_again(self):
+        self._download()
+
+        # A new generation invalidates the manifest entry even if the contents didn't change.
+        self._write_blob("blob_2.csv", "contents 2", mtime_ns=2)
+        self.assertEqual(self._download(), ["gs://test-bucket/blob_2.csv"])
+
+    def test_missing_local_file_is_downloaded_again(self):
+        self._download()
+
+        os.remove(f"{self.local_dir}/blob_0.csv")
+        self.assertEqual(self._download(), ["gs://test-bucket/blob_0.csv"])
+        self.assertEqual(self._read_local(0), "contents 0")
+
+    def test_files_downloaded_before_the_manifest(self):
+        # Files which were downloaded before the manifest existed are only downloaded again if they are out of date.
+        os.makedirs(self.local_dir)
+        with open(f"{self.local_dir}/blob_0.csv", "w") as f:
+            f.write("contents 0")
+        with open(f"{self.local_dir}/blob_1.csv", "w") as f:
+            f.write("out of date contents")
+
+        self.assertEqual(self._download(), ["gs://test-bucket/blob_1.csv", "gs://test-bucket/blob_2.csv"])
+        self.assertEqual(self._read_local(1), "contents 1")
+
+        with open(self.manifest_path) as f:
+            self.assertEqual(set(json.load(f)), set(self.blob_urls_to_local_paths))
+        self.assertEqual(self._download(), [])
+
+    def test_concurrent_downloads(self):
+        self.assertEqual(self._download(max_concurrent_downloads=3), sorted(self.blob_urls_to_local_paths))
+        for i in range(3):
+            self.assertEqual(self._read_local(i), f"contents {i}")
+        self.assertFalse(any(path.endswith(".tmp") for path in os.listdir(self.local_dir)))
+
+        self.assertEqual(self._download(max_concurrent_downloads=3), [])
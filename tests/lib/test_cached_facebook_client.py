@@ -0,0 +1,54 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from src.lib.cached_facebook_client import CachedFacebookClient
+
+_START = datetime(2021, 1, 1, tzinfo=timezone.utc)
+
+
+def _time(days):
+    return _START + timedelta(days=days)
+
+
+class _FakeFacebookClient(object):
+    def __init__(self, posts):
+        self.posts = posts
+        self.searched_ranges = []
+
+    def get_posts_published_by_page(self, page_id, fields=None, created_after=None, created_before=None):
+        self.searched_ranges.append((created_after, created_before))
+        posts = [post for post in self.posts
+                 if CachedFacebookClient.is_created_in_range(post, created_after, created_before)]
+        return sorted(posts, key=lambda post: post["created_time"], reverse=True)
+
+
+class TestCachedFacebookClient(unittest.TestCase):
+    def setUp(self):
+        # One post at the start of each day.
+        self.posts = [{"id": f"post-{day}", "created_time": _time(day).isoformat()} for day in range(10)]
+
+    def test_is_created_in_range(self):
+        post = {"id": "post", "created_time": _time(1).isoformat()}
+
+        self.assertTrue(CachedFacebookClient.is_created_in_range(post, _time(1), _time(2)))
+        self.assertFalse(CachedFacebookClient.is_created_in_range(post, _time(0), _time(1)))
+        self.assertTrue(CachedFacebookClient.is_created_in_range(post))
+
+    def test_cached_search_matches_uncached_at_range_edges(self):
+        facebook = _FakeFacebookClient(self.posts)
+        cached_facebook = CachedFacebookClient(facebook)
+
+        cached_facebook.get_posts_published_by_page("page", created_after=_time(2), created_before=_time(5))
+        cached_facebook.get_posts_published_by_page("page", created_after=_time(4), created_before=_time(8))
+
+        # This range is served from the cache, and starts and ends exactly on posts.
+        posts = cached_facebook.get_posts_published_by_page("page", created_after=_time(3), created_before=_time(7))
+        self.assertEqual(
+            [post["id"] for post in posts],
+            [post["id"] for post in _FakeFacebookClient(self.posts).get_posts_published_by_page(
+                "page", created_after=_time(3), created_before=_time(7))]
+        )
+        self.assertEqual([post["id"] for post in posts], ["post-6", "post-5", "post-4", "post-3"])
+
+        # Only the part of the second range which wasn't covered by the first was requested from Facebook.
+        self.assertEqual(facebook.searched_ranges, [(_time(2), _time(5)), (_time(5), _time(8))])
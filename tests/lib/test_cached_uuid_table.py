@@ -0,0 +1,104 @@
+import shutil
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from src.lib.cached_uuid_table import CachedUuidTable
+from src.lib.local_uuid_table import LocalUuidTable
+
+
+class _CountingUuidTable(LocalUuidTable):
+    def __init__(self, uuid_prefix):
+        super().__init__(uuid_prefix)
+        self.requested_data = []
+        self.requested_uuids = []
+
+    def data_to_uuid_batch(self, list_of_data):
+        self.requested_data.extend(list_of_data)
+        return super().data_to_uuid_batch(list_of_data)
+
+    def uuid_to_data_batch(self, uuids):
+        self.requested_uuids.extend(uuids)
+        return super().uuid_to_data_batch(uuids)
+
+
+class TestCachedUuidTable(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache_path = f"{self.cache_dir}/uuid_table_cache.sqlite"
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_miss_then_hit(self):
+        uuid_table = _CountingUuidTable("avf-phone-uuid-")
+        cached_table = CachedUuidTable(uuid_table, "phone", self.cache_path)
+
+        data_to_uuid = cached_table.data_to_uuid_batch(["+254700000001", "+254700000002"])
+        self.assertEqual(sorted(uuid_table.requested_data), ["+254700000001", "+254700000002"])
+
+        # Only the data which missed the cache is requested from the wrapped table.
+        self.assertEqual(cached_table.data_to_uuid_batch(["+254700000001", "+254700000003"])["+254700000001"],
+                         data_to_uuid["+254700000001"])
+        self.assertEqual(sorted(uuid_table.requested_data), ["+254700000001", "+254700000002", "+254700000003"])
+        self.assertEqual((cached_table.hits, cached_table.misses), (1, 3))
+
+        # Mappings cached by data are also served when looking up by uuid.
+        self.assertEqual(cached_table.uuid_to_data(data_to_uuid["+254700000002"]), "+254700000002")
+        self.assertEqual(uuid_table.requested_uuids, [])
+        cached_table.close()
+
+    def test_uuid_lookups_are_cached(self):
+        uuid_table = _CountingUuidTable("avf-phone-uuid-")
+        uuid = uuid_table.data_to_uuid("+254700000001")
+        cached_table = CachedUuidTable(uuid_table, "phone", self.cache_path)
+
+        self.assertEqual(cached_table.uuid_to_data(uuid), "+254700000001")
+        self.assertEqual(cached_table.uuid_to_data(uuid), "+254700000001")
+        self.assertEqual(uuid_table.requested_uuids, [uuid])
+        self.assertEqual(cached_table.data_to_uuid("+254700000001"), uuid)
+        self.assertEqual(uuid_table.requested_data, ["+254700000001"])
+        cached_table.close()
+
+    def test_cache_persists_between_runs(self):
+        uuid_table = _CountingUuidTable("avf-phone-uuid-")
+        cached_table = CachedUuidTable(uuid_table, "phone", self.cache_path)
+        uuid = cached_table.data_to_uuid("+254700000001")
+        cached_table.close()
+
+        next_run_uuid_table = _CountingUuidTable("avf-phone-uuid-")
+        next_run_cached_table = CachedUuidTable(next_run_uuid_table, "phone", self.cache_path)
+        self.assertEqual(next_run_cached_table.data_to_uuid("+254700000001"), uuid)
+        self.assertEqual(next_run_uuid_table.requested_data, [])
+        next_run_cached_table.close()
+
+    def test_tables_are_cached_separately(self):
+        phone_table = CachedUuidTable(_CountingUuidTable("avf-phone-uuid-"), "phone", self.cache_path)
+        facebook_uuid_table = _CountingUuidTable("avf-facebook-uuid-")
+        facebook_table = CachedUuidTable(facebook_uuid_table, "facebook", self.cache_path)
+
+        phone_table.data_to_uuid("12345")
+        self.assertTrue(facebook_table.data_to_uuid("12345").startswith("avf-facebook-uuid-"))
+        self.assertEqual(facebook_uuid_table.requested_data, ["12345"])
+        phone_table.close()
+        facebook_table.close()
+
+    def test_misses_are_fetched_concurrently(self):
+        # Each lookup waits in the wrapped table until both lookups are there, which only happens if the cache doesn't
+        # hold its lock while requesting misses.
+        barrier = threading.Barrier(2, timeout=10)
+
+        class _BlockingUuidTable(LocalUuidTable):
+            def data_to_uuid_batch(self, list_of_data):
+                barrier.wait()
+                return super().data_to_uuid_batch(list_of_data)
+
+        cached_table = CachedUuidTable(_BlockingUuidTable("avf-phone-uuid-"), "phone", self.cache_path)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            lookups = [executor.submit(cached_table.data_to_uuid, data) for data in ["+254700000001", "+254700000002"]]
+            uuids = [lookup.result() for lookup in lookups]
+
+        self.assertEqual(cached_table.data_to_uuid_batch(["+254700000001", "+254700000002"]),
+                         {"+254700000001": uuids[0], "+254700000002": uuids[1]})
+        cached_table.close()
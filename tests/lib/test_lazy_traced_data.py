@@ -0,0 +1,111 @@
+import pickle
+import unittest
+from io import StringIO
+from unittest import mock
+
+from core_data_modules.traced_data import Metadata, TracedData
+from core_data_modules.traced_data.io import TracedDataJsonIO
+
+from src.lib.lazy_traced_data import LazyTracedData, _DELEGATED_METHODS
+
+
+def _metadata():
+    return Metadata("test_user", Metadata.get_call_location(), "2021-01-01T00:00:00+00:00")
+
+
+class TestLazyTracedData(unittest.TestCase):
+    PROJECTED_KEYS = frozenset({"uid", "rqa_s01e01_raw", "sent_on", "missing"})
+
+    def setUp(self):
+        td = TracedData({"uid": "avf-phone-uuid-1", "rqa_s01e01_raw": "hello", "sent_on": "2021-01-01T10:00:00+03:00",
+                         "unprojected": "a"}, _metadata())
+        td.append_data({"rqa_s01e01_raw": "hello again", "unprojected": "b"}, _metadata())
+
+        f = StringIO()
+        TracedDataJsonIO.export_traced_data_iterable_to_jsonl([td], f)
+        self.line = f.getvalue()
+
+    def _load(self):
+        return LazyTracedData.from_jsonl_line(self.line, self.PROJECTED_KEYS)
+
+    def _eager(self):
+        return TracedDataJsonIO.import_jsonl_to_traced_data_iterable(StringIO(self.line))[0]
+
+    def test_is_traced_data(self):
+        self.assertIsInstance(self._load(), TracedData)
+
+    def test_projection_matches_decoded(self):
+        td = self._load()
+        if isinstance(td, LazyTracedData):
+            self.assertTrue(td.projection_matches_decoded())
+
+    def test_projected_reads_dont_materialise(self):
+        td = self._load()
+        if not isinstance(td, LazyTracedData):
+            self.skipTest("TracedData JSONL format can't be projected")
+
+        self.assertEqual(td["rqa_s01e01_raw"], "hello again")
+        self.assertEqual(td.get("missing", "default"), "default")
+        self.assertNotIn("missing", td)
+        self.assertFalse(td.is_materialised())
+
+        self.assertEqual(td["unprojected"], "b")
+        self.assertTrue(td.is_materialised())
+
+    def test_updates_match_eager(self):
+        def update(td):
+            td.append_data({"rqa_s01e01_coded": "code"}, _metadata())
+            td.hide_keys({"sent_on"}, _metadata())
+            td.append_traced_data("survey", TracedData({"gender_raw": "f"}, _metadata()), _metadata())
+            return [td.get("rqa_s01e01_coded"), "sent_on" in td, td.get("uid")]
+
+        lazy = self._load()
+        eager = self._eager()
+        self.assertEqual(update(lazy), update(eager))
+        self.assertEqual(dict(lazy.items()), dict(eager.items()))
+
+    def test_pickle_round_trip(self):
+        td = pickle.loads(pickle.dumps(self._load()))
+
+        self.assertEqual(td["uid"], "avf-phone-uuid-1")
+        self.assertEqual(dict(td.items()), dict(self._eager().items()))
+
+    def test_projection_of_updated_traced_data_matches_decoded(self):
+        # Round-trip TracedData which have had keys hidden and other TracedData appended to them, including keys which
+        # were hidden and then set again.
+        hidden = TracedData({"uid": "avf-phone-uuid-2", "rqa_s01e01_raw": "hello", "sent_on": "2021-01-02"},
+                            _metadata())
+        hidden.hide_keys({"rqa_s01e01_raw", "sent_on"}, _metadata())
+        hidden.append_data({"sent_on": "2021-01-03"}, _metadata())
+
+        appended = TracedData({"uid": "avf-phone-uuid-3", "rqa_s01e01_raw": "hello"}, _metadata())
+        appended.append_traced_data("survey", TracedData({"rqa_s01e01_raw": "survey", "missing": "m"}, _metadata()),
+                                    _metadata())
+
+        hidden_after_append = TracedData({"uid": "avf-phone-uuid-4", "sent_on": "2021-01-04"}, _metadata())
+        hidden_after_append.append_traced_data("survey", TracedData({"rqa_s01e01_raw": "survey"}, _metadata()),
+                                               _metadata())
+        hidden_after_append.hide_keys({"rqa_s01e01_raw"}, _metadata())
+
+        f = StringIO()
+        TracedDataJsonIO.export_traced_data_iterable_to_jsonl([hidden, appended, hidden_after_append], f)
+        for line in f.getvalue().splitlines(keepends=True):
+            td = LazyTracedData.from_jsonl_line(line, self.PROJECTED_KEYS)
+            eager = TracedDataJsonIO.import_jsonl_to_traced_data_iterable(StringIO(line))[0]
+
+            self.assertEqual({key: td[key] for key in self.PROJECTED_KEYS if key in td},
+                             {key: eager[key] for key in self.PROJECTED_KEYS if key in eager})
+            if isinstance(td, LazyTracedData):
+                self.assertTrue(td.projection_matches_decoded())
+
+    def test_delegated_methods_run_on_materialised(self):
+        td = self._load()
+        if not isinstance(td, LazyTracedData):
+            self.skipTest("TracedData JSONL format can't be projected")
+
+        materialised = mock.Mock()
+        with mock.patch.object(td, "materialise", return_value=materialised):
+            for method_name in _DELEGATED_METHODS:
+                self.assertIs(getattr(td, method_name)("arg", kwarg="kwarg"),
+                              getattr(materialised, method_name).return_value)
+                getattr(materialised, method_name).assert_called_once_with("arg", kwarg="kwarg")
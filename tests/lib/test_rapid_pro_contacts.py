@@ -0,0 +1,23 @@
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from src.lib.rapid_pro_contacts import ContactsSnapshot, ContactsStore
+
+
+class TestContactsSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.db_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.db_dir)
+
+    def test_with_block_closes_store(self):
+        store = ContactsStore(f"{self.db_dir}/contacts.sqlite")
+        with ContactsSnapshot(store) as snapshot:
+            self.assertEqual(len(snapshot), 0)
+            self.assertNotIn("contact-a", snapshot)
+
+        with self.assertRaises(sqlite3.ProgrammingError):
+            len(store)
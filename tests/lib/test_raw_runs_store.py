@@ -0,0 +1,45 @@
+import unittest
+from types import SimpleNamespace
+
+from src.lib.raw_runs_store import RawRunsStore
+
+
+def _run(run_id, version):
+    # merge_runs only depends on each run's id.
+    return SimpleNamespace(id=run_id, version=version)
+
+
+class TestRawRunsStore(unittest.TestCase):
+    def test_merge_runs(self):
+        runs = [_run(1, "a"), _run(2, "a"), _run(3, "a")]
+        new_runs = [_run(4, "a"), _run(2, "b"), _run(5, "a"), _run(1, "b")]
+
+        merged = RawRunsStore.merge_runs(runs, new_runs)
+
+        # Updated runs keep their original positions, and new runs are added to the end in the order they were given.
+        self.assertEqual([(run.id, run.version) for run in merged],
+                         [(1, "b"), (2, "b"), (3, "a"), (4, "a"), (5, "a")])
+
+    def test_merge_runs_repeated_updates(self):
+        merged = RawRunsStore.merge_runs([_run(1, "a"), _run(2, "a")], [_run(1, "b"), _run(1, "c")])
+
+        self.assertEqual([(run.id, run.version) for run in merged], [(1, "c"), (2, "a")])
+
+    def test_merge_runs_matches_load_order(self):
+        # Merging one fetch's runs at a time gives the same order as merging every stored version at once, which is
+        # how load_runs reads the store.
+        fetches = [
+            [_run(1, "a"), _run(2, "a")],
+            [_run(2, "b"), _run(3, "a")],
+            [_run(1, "b"), _run(4, "a"), _run(3, "b")]
+        ]
+
+        incrementally_merged = []
+        for fetch in fetches:
+            incrementally_merged = RawRunsStore.merge_runs(incrementally_merged, fetch)
+        merged_at_once = RawRunsStore.merge_runs([], [run for fetch in fetches for run in fetch])
+
+        self.assertEqual([(run.id, run.version) for run in incrementally_merged],
+                         [(run.id, run.version) for run in merged_at_once])
+        self.assertEqual([(run.id, run.version) for run in merged_at_once],
+                         [(1, "b"), (2, "b"), (3, "b"), (4, "a")])
@@ -0,0 +1,73 @@
+import json
+import shutil
+import tempfile
+import unittest
+
+from src.lib.traced_data_conversion_cache import TracedDataConversionCache
+
+
+class TestTracedDataConversionCache(unittest.TestCase):
+    def setUp(self):
+        self.raw_data_dir = tempfile.mkdtemp()
+        self.keys = [(1, "2021-01-01T00:00:00+00:00", "2021-01-01T00:00:00+00:00"),
+                         (2, "2021-01-02T00:00:00+00:00", None),
+                         (3, "2021-01-03T00:00:00+00:00", "2021-01-01T00:00:00+00:00")]
+        # The second run has no TracedData e.g. because it was from a test contact.
+        self.lines = ['{"run": 1}\n', None, '{"run": 3}\n']
+
+    def tearDown(self):
+        shutil.rmtree(self.raw_data_dir)
+
+    def _cache(self, fingerprint=None, compression=None):
+        if fingerprint is None:
+            fingerprint = {"TestContactUUIDs": ["test-contact"]}
+        return TracedDataConversionCache(self.raw_data_dir, "flow", fingerprint, compression)
+
+    def test_load_without_previous_export(self):
+        self.assertEqual(self._cache().load(), dict())
+
+    def test_save_then_load(self):
+        self._cache().save(self.keys, self.lines)
+
+        with open(f"{self.raw_data_dir}/flow.jsonl") as f:
+            self.assertEqual(f.read(), '{"run": 1}\n{"run": 3}\n')
+        self.assertEqual(self._cache().load(), dict(zip(self.keys, self.lines)))
+
+    def test_save_then_load_compressed(self):
+        self._cache(compression="gzip").save(self.keys, self.lines)
+
+        self.assertEqual(self._cache(compression="gzip").load(), dict(zip(self.keys, self.lines)))
+
+    def test_changed_run_misses(self):
+        self._cache().save(self.keys, self.lines)
+
+        # A run is only re-used if its key, which includes its and its contact's modified_on, is unchanged.
+        cached_lines = self._cache().load()
+        self.assertNotIn((1, "2021-01-05T00:00:00+00:00", "2021-01-01T00:00:00+00:00"), cached_lines)
+        self.assertNotIn((3, "2021-01-03T00:00:00+00:00", "2021-01-05T00:00:00+00:00"), cached_lines)
+        self.assertIn(self.keys[0], cached_lines)
+
+    def test_fingerprint_change_invalidates(self):
+        self._cache().save(self.keys, self.lines)
+
+        self.assertEqual(self._cache({"TestContactUUIDs": ["other-test-contact"]}).load(), dict())
+
+    def test_version_change_invalidates(self):
+        self._cache().save(self.keys, self.lines)
+
+        with open(f"{self.raw_data_dir}/flow_traced_data_index.json") as f:
+            index = json.load(f)
+        index["Fingerprint"]["Version"] = TracedDataConversionCache.VERSION - 1
+        with open(f"{self.raw_data_dir}/flow_traced_data_index.json", "w") as f:
+            json.dump(index, f)
+
+        self.assertEqual(self._cache().load(), dict())
+
+    def test_modified_traced_data_file_invalidates(self):
+        self._cache().save(self.keys, self.lines)
+
+        # The index no longer describes the TracedData file if something else rewrote it.
+        with open(f"{self.raw_data_dir}/flow.jsonl", "a") as f:
+            f.write('{"run": 4}\n')
+
+        self.assertEqual(self._cache().load(), dict())
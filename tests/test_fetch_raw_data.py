@@ -0,0 +1,61 @@
+import unittest
+from types import SimpleNamespace
+
+from fetch_raw_data import convert_runs_to_traced_data_by_run_id
+
+
+def _run(run_id, contact_uuid):
+    return SimpleNamespace(id=run_id, contact=SimpleNamespace(uuid=contact_uuid))
+
+
+class _FakeContactsSnapshot(object):
+    def __init__(self, contact_uuids):
+        self.contact_uuids = set(contact_uuids)
+
+    def preload(self, contact_uuids):
+        pass
+
+    def __contains__(self, contact_uuid):
+        return contact_uuid in self.contact_uuids
+
+    def contacts_for_runs(self, runs):
+        return [SimpleNamespace(uuid=run.contact.uuid) for run in runs if run.contact.uuid in self.contact_uuids]
+
+
+class _FakeRapidProClient(object):
+    def __init__(self):
+        self.conversions = []
+
+    def convert_runs_to_traced_data(self, user, raw_runs, raw_contacts, phone_number_uuid_table, test_contact_uuids):
+        # Like RapidProClient, skip runs by test contacts and runs whose contact isn't given.
+        self.conversions.append([run.id for run in raw_runs])
+        contact_uuids = {contact.uuid for contact in raw_contacts}
+        return [f"traced run {run.id}" for run in raw_runs
+                if run.contact.uuid not in test_contact_uuids and run.contact.uuid in contact_uuids]
+
+
+class TestConvertRunsToTracedDataByRunId(unittest.TestCase):
+    def test_skipped_runs(self):
+        rapid_pro = _FakeRapidProClient()
+        runs = [_run(1, "contact-a"), _run(2, "test-contact"), _run(3, "deleted-contact"), _run(4, "contact-b"),
+                _run(5, "contact-a")]
+
+        converted_runs = convert_runs_to_traced_data_by_run_id(
+            "user", rapid_pro, runs, _FakeContactsSnapshot(["contact-a", "contact-b", "test-contact"]), None,
+            ["test-contact"])
+
+        self.assertEqual(converted_runs, {
+            1: "traced run 1", 2: None, 3: None, 4: "traced run 4", 5: "traced run 5"
+        })
+        # All the runs which can be converted are converted in a single batch.
+        self.assertEqual(rapid_pro.conversions, [[1, 4, 5]])
+
+    def test_no_runs_to_convert(self):
+        rapid_pro = _FakeRapidProClient()
+
+        converted_runs = convert_runs_to_traced_data_by_run_id(
+            "user", rapid_pro, [_run(1, "test-contact")], _FakeContactsSnapshot(["test-contact"]), None,
+            ["test-contact"])
+
+        self.assertEqual(converted_runs, {1: None})
+        self.assertEqual(rapid_pro.conversions, [])
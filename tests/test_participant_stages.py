@@ -0,0 +1,74 @@
+import random
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from src.participant_stages import ParticipantStages
+
+
+def _translate_source_keys(user, data, pipeline_configuration):
+    return data
+
+
+def _filter_empty_messages(data, raw_fields):
+    return [td for td in data if td["text"] is not None]
+
+
+def _move_wrong_scheme_messages(user, data, prev_coded_dir_path):
+    # Like WSCorrection, output new messages grouped by participant in order of each participant's first message,
+    # sometimes adding a message for a moved response.
+    data_grouped_by_uid = dict()
+    for td in data:
+        data_grouped_by_uid.setdefault(td["uid"], []).append(td)
+
+    corrected_data = []
+    for group in data_grouped_by_uid.values():
+        corrected_data.extend(dict(td) for td in group)
+        if group[0]["moved"]:
+            corrected_data.append({**group[0], "text": f"moved {group[0]['text']}"})
+    return corrected_data
+
+
+def _auto_code_messages(user, data, pipeline_configuration):
+    return [td for td in data if not td["text"].endswith("noise")]
+
+
+class TestParticipantStages(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(0)
+        self.data = []
+        for i in range(500):
+            self.data.append({
+                "uid": f"avf-phone-uuid-{rng.randrange(40)}",
+                "text": rng.choice([None, f"message {i}", f"message {i} noise"]),
+                "moved": rng.random() < 0.2
+            })
+
+        patches = [
+            mock.patch("src.participant_stages.PipelineConfiguration", SimpleNamespace(RQA_CODING_PLANS=[])),
+            mock.patch("src.participant_stages.TranslateSourceKeys.translate_source_keys", _translate_source_keys),
+            mock.patch("src.participant_stages.MessageFilters.filter_empty_messages", _filter_empty_messages),
+            mock.patch("src.participant_stages.WSCorrection.move_wrong_scheme_messages", _move_wrong_scheme_messages),
+            mock.patch("src.participant_stages.AutoCode.auto_code_messages", _auto_code_messages)
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def _assert_sharded_matches_serial(self, pipeline_configuration):
+        serial_output = ParticipantStages.run("test_user", [dict(td) for td in self.data], pipeline_configuration,
+                                              None)
+
+        for shards in [1, 2, 7]:
+            # Run each shard in this process, so that the stages can be faked.
+            keyed_shards = ParticipantStages.partition([dict(td) for td in self.data], shards)
+            keyed_outputs = [ParticipantStages.run_keyed("test_user", keyed_shard, pipeline_configuration, None)
+                             for keyed_shard in keyed_shards]
+            self.assertEqual(ParticipantStages.merge(keyed_outputs), serial_output)
+
+    def test_sharded_matches_serial(self):
+        self._assert_sharded_matches_serial(SimpleNamespace(move_ws_messages=True))
+
+    def test_sharded_matches_serial_without_ws_correction(self):
+        self.data = [td for td in self.data if td["text"] is not None]
+        self._assert_sharded_matches_serial(SimpleNamespace(move_ws_messages=False))
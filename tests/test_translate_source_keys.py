@@ -0,0 +1,198 @@
+import random
+import unittest
+from datetime import datetime, timedelta
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
+
+import pytz
+from core_data_modules.traced_data import Metadata, TracedData
+from core_data_modules.traced_data.io import TracedDataJsonIO
+from dateutil.parser import isoparse
+
+from src.lib.lazy_traced_data import LazyTracedData
+from src.translate_source_keys import TranslateSourceKeys
+
+_RQA_CODING_PLANS = [SimpleNamespace(raw_field="rqa_s01e01_raw", time_field="sent_on"),
+                     SimpleNamespace(raw_field="rqa_s01e02_raw", time_field="sent_on")]
+_SURVEY_CODING_PLANS = [SimpleNamespace(raw_field="gender_raw", time_field="gender_time"),
+                        SimpleNamespace(raw_field="age_raw", time_field="age_time")]
+
+_SOURCE_KEY_REMAPPINGS = [
+    SimpleNamespace(is_activation_message=True, source_key="Rqa_S01E01 (Text) - s01e01_activation",
+                    pipeline_key="rqa_s01e01_raw"),
+    SimpleNamespace(is_activation_message=True, source_key="Rqa_S01E02 (Text) - s01e02_activation",
+                    pipeline_key="rqa_s01e02_raw"),
+    SimpleNamespace(is_activation_message=False, source_key="Gender (Text) - demog", pipeline_key="gender_raw"),
+    SimpleNamespace(is_activation_message=False, source_key="Gender (Text) - follow_up", pipeline_key="gender_raw"),
+    SimpleNamespace(is_activation_message=False, source_key="Gender (Time) - demog", pipeline_key="gender_time"),
+    SimpleNamespace(is_activation_message=False, source_key="Age (Text) - demog", pipeline_key="age_raw"),
+    SimpleNamespace(is_activation_message=False, source_key="Rqa_S01E01 (Time) - s01e01_activation",
+                    pipeline_key="sent_on")
+]
+
+_PROJECTED_KEYS = frozenset(
+    {"uid", "sent_on", "rqa_message", "show_pipeline_key", "gender_time", "age_time"} |
+    {remapping.source_key for remapping in _SOURCE_KEY_REMAPPINGS} |
+    {remapping.pipeline_key for remapping in _SOURCE_KEY_REMAPPINGS}
+)
+
+_T0 = pytz.utc.localize(datetime(2021, 1, 1))
+
+
+def _reference_translate_source_keys(message, pipeline_configuration):
+    """
+    Translates the source keys of a message given as a dict, by applying each of the original steps of source key
+    translation in turn, and returns the translated message.
+    """
+    message = dict(message)
+
+    # Set the show ids.
+    show = dict()
+    for remapping in pipeline_configuration.source_key_remappings:
+        if remapping.is_activation_message and message.get(remapping.source_key) is not None:
+            assert "rqa_message" not in show
+            show = {"rqa_message": message[remapping.source_key], "show_pipeline_key": remapping.pipeline_key}
+    message.update(show)
+
+    # Remap radio shows by time range, in configuration order.
+    for remapping in pipeline_configuration.timestamp_remappings:
+        if remapping.time_key in message and \
+                remapping.range_start_inclusive <= isoparse(message[remapping.time_key]) < \
+                remapping.range_end_exclusive:
+            message["show_pipeline_key"] = remapping.show_pipeline_key_to_remap_to
+            if remapping.time_to_adjust_to is not None:
+                message[remapping.time_key] = remapping.time_to_adjust_to.isoformat()
+
+    # Remap key names. Later remappings to the same pipeline key take precedence, unless they are null.
+    old_keys = set()
+    remapped = dict()
+    for remapping in pipeline_configuration.source_key_remappings:
+        if remapping.is_activation_message:
+            continue
+        if remapping.source_key in message and remapping.pipeline_key not in message:
+            old_keys.add(remapping.source_key)
+            if message[remapping.source_key] is None and remapped.get(remapping.pipeline_key) is not None:
+                continue
+            remapped[remapping.pipeline_key] = message[remapping.source_key]
+    for key in old_keys:
+        del message[key]
+    message.update(remapped)
+
+    # Set the raw field of each message's show.
+    if "show_pipeline_key" in message:
+        message[message["show_pipeline_key"]] = message["rqa_message"]
+
+    # Hide null messages.
+    for plan in _RQA_CODING_PLANS + _SURVEY_CODING_PLANS:
+        if plan.raw_field in message and message[plan.raw_field] is None:
+            message.pop(plan.raw_field)
+            message.pop(plan.time_field, None)
+
+    return message
+
+
+def _random_pipeline_configuration(rng):
+    timestamp_remappings = []
+    for _ in range(rng.randrange(0, 6)):
+        range_start_days = rng.randrange(-1, 10)
+        time_to_adjust_to_days = rng.choice([None, None, rng.randrange(-1, 11)])
+        timestamp_remappings.append(SimpleNamespace(
+            time_key=rng.choice(["sent_on", "gender_time"]),
+            show_pipeline_key_to_remap_to=rng.choice(["rqa_s01e01_raw", "rqa_s01e02_raw"]),
+            range_start_inclusive=_T0 + timedelta(days=range_start_days),
+            range_end_exclusive=_T0 + timedelta(days=range_start_days + rng.randrange(1, 6)),
+            time_to_adjust_to=None if time_to_adjust_to_days is None else _T0 + timedelta(days=time_to_adjust_to_days)
+        ))
+
+    return SimpleNamespace(source_key_remappings=_SOURCE_KEY_REMAPPINGS, timestamp_remappings=timestamp_remappings)
+
+
+def _random_message(rng, i):
+    message = {"uid": f"avf-phone-uuid-{i}"}
+    message[rng.choice(["Rqa_S01E01 (Text) - s01e01_activation", "Rqa_S01E02 (Text) - s01e02_activation"])] = \
+        "message" if rng.random() < 0.98 else None
+    if rng.random() < 0.9:
+        message["Rqa_S01E01 (Time) - s01e01_activation"] = (_T0 + timedelta(days=rng.randrange(10))).isoformat()
+    if rng.random() < 0.7:
+        message["sent_on"] = (_T0 + timedelta(days=rng.randrange(-2, 12), hours=rng.randrange(24))).isoformat()
+    if rng.random() < 0.5:
+        message["gender_time"] = (_T0 + timedelta(days=rng.randrange(-2, 12))).isoformat()
+    if rng.random() < 0.3:
+        message["Gender (Time) - demog"] = (_T0 + timedelta(days=rng.randrange(10))).isoformat()
+    for key in ["Gender (Text) - demog", "Gender (Text) - follow_up", "Age (Text) - demog", "gender_raw"]:
+        if rng.random() < 0.4:
+            message[key] = rng.choice(["woman", None, "man"])
+    return message
+
+
+class _CountingTracedData(TracedData):
+    def __init__(self, data, metadata):
+        super().__init__(data, metadata)
+        self.updates_count = 0
+
+    def append_data(self, new_data, new_metadata):
+        self.updates_count += 1
+        return super().append_data(new_data, new_metadata)
+
+    def hide_keys(self, keys, new_metadata):
+        self.updates_count += 1
+        return super().hide_keys(keys, new_metadata)
+
+
+class TestTranslateSourceKeys(unittest.TestCase):
+    TRIALS = 200
+    MESSAGES_PER_TRIAL = 25
+
+    def setUp(self):
+        patch = mock.patch("src.translate_source_keys.PipelineConfiguration", SimpleNamespace(
+            RQA_CODING_PLANS=_RQA_CODING_PLANS, SURVEY_CODING_PLANS=_SURVEY_CODING_PLANS))
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    @staticmethod
+    def _metadata():
+        return Metadata("test_user", Metadata.get_call_location(), "2021-01-01T00:00:00+00:00")
+
+    def _trials(self):
+        for trial in range(self.TRIALS):
+            rng = random.Random(trial)
+            pipeline_configuration = _random_pipeline_configuration(rng)
+            messages = [_random_message(rng, i) for i in range(self.MESSAGES_PER_TRIAL)]
+            try:
+                expected = [_reference_translate_source_keys(message, pipeline_configuration) for message in messages]
+            except KeyError:
+                # e.g. a null activation message was remapped to a show, so has a show but no 'rqa_message'.
+                expected = KeyError
+            yield trial, pipeline_configuration, messages, expected
+
+    def test_matches_reference(self):
+        for trial, pipeline_configuration, messages, expected in self._trials():
+            data = [_CountingTracedData(message, self._metadata()) for message in messages]
+            if expected is KeyError:
+                with self.assertRaises(KeyError, msg=f"trial {trial}"):
+                    TranslateSourceKeys.translate_source_keys("test_user", data, pipeline_configuration)
+                continue
+
+            TranslateSourceKeys.translate_source_keys("test_user", data, pipeline_configuration)
+            self.assertEqual([dict(td.items()) for td in data], expected, f"trial {trial}")
+            # Each message is updated at most twice: one `hide_keys` and one `append_data`.
+            self.assertLessEqual(max(td.updates_count for td in data), 2, f"trial {trial}")
+
+    def test_lazily_loaded_matches_reference(self):
+        for trial, pipeline_configuration, messages, expected in self._trials():
+            f = StringIO()
+            TracedDataJsonIO.export_traced_data_iterable_to_jsonl(
+                [TracedData(message, self._metadata()) for message in messages], f)
+            data = [LazyTracedData.from_jsonl_line(line, _PROJECTED_KEYS)
+                    for line in f.getvalue().splitlines(keepends=True)]
+            if expected is KeyError:
+                with self.assertRaises(KeyError, msg=f"trial {trial}"):
+                    TranslateSourceKeys.translate_source_keys("test_user", data, pipeline_configuration)
+                continue
+
+            TranslateSourceKeys.translate_source_keys("test_user", data, pipeline_configuration)
+            # Translation only reads projected keys, so doesn't need to decode the lazily loaded messages.
+            self.assertFalse(any(isinstance(td, LazyTracedData) and td.is_materialised() for td in data),
+                             f"trial {trial}")
+            self.assertEqual([dict(td.items()) for td in data], expected, f"trial {trial}")